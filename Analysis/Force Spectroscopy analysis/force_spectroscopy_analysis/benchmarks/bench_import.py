@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__doc__ = """\
+Benchmarks of the start-up of a new process using foldometer: the time to import the package or the parts of it that a
+headless worker needs, and the number of modules and the resident memory it ends up with. Each repetition runs in a new
+interpreter, so nothing is already imported
+"""
+
+import subprocess
+import sys
+
+
+#Statements run in the new interpreter, from the cheapest to the whole analysis
+IMPORT_STATEMENTS = ["import foldometer",
+                     "from foldometer.ixo.binary import read_file",
+                     "from foldometer.ixo.data_conversion import process_data",
+                     "import foldometer; foldometer.Folding",
+                     "import foldometer.tools.plots"]
+
+
+def imported_state(statement):
+    """
+    Function to run an import statement in a new interpreter and get the modules and memory of the process afterwards
+
+    Args:
+        statement (str): Python statement to run
+
+    Returns:
+        modules (int): number of modules loaded
+        rss (int): resident memory of the process in bytes
+    """
+
+    code = "{}\nimport sys\nmodules = len(sys.modules)\nfrom foldometer.tools.profiling import resident_memory\n" \
+           "print(modules, resident_memory())".format(statement)
+    modules, rss = subprocess.check_output([sys.executable, "-c", code]).split()
+
+    return int(modules), int(rss)
+
+
+class ImportTime(object):
+    """
+    Start-up of a process importing foldometer, for each of the statements in IMPORT_STATEMENTS
+    """
+
+    params = IMPORT_STATEMENTS
+    param_names = ["statement"]
+    repeat = 10
+
+    def timeraw_import(self, statement):
+        return statement
+
+    def track_imported_modules(self, statement):
+        return imported_state(statement)[0]
+
+    track_imported_modules.unit = "modules"
+
+    def track_import_rss(self, statement):
+        return imported_state(statement)[1]
+
+    track_import_rss.unit = "bytes"
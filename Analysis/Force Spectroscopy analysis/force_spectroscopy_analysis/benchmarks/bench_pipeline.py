@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__doc__ = """\
+Benchmarks of each stage of the analysis of a pulling measurement (see foldometer.Folding), on synthetic measurements of
+the sizes in common.SIZES. For every stage, time_* measures the duration and track_peakmem_* the peak of the memory
+allocated by the stage. The set-up runs the previous stages, so each repetition starts from the same state
+"""
+
+from .common import SIZES, EVENT_WINDOW, EVENT_THRESHOLD, TRACKING_HALF_WIDTH, measurement_files, folding_at_stage, \
+    peak_memory
+from foldometer.ixo.binary import read_file
+from foldometer.ixo.lumicks_c_trap import read_data_file_lumicks, FD_COMPACT_CHANNELS
+from foldometer.simulate.measurement import KYMOGRAPH_PIXELS
+from foldometer.analysis.thermal_calibration import calibration_data
+from foldometer.core.main import Folding
+
+
+class StageBenchmark(object):
+    """
+    Base of the benchmarks of a stage: one parameter, the number of samples, and a single call per repetition
+    """
+
+    params = SIZES
+    param_names = ["samples"]
+    number = 1
+    repeat = (1, 5, 60)
+    timeout = 3600
+    unit = "bytes"
+
+    def setup(self, samples):
+        self.files = measurement_files(samples)
+
+
+class ReadFile(StageBenchmark):
+
+    def time_read_file(self, samples):
+        read_file(self.files["binary"])
+
+    def track_peakmem_read_file(self, samples):
+        return peak_memory(read_file, self.files["binary"])
+
+
+class ReadDataFileLumicks(StageBenchmark):
+
+    def time_read_data_file_lumicks(self, samples):
+        read_data_file_lumicks(self.files["tdms"], channels=FD_COMPACT_CHANNELS)
+
+    def track_peakmem_read_data_file_lumicks(self, samples):
+        return peak_memory(read_data_file_lumicks, self.files["tdms"], channels=FD_COMPACT_CHANNELS)
+
+
+class CalibrationData(StageBenchmark):
+
+    def setup(self, samples):
+        self.header, self.calibrationFit, self.rawData = read_file(measurement_files(samples)["binary"],
+                                                                   mode="calibration")[:3]
+
+    def time_calibration_data(self, samples):
+        calibration_data(self.rawData, self.header, self.calibrationFit, plot=False)
+
+    def track_peakmem_calibration_data(self, samples):
+        return peak_memory(calibration_data, self.rawData, self.header, self.calibrationFit, plot=False)
+
+
+class ProcessData(StageBenchmark):
+
+    def setup(self, samples):
+        self.measurement = folding_at_stage(samples, "process_data")
+
+    def time_process_data(self, samples):
+        self.measurement.process_data()
+
+    def track_peakmem_process_data(self, samples):
+        return peak_memory(self.measurement.process_data)
+
+
+class AssignRegions(StageBenchmark):
+
+    def setup(self, samples):
+        self.measurement = folding_at_stage(samples, "assign_regions")
+
+    def time_assign_regions(self, samples):
+        self.measurement.assign_regions()
+
+    def track_peakmem_assign_regions(self, samples):
+        return peak_memory(self.measurement.assign_regions)
+
+
+class RemoveDrift(StageBenchmark):
+
+    def setup(self, samples):
+        self.measurement = Folding(measurement_files(samples)["binary"])
+        #the middle of the trap positions as the reference of every cycle
+        self.reference = tuple(self.measurement.rawData["MirrorX"].quantile([0.4, 0.6]))
+
+    def time_remove_drift(self, samples):
+        self.measurement.remove_drift(reference=self.reference, plot=False)
+
+    def track_peakmem_remove_drift(self, samples):
+        return peak_memory(self.measurement.remove_drift, reference=self.reference, plot=False)
+
+
+class FindUnfoldingEvents(StageBenchmark):
+
+    def setup(self, samples):
+        self.measurement = folding_at_stage(samples, "find_unfolding_events")
+
+    def time_find_unfolding_events(self, samples):
+        self.measurement.find_unfolding_events(rollingWindow=EVENT_WINDOW, unfoldingThreshold=EVENT_THRESHOLD)
+
+    def track_peakmem_find_unfolding_events(self, samples):
+        return peak_memory(self.measurement.find_unfolding_events, rollingWindow=EVENT_WINDOW,
+                           unfoldingThreshold=EVENT_THRESHOLD)
+
+
+class FitWLC(StageBenchmark):
+
+    def setup(self, samples):
+        self.measurement = folding_at_stage(samples, "fit_wlc")
+
+    def time_fit_wlc(self, samples):
+        self.measurement.fit_wlc(*self.measurement.timeInterval)
+
+    def track_peakmem_fit_wlc(self, samples):
+        return peak_memory(self.measurement.fit_wlc, *self.measurement.timeInterval)
+
+
+class CalculateProteinContourLength(StageBenchmark):
+
+    def setup(self, samples):
+        self.measurement = folding_at_stage(samples, "calculate_protein_contour_length")
+
+    def time_calculate_protein_contour_length(self, samples):
+        self.measurement.calculate_protein_contour_length()
+
+    def track_peakmem_calculate_protein_contour_length(self, samples):
+        return peak_memory(self.measurement.calculate_protein_contour_length)
+
+
+class AlignFluorescence(StageBenchmark):
+
+    def setup(self, samples):
+        self.measurement = folding_at_stage(samples, "align_fluorescence")
+        self.lineEdges = (KYMOGRAPH_PIXELS // 2 - TRACKING_HALF_WIDTH, KYMOGRAPH_PIXELS // 2 + TRACKING_HALF_WIDTH)
+
+    def time_align_fluorescence(self, samples):
+        self.measurement.align_fluorescence(lineEdges=self.lineEdges)
+
+    def track_peakmem_align_fluorescence(self, samples):
+        return peak_memory(self.measurement.align_fluorescence, lineEdges=self.lineEdges)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__doc__ = """\
+Shared set-up of the benchmarks: synthetic measurements of several sizes (see foldometer.simulate.measurement), written
+once in a folder that is reused between runs, and Folding instances brought up to the stage before the benchmarked one
+"""
+
+import matplotlib
+matplotlib.use("Agg")
+
+from foldometer.core.main import Folding
+from foldometer.analysis.wlc_curve_fit import identify_individual_curves
+from foldometer.simulate.measurement import generate_measurement_files, read_ground_truth, synthetic_kymograph, \
+    tether_separation, KYMOGRAPH_TIME_RESOLUTION, FORCE_RANGE, PULLING_SPEED, STATIONARY_TIME, SAMPLE_FREQUENCY
+from foldometer.tools.cache import set_cache
+import numpy as np
+import tracemalloc
+import tempfile
+import warnings
+import os
+
+
+#Number of samples of the benchmarked measurements, "1e5,1e6" in FOLDOMETER_BENCHMARK_SIZES runs only the small ones
+SIZES = [int(float(size)) for size in os.environ.get("FOLDOMETER_BENCHMARK_SIZES", "1e5,1e6,1e7").split(",")]
+BENCHMARK_DIRECTORY = os.environ.get("FOLDOMETER_BENCHMARK_DIR",
+                                     os.path.join(tempfile.gettempdir(), "foldometer-benchmarks"))
+SEED = 0
+DOMAINS = 1
+PROTEIN = "MBP"
+#Unfolding events are searched in 50 ms windows, as in Folding.analyse_data()
+EVENT_WINDOW = SAMPLE_FREQUENCY // 20
+EVENT_THRESHOLD = 2
+#Window of the kymograph where the bead is tracked, around the center of the lines
+TRACKING_HALF_WIDTH = 10
+#Delay of the synthetic kymograph with respect to the force data, in [s]
+FLUORESCENCE_OFFSET = 1
+
+#Every stage has to be computed, not loaded from the cache of a previous repetition
+set_cache(False)
+warnings.simplefilter("ignore")
+
+
+def cycles_for_samples(samples):
+    """
+    Function to calculate the number of pulling cycles of the default protocol that give a measurement of (about) a
+    number of samples
+
+    Args:
+        samples (int): number of samples
+
+    Returns:
+        cycles (int): number of pulling cycles, at least 1
+    """
+
+    minTrapSep, maxTrapSep = tether_separation(np.asarray(FORCE_RANGE, dtype=float))
+    cycleSamples = 2 * round(STATIONARY_TIME * SAMPLE_FREQUENCY) + \
+        2 * round((maxTrapSep - minTrapSep) / PULLING_SPEED * SAMPLE_FREQUENCY)
+
+    return max(1, int(round(samples / cycleSamples)))
+
+
+def measurement_files(samples):
+    """
+    Function to get the files of the synthetic measurement of a given size, writing them the first time
+
+    Args:
+        samples (int): number of samples of the measurement
+
+    Returns:
+        files (dict): paths of the files, see generate_measurement_files()
+    """
+
+    folder = os.path.join(BENCHMARK_DIRECTORY, "{:.0e}".format(samples))
+    name = "benchmark{}".format(SEED)
+    files = {"binary": os.path.join(folder, name + ".dat"),
+             "truth": os.path.join(folder, name)}
+    if not os.path.isfile(files["truth"] + "_truth.json"):
+        generate_measurement_files(folder, name, protein=PROTEIN, cycles=cycles_for_samples(samples),
+                                   domains=DOMAINS, seed=SEED)
+    files["tdms"] = [os.path.join(folder, fileName) for fileName in os.listdir(folder)
+                     if fileName.endswith("001-001.tdms")][0]
+
+    return files
+
+
+def folding_at_stage(samples, stage):
+    """
+    Function to read a synthetic measurement and run the analysis up to (not including) a stage
+
+    Args:
+        samples (int): number of samples of the measurement
+        stage (str): one of "process_data", "assign_regions", "find_unfolding_events", "fit_wlc",
+            "calculate_protein_contour_length" or "align_fluorescence"
+
+    Returns:
+        measurement (foldometer.Folding): measurement ready for the stage
+    """
+
+    stages = ["process_data", "assign_regions", "find_unfolding_events", "fit_wlc",
+              "calculate_protein_contour_length", "align_fluorescence"]
+    files = measurement_files(samples)
+    measurement = Folding(files["binary"])
+    for previousStage in stages[:stages.index(stage)]:
+        if previousStage == "process_data":
+            measurement.process_data()
+        elif previousStage == "assign_regions":
+            measurement.assign_regions()
+        elif previousStage == "find_unfolding_events":
+            measurement.find_unfolding_events(rollingWindow=EVENT_WINDOW, unfoldingThreshold=EVENT_THRESHOLD)
+            identify_individual_curves(measurement.own_stage("data"))
+        elif previousStage == "fit_wlc":
+            measurement.fit_wlc(*measurement.timeInterval)
+        elif previousStage == "calculate_protein_contour_length":
+            measurement.calculate_protein_contour_length()
+
+    if stage == "align_fluorescence":
+        truth = read_ground_truth(files["truth"])[0]
+        measurement.fluoTimeRes = KYMOGRAPH_TIME_RESOLUTION
+        measurement.fluoData = {"532nm": synthetic_kymograph(truth, measurement.fluoTimeRes,
+                                                                       timeOffset=FLUORESCENCE_OFFSET, seed=SEED)}
+
+    return measurement
+
+
+def peak_memory(function, *args, **kwargs):
+    """
+    Function to measure the peak of the memory allocated while calling a function. Only the allocations traced by
+    tracemalloc are counted (Python objects and numpy arrays), and not the memory allocated before the call
+
+    Args:
+        function (function): function to be called
+        *args: positional arguments of the function
+        **kwargs: keyword arguments of the function
+
+    Returns:
+        peak (int): peak of the allocated memory in bytes
+    """
+
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return peak
@@ -17,20 +17,41 @@ __version__ = (0, 0, 1)
 # This has to be declared before any foldometer imports
 _ROOT = os.path.abspath(os.path.dirname(__file__))
 
-from .ixo.binary import read_file
-from .ixo.lumicks_c_trap import lumicks_file
-from .ixo.data_conversion import process_file, analyse_file
-
-from . import physics
-from .simulate.trap import simulate_trap
-from .tools.plots import force_extension_curve, plot_xcorr
-from .tools.maths import cross_correlation
-
-from .analysis.thermal_calibration import calibration_file, calibration_data
-from .analysis.region_classification import assign_regions
-from .analysis.event_classification import find_unfolding_events
-from .analysis.wlc_curve_fit import wlc_fit_data
-from .analysis.tweezers_parameters import MIRRORVOLTDISTANCEFACTOR
-
-from .core.main import Folding
-from .core.subclasses import Thread, LifeTimeMeasurement
+from .tools.lazy import lazy_attributes
+
+#The names of the package are imported when first used (see foldometer.tools.lazy), so that importing foldometer or
+#one of its modules does not load the plotting and fitting dependencies of the rest of the package
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "read_file": ".ixo.binary:read_file",
+    "read_time_window": ".ixo.binary:read_time_window",
+    "lumicks_file": ".ixo.lumicks_c_trap:lumicks_file",
+    "process_file": ".ixo.data_conversion:process_file",
+    "analyse_file": ".ixo.data_conversion:analyse_file",
+
+    "simulate_trap": ".simulate.trap:simulate_trap",
+    "simulate_traps": ".simulate.trap:simulate_traps",
+    "generate_measurement_files": ".simulate.measurement:generate_measurement_files",
+    "read_ground_truth": ".simulate.measurement:read_ground_truth",
+    "force_extension_curve": ".tools.plots:force_extension_curve",
+    "plot_xcorr": ".tools.plots:plot_xcorr",
+    "cross_correlation": ".tools.maths:cross_correlation",
+
+    "calibration_file": ".analysis.thermal_calibration:calibration_file",
+    "calibration_data": ".analysis.thermal_calibration:calibration_data",
+    "calibration_files": ".analysis.thermal_calibration:calibration_files",
+    "assign_regions": ".analysis.region_classification:assign_regions",
+    "find_unfolding_events": ".analysis.event_classification:find_unfolding_events",
+    "wlc_fit_data": ".analysis.wlc_curve_fit:wlc_fit_data",
+    "MIRRORVOLTDISTANCEFACTOR": ".analysis.tweezers_parameters:MIRRORVOLTDISTANCEFACTOR",
+
+    "Folding": ".core.main:Folding",
+    "Thread": ".core.subclasses:Thread",
+    "LifeTimeMeasurement": ".core.subclasses:LifeTimeMeasurement",
+
+    "analysis": ".analysis",
+    "core": ".core",
+    "ixo": ".ixo",
+    "physics": ".physics",
+    "simulate": ".simulate",
+    "tools": ".tools",
+})
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__doc__ = """\
+Removal of the drift of the PSD signals between pulling cycles, without plotting or user input. In a reference part of
+the data (a range of the trap position where the signal should be the same in every cycle) the signal of each cycle
+is fitted with a polynomial of the trap position (a constant by default). The drift of a cycle is the difference
+between its fit and the fit of the first cycle of its region, and the regions are then aligned to a reference region.
+All the cycles are fitted and corrected at once, from the sums of each (region, cycle) group.
+
+Example:
+    >>> from foldometer.analysis.drift import remove_drift_cycles, plot_drift
+    >>> corrected, coefficients = remove_drift_cycles(data, reference=(-0.2, 0.1), variable="MirrorX", degree=1)
+    >>> plot_drift(data, corrected)
+    >>> data[corrected.columns] = corrected
+"""
+
+from foldometer.tools.schema import region_codes, region_categorical
+from collections import OrderedDict as od
+from scipy.special import comb
+import pandas as pd
+import numpy as np
+
+
+#Signals corrected, and regions whose cycles are corrected (aligned to the first one of the list)
+DRIFT_CHANNELS = ["PSD1VxDiff", "PSD2VxDiff"]
+DRIFT_REGIONS = ["pulling", "retracting"]
+
+
+def reference_mask(data, reference, variable="trapSepX"):
+    """
+    Function to get the data points of the reference part of the data
+
+    Args:
+        data (pandas.DataFrame): data with the columns region, pullingCycle and variable
+        reference: (minimum, maximum) of the variable, as a tuple or a list of two numbers (like the parameters
+            loaded from JSON), index labels of the reference data points (like the index of a selection made with
+            foldometer.tools.misc.data_selection()) or boolean mask of the data points
+        variable (str): column of the range given as reference
+
+    Returns:
+        mask (numpy.ndarray): True for the data points of the reference
+    """
+
+    if isinstance(reference, (tuple, list)) and len(reference) == 2 and \
+            all(isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_))
+                for value in reference):
+        return ((data[variable] >= min(reference)) & (data[variable] <= max(reference))).values
+    if isinstance(reference, tuple):
+        raise ValueError("A reference range should be (minimum, maximum) of " + variable + ", not " + str(reference))
+    if isinstance(reference, (pd.Series, np.ndarray)) and reference.dtype == bool:
+        return np.asarray(reference)
+
+    return data.index.isin(reference)
+
+
+def _group_keys(data, cycles):
+    """
+    Function to number the (region, pulling cycle) group of each data point
+
+    Args:
+        data (pandas.DataFrame): data with the columns region and pullingCycle
+        cycles (int): number larger than all the pulling cycles
+
+    Returns:
+        keys (numpy.ndarray): region code (see foldometer.tools.schema) * cycles + pulling cycle of each data point
+    """
+
+    return region_codes(data["region"]).astype(np.int64) * cycles + data["pullingCycle"].values.astype(np.int64)
+
+
+def fit_drift(data, reference, channels=DRIFT_CHANNELS, variable="trapSepX", degree=0, regions=DRIFT_REGIONS):
+    """
+    Function to fit the signals of each pulling cycle in the reference part of the data. All the groups (region and
+    cycle) are fitted at once by least squares, from the sums of the powers of the variable in each group
+
+    Args:
+        data (pandas.DataFrame): data with the columns region, pullingCycle, the channels and the variable
+        reference: reference part of the data, see reference_mask()
+        channels (list): signals to fit
+        variable (str): column used as the x of the polynomials
+        degree (int): degree of the polynomials. 0 (default) fits the mean of the reference of each cycle
+        regions (list): regions whose cycles are fitted
+
+    Returns:
+        coefficients (pandas.DataFrame): one row per region, cycle and channel with the number of reference points and
+        the coefficients of the polynomial (coefficient0 + coefficient1 * x + ...)
+    """
+
+    mask = reference_mask(data, reference, variable) & data["region"].isin(regions).values & \
+        data["pullingCycle"].notna().values
+    referenceData = data.loc[mask]
+    cycles = int(data["pullingCycle"].max()) + 1 if len(referenceData) else 1
+    groups, groupPositions = np.unique(_group_keys(referenceData, cycles), return_inverse=True)
+
+    #the variable is centred and scaled to keep the sums of its powers of the same order
+    x = referenceData[variable].values.astype(float)
+    centre = x.mean() if len(x) else 0.
+    scale = x.std() if len(x) and x.std() > 0 else 1.
+    x = (x - centre) / scale
+    powers = np.vstack([x ** power for power in range(2 * degree + 1)])
+    sums = np.vstack([np.bincount(groupPositions, weights=powers[power], minlength=len(groups))
+                      for power in range(2 * degree + 1)]).T
+    normalMatrices = sums[:, np.add.outer(np.arange(degree + 1), np.arange(degree + 1))]
+    pseudoInverses = np.linalg.pinv(normalMatrices)
+    #the coefficients of the scaled variable are converted to coefficients of the variable
+    conversion = np.array([[comb(power, lower) * (-centre) ** (power - lower) / scale ** power if power >= lower else 0.
+                            for power in range(degree + 1)] for lower in range(degree + 1)])
+
+    coefficients = []
+    for channel in channels:
+        y = referenceData[channel].values.astype(float)
+        moments = np.vstack([np.bincount(groupPositions, weights=powers[power] * y, minlength=len(groups))
+                             for power in range(degree + 1)]).T
+        scaledCoefficients = np.einsum("gij,gj->gi", pseudoInverses, moments)
+        channelCoefficients = pd.DataFrame(scaledCoefficients @ conversion.T,
+                                           columns=["coefficient{}".format(power) for power in range(degree + 1)])
+        channelCoefficients.insert(0, "points", sums[:, 0].astype(int))
+        channelCoefficients.insert(0, "channel", channel)
+        channelCoefficients.insert(0, "pullingCycle", groups % cycles)
+        channelCoefficients.insert(0, "region", region_categorical(groups // cycles))
+        coefficients.append(channelCoefficients)
+
+    return pd.concat(coefficients, ignore_index=True)
+
+
+def evaluate_polynomials(coefficients, x):
+    """
+    Function to evaluate a different polynomial at each point
+
+    Args:
+        coefficients (numpy.ndarray): coefficients of the polynomial of each point, one column per power
+        x (numpy.ndarray): value of the variable at each point
+
+    Returns:
+        values (numpy.ndarray): value of the polynomial of each point
+    """
+
+    values = np.zeros(len(x))
+    for power in range(coefficients.shape[1] - 1, -1, -1):
+        values = values * x + coefficients[:, power]
+
+    return values
+
+
+def remove_drift_cycles(data, reference, channels=DRIFT_CHANNELS, variable="trapSepX", degree=0,
+                        regions=DRIFT_REGIONS, referenceRegion="pulling"):
+    """
+    Function to remove the drift of the signals between pulling cycles: the fit of the reference part of each cycle
+    (see fit_drift()) minus the fit of the first cycle of its region is subtracted from the whole cycle. Then the
+    difference between the mean reference of each region and the one of referenceRegion is subtracted from the region.
+    The cycles without reference points are not corrected
+
+    Args:
+        data (pandas.DataFrame): data with the columns region, pullingCycle, the channels and the variable
+        reference: reference part of the data, see reference_mask()
+        channels (list): signals to correct
+        variable (str): column used as the x of the polynomials
+        degree (int): degree of the polynomials. 0 (default) corrects the offset of each cycle
+        regions (list): regions whose cycles are corrected
+        referenceRegion (str): region the other regions are aligned to. None does not align the regions
+
+    :returns: * **corrected** (pandas.DataFrame) -- corrected channels, with the index of the data
+              * **coefficients** (pandas.DataFrame) -- coefficients of the fit of each region, cycle and channel (see
+                fit_drift()), with the drift subtracted from the cycle (drift0 + drift1 * x + ...) and the offset
+                subtracted from its region (regionOffset)
+    """
+
+    coefficients = fit_drift(data, reference, channels, variable, degree, regions)
+    powerColumns = ["coefficient{}".format(power) for power in range(degree + 1)]
+    driftColumns = ["drift{}".format(power) for power in range(degree + 1)]
+    firstCycles = coefficients.groupby(["region", "channel"], observed=True)["pullingCycle"].transform("min")
+    firstCoefficients = coefficients.merge(coefficients.loc[coefficients["pullingCycle"] == firstCycles],
+                                           on=["region", "channel"], how="left", suffixes=("", "First"))
+    coefficients[driftColumns] = coefficients[powerColumns].values - \
+        firstCoefficients[[column + "First" for column in powerColumns]].values
+    coefficients["regionOffset"] = 0.
+
+    mask = reference_mask(data, reference, variable)
+    cycles = int(coefficients["pullingCycle"].max()) + 1 if len(coefficients) else 1
+    keys = _group_keys(data, cycles)
+    x = data[variable].values.astype(float)
+    corrected = od()
+    for channel in channels:
+        channelCoefficients = coefficients.loc[coefficients["channel"] == channel]
+        channelKeys = _group_keys(channelCoefficients, cycles)
+        order = np.argsort(channelKeys)
+        positions = np.minimum(np.searchsorted(channelKeys[order], keys), max(len(order) - 1, 0))
+        found = (channelKeys[order][positions] == keys) if len(order) else np.zeros(len(keys), dtype=bool)
+        rows = order[positions]
+        drift = np.zeros(len(data))
+        drift[found] = evaluate_polynomials(channelCoefficients[driftColumns].values[rows[found]], x[found])
+        values = data[channel].values - drift
+
+        if referenceRegion is not None:
+            referenceMean = values[mask & (data["region"] == referenceRegion).values].mean()
+            for region in regions:
+                if region == referenceRegion:
+                    continue
+                regionMask = (data["region"] == region).values
+                offset = values[mask & regionMask].mean() - referenceMean
+                if np.isfinite(offset):
+                    values = np.where(regionMask, values - offset, values)
+                    coefficients.loc[(coefficients["channel"] == channel) & (coefficients["region"] == region),
+                                     "regionOffset"] = offset
+        corrected[channel] = values
+
+    return pd.DataFrame(corrected, index=data.index), coefficients
+
+
+def plot_drift(data, corrected, channels=DRIFT_CHANNELS, variable="trapSepX"):
+    """
+    Function to plot the signal of the two PSDs (half the difference of the two channels) against the variable, before
+    (blue) and after (red) the drift removal
+
+    Args:
+        data (pandas.DataFrame): data before the drift removal
+        corrected (pandas.DataFrame): corrected channels, see remove_drift_cycles()
+        channels (list): the two channels of the signal
+        variable (str): column in the x axis
+    """
+
+    import matplotlib.pyplot as plt
+
+    plt.plot(data[variable], (data[channels[0]] - data[channels[1]]) / 2, color="blue")
+    plt.plot(data[variable], (corrected[channels[0]] - corrected[channels[1]]) / 2, color="red")
+    plt.show()
@@ -2,16 +2,16 @@
 # -*- coding: utf-8 -*-
 
 from foldometer.analysis.region_classification import *
-from foldometer.tools.plots import force_extension_curve
+from foldometer.tools.profiling import profiled_stage
 from scipy import ndimage
-import matplotlib.pyplot as plt
-from matplotlib.widgets import Cursor
 import numpy as np
 import pandas as pd
 from copy import deepcopy
 
 
 def select_event_threshold(data, forceSTD, forceMeanChange, axis="X", forceChannel="force"):
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import Cursor
     fig = plt.figure(figsize=(8, 6))
     ax = fig.add_subplot(111, axisbg='#FFFFCC')
 
@@ -28,6 +28,35 @@ def select_event_threshold(data, forceSTD, forceMeanChange, axis="X", forceChann
     plt.show()
 
 
+def rolling_mean_diff(series, window, center=True):
+    """
+    Function to calculate the rolling mean of the difference (first order) of a series. The differences inside a
+    window add up to the difference between its last and first points, so the mean is computed for all the windows at
+    once in O(N), with the same result and window alignment as series.rolling(window, center).apply(mean of np.diff)
+
+    Args:
+        series (pandas.Series): data to calculate the rolling mean of the difference from
+        window (int): number of points of each window
+        center (bool): if True, the result is set at the center of the window, otherwise at its last point
+
+    Returns:
+        meanDiff (pandas.Series): rolling mean of the difference, NaN for incomplete windows or windows with NaN values
+    """
+
+    values = np.asarray(series, dtype=float)
+    n = len(values)
+    meanDiff = np.full(n, np.nan)
+    if 1 < window <= n:
+        windowMeanDiff = (values[window - 1:] - values[:n - window + 1]) / (window - 1)
+        #any missing value in the window makes the result missing, as in pandas rolling
+        missingCount = np.concatenate(([0], np.cumsum(np.isnan(values))))
+        windowMeanDiff[missingCount[window:] - missingCount[:n - window + 1] > 0] = np.nan
+        offset = (window - 1) // 2 if center else 0
+        meanDiff[window - 1 - offset: n - offset] = windowMeanDiff
+
+    return pd.Series(meanDiff, index=series.index)
+
+
 def identify_unfolding_events(data, axis="x", forceChannel="force", window=15, STDthreshold=0.8, forceThreshold=5):
     """
     Function to identify potential unfolding events using the rolling standard deviation and rolling mean of the
@@ -49,23 +78,12 @@ def identify_unfolding_events(data, axis="x", forceChannel="force", window=15, S
 
     data["unfolding"] = False
 
-    def mean_diff(dataSet, n):
-        """
-        Subfunction to calculate the rolling mean of the difference
-        Args:
-            dataSet (numpy.array): array with the data subset (window) to calculate the moving mean of the difference
-            n (integer): number of datapoints to calculate the diff from
-        Returns:
-            mean of the difference of the subset
-        """
-        return np.mean(np.diff(dataSet, n))
-
     force = data[forceChannel + axis]
     #Calculate the rolling standard deviation
     forceSTD = force.rolling(window, center=True).std()
     #print(window)
     #Calculate the rolling mean of the difference
-    forceMeanChange = force.rolling(window, center=True).apply(func=mean_diff, args=(1,))
+    forceMeanChange = rolling_mean_diff(force, window, center=True)
     #select_event_threshold(data, forceSTD, forceMeanChange, axis)
     #forceMeanChange2 = pd.rolling_apply(force, window, func=mean_diff, args=(2,), center=True)
 
@@ -134,7 +152,6 @@ def calculate_force_change(data, axis="x", forceChannel="force", distanceChannel
     # unclassified regions
     times = {"startTimes": data.groupby("eventID").time.first()[1:], "endTimes": data.groupby("eventID").time.last()[1:]}
     newWindow = deepcopy(window)
-    import streamlit as st
     for startTime, endTime in zip(times["startTimes"], times["endTimes"]):
         if (startTime > data["time"].min())*(startTime < data["time"].max())*(endTime > data["time"].min())*(endTime < data["time"].max()):
             if data.index.get_loc(startTime) < newWindow:
@@ -152,8 +169,7 @@ def calculate_force_change(data, axis="x", forceChannel="force", distanceChannel
     return unfoldingData
 
 
-import streamlit as st
-@st.cache()
+@profiled_stage()
 def find_unfolding_events(data, axis="x", forceChannel="force", distanceChannel="surfaceSep", unfoldingThreshold=1,
                           forceThreshold=5, rollingWindow=5, unfoldingWindow=15, plot=False, **kwargs):
     """
@@ -176,6 +192,9 @@ def find_unfolding_events(data, axis="x", forceChannel="force", distanceChannel=
         unfoldingForces (pandas.DataFrame): pandas DataFrame with information about the unfolding events force,
         extension change and time
     """
+    if plot:
+        import matplotlib.pyplot as plt
+        from foldometer.tools.plots import force_extension_curve
 
     axis = axis.upper()
     #print(rollingWindow)
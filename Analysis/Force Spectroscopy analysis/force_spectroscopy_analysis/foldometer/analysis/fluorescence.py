@@ -2,18 +2,207 @@
 # -*- coding: utf-8 -*-
 
 import pandas as pd
-import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
 from scipy.signal import savgol_filter
 from foldometer.tools.misc import data_selection
+from foldometer.tools.maths import fft_correlate, parabolic_peak
+from foldometer.tools.profiling import profiled_stage
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import os
 
 
+#lines fitted together when tracking a feature in a kymograph, and number of times their fitting windows are
+#centered on the centroid of the feature before the fit
+TRACKING_BATCH_LINES = 200
+TRACKING_SEED_ITERATIONS = 3
+#settings of the Levenberg-Marquardt fit of the Gaussian features
+LM_MAX_ITERATIONS = 100
+LM_TOLERANCE = 1e-8
+LM_INITIAL_DAMPING = 1e-3
+LM_MAX_DAMPING = 1e10
+#lines per task of the process pool for the lines that do not converge with the batched fit
+FALLBACK_CHUNK_LINES = 50
+
+
+def gaussian(x, A, mean, sigma):
+    """
+    Simple Gaussian function
+    """
+    return A*np.exp(-(x-mean)**2/(2*sigma**2))
+
+
+def gaussian_moments(x, y):
+    """
+    Function to estimate the parameters of a Gaussian feature in many lines at once from the moments of the signal
+
+    Args:
+        x (numpy.array): positions of the points of each line, with shape (lines, points)
+        y (numpy.array): signal of each line without background (not negative), same shape as x
+
+    Returns:
+        parameters (numpy.array): amplitude, center and sigma of each line, with shape (lines, 3)
+    """
+
+    weights = np.clip(y, 0, None)
+    total = weights.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        center = (weights * x).sum(axis=1) / total
+        sigma = np.sqrt((weights * (x - center[:, None]) ** 2).sum(axis=1) / total)
+
+    return np.column_stack((y.max(axis=1), center, sigma))
+
+
+def fit_gaussians(x, y, initialParameters, maxIterations=LM_MAX_ITERATIONS, tolerance=LM_TOLERANCE):
+    """
+    Function to fit a Gaussian (see gaussian()) to many lines at once with the Levenberg-Marquardt algorithm. All the
+    lines are iterated together, with a damping factor per line
+
+    Args:
+        x (numpy.array): positions of the points of each line, with shape (lines, points)
+        y (numpy.array): signal of each line, same shape as x
+        initialParameters (numpy.array): initial amplitude, center and sigma of each line, with shape (lines, 3)
+        maxIterations (int): maximum number of iterations
+        tolerance (float): relative change of the sum of squares or of the parameters below which a line has converged
+
+    Returns:
+        parameters (numpy.array): fitted amplitude, center and sigma of each line, with shape (lines, 3)
+        converged (numpy.array): True for the lines that converged to a Gaussian inside the line
+    """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    parameters = np.array(initialParameters, dtype=float)
+    lineNumber = len(parameters)
+
+    def sum_squares(lines, lineParameters):
+        residuals = gaussian(x[lines], *lineParameters.T[:, :, None]) - y[lines]
+        return np.sum(residuals ** 2, axis=1)
+
+    with np.errstate(all="ignore"):
+        cost = sum_squares(np.arange(lineNumber), parameters)
+        damping = np.full(lineNumber, LM_INITIAL_DAMPING)
+        active = np.isfinite(cost) & np.all(np.isfinite(parameters), axis=1) & (parameters[:, 2] != 0)
+        converged = np.zeros(lineNumber, dtype=bool)
+
+        for iteration in range(maxIterations):
+            lines = np.flatnonzero(active & ~converged)
+            if not len(lines):
+                break
+            A, mean, sigma = parameters[lines].T[:, :, None]
+            distance = x[lines] - mean
+            exponential = np.exp(-distance ** 2 / (2 * sigma ** 2))
+            jacobian = np.stack((exponential, A * exponential * distance / sigma ** 2,
+                                 A * exponential * distance ** 2 / sigma ** 3), axis=-1)
+            residuals = A * exponential - y[lines]
+            curvature = np.einsum("lpi,lpj->lij", jacobian, jacobian)
+            gradient = np.einsum("lpi,lp->li", jacobian, residuals)
+
+            #Marquardt scaling of the diagonal; singular systems mean the line cannot be fitted
+            dampedCurvature = curvature + damping[lines, None, None] * \
+                np.eye(3) * np.diagonal(curvature, axis1=1, axis2=2)[:, :, None]
+            solvable = np.isfinite(dampedCurvature).all(axis=(1, 2)) & (np.abs(np.linalg.det(dampedCurvature)) > 0)
+            active[lines[~solvable]] = False
+            lines, dampedCurvature, gradient = lines[solvable], dampedCurvature[solvable], gradient[solvable]
+            step = -np.linalg.solve(dampedCurvature, gradient[:, :, None])[:, :, 0]
+
+            newParameters = parameters[lines] + step
+            newCost = sum_squares(lines, newParameters)
+            better = newCost < cost[lines]
+            smallChange = (cost[lines] - newCost <= tolerance * cost[lines]) | \
+                np.all(np.abs(step) <= tolerance * (np.abs(parameters[lines]) + tolerance), axis=1)
+
+            improved = lines[better]
+            parameters[improved] = newParameters[better]
+            cost[improved] = newCost[better]
+            converged[improved] = smallChange[better]
+            damping[improved] /= 10
+            damping[lines[~better]] *= 10
+            #no step can reduce the sum of squares anymore, the line is at a minimum
+            converged[lines[~better & (damping[lines] > LM_MAX_DAMPING)]] = True
+
+    parameters[:, 2] = np.abs(parameters[:, 2])
+    converged &= np.all(np.isfinite(parameters), axis=1) & (parameters[:, 2] > 0) & \
+        (parameters[:, 1] >= x.min(axis=1)) & (parameters[:, 1] <= x.max(axis=1))
+
+    return parameters, converged
+
+
+def fit_gaussians_individually(x, y, initialParameters):
+    """
+    Function to fit a Gaussian (see gaussian()) to each line with scipy.optimize.curve_fit, one after another
+
+    Args:
+        x (numpy.array): positions of the points of each line, with shape (lines, points)
+        y (numpy.array): signal of each line, same shape as x
+        initialParameters (numpy.array): initial amplitude, center and sigma of each line, with shape (lines, 3)
+
+    Returns:
+        parameters (numpy.array): fitted amplitude, center and sigma of each line, NaN if the fit failed
+    """
+
+    parameters = np.full((len(x), 3), np.nan)
+    for line in range(len(x)):
+        try:
+            parameters[line] = curve_fit(gaussian, x[line], y[line], p0=initialParameters[line])[0]
+        except Exception:
+            pass
+    parameters[:, 2] = np.abs(parameters[:, 2])
+
+    return parameters
+
+
+def fit_gaussian_lines(x, y, initialParameters=None, processes=None):
+    """
+    Function to fit a Gaussian to many lines of an image. All the lines are fitted at once (see fit_gaussians()) and the
+    ones that do not converge are fitted again individually with curve_fit, in chunks of FALLBACK_CHUNK_LINES lines
+    distributed to a pool of processes
+
+    Args:
+        x (numpy.array): positions of the points of each line, with shape (lines, points)
+        y (numpy.array): signal of each line, same shape as x
+        initialParameters (numpy.array): initial amplitude, center and sigma of each line. If None, they are estimated
+            from the moments of the signal (see gaussian_moments())
+        processes (int): number of worker processes for the individual fits. If 1, they run in the current process.
+            Default is None, the number of CPUs
+
+    Returns:
+        parameters (numpy.array): fitted amplitude, center and sigma of each line, with shape (lines, 3). NaN for the
+            lines that could not be fitted
+    """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if initialParameters is None:
+        initialParameters = gaussian_moments(x, y - y.min(axis=1)[:, None])
+    parameters, converged = fit_gaussians(x, y, initialParameters)
+
+    failed = np.flatnonzero(~converged)
+    if len(failed):
+        if processes is None:
+            processes = os.cpu_count() or 1
+        chunks = [chunk for chunk in np.array_split(failed, int(np.ceil(len(failed) / FALLBACK_CHUNK_LINES)))]
+        seeds = np.where(np.isfinite(initialParameters), initialParameters, 1)
+        if processes <= 1 or len(chunks) <= 1:
+            fallbackParameters = [fit_gaussians_individually(x[chunk], y[chunk], seeds[chunk]) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=min(processes, len(chunks))) as executor:
+                fallbackParameters = list(executor.map(fit_gaussians_individually, [x[chunk] for chunk in chunks],
+                                                       [y[chunk] for chunk in chunks],
+                                                       [seeds[chunk] for chunk in chunks]))
+        parameters[failed] = np.concatenate(fallbackParameters)
+
+    return parameters
+
+
+@profiled_stage()
 def track_gaussian_feature(fluoData, startLine, endLine=None, lineEdges=None, fluoTimeRes=0.08596, shiftCenter=0,
-                           averageLines=0, invert=False):
+                           averageLines=0, invert=False, batchLines=TRACKING_BATCH_LINES, processes=None):
     """
     Track a Gaussian-resembling feature in the fluorescence using a Gaussian fit. The feature can be the edge of a
-    bead, a bright spot in the middle or a whole bead (by using invert)/
+    bead, a bright spot in the middle or a whole bead (by using invert)/. The lines are tracked in batches: the fitting
+    window of each line is centered on the centroid of the feature, starting from the last position of the previous
+    batch, and all the lines of the batch are fitted at once (see fit_gaussian_lines())
 
     Args:
         fluoData (numpy.array): data containing the fluorescence fluoData
@@ -24,6 +213,9 @@ def track_gaussian_feature(fluoData, startLine, endLine=None, lineEdges=None, fl
         shiftCenter (int): displacement of the center if the Gaussian-like feature is not symmetric
         averageLines (int): number of scanning lines to add to the standard for smoother tracking
         invert (bool): to use for tracking dark features, instead of bright
+        batchLines (int): number of lines fitted together. The feature should not move more than the fitting window
+            within a batch
+        processes (int): number of worker processes for the lines that have to be fitted individually
 
     Returns:
         trackedFluorescence (numpy.array): array with the location of the tracked feature (in pixels)
@@ -44,55 +236,112 @@ def track_gaussian_feature(fluoData, startLine, endLine=None, lineEdges=None, fl
 
     if not endLine:
         endLine = len(fluoData[0])
-    guessSigma = 1
-    guessAmplitude = 1000
-
-    def gauss(x, A, mean, sigma):
-        """
-        Simple Gaussian function
-        """
-        return A*np.exp(-(x-mean)**2/(2*sigma**2))
 
     guessCenter = (lineEdges[0] + lineEdges[1]) // 2 + shiftCenter
     halfWidth = (lineEdges[1] - lineEdges[0]) // 2
     halfWidthLeft = halfWidth + shiftCenter
     halfWidthRight = halfWidth - shiftCenter
-    trackingFits = []
-
-    for line in np.arange(startLine + averageLines, endLine - averageLines):
 
-        x = np.arange(guessCenter - halfWidthLeft, guessCenter + halfWidthRight)
-        if averageLines is 0:
-            signal = fluoData[guessCenter - halfWidthLeft:guessCenter + halfWidthRight, line]
-        else:
-            signal = np.mean(fluoData[:, line - averageLines: line + averageLines], axis=1)[guessCenter -
-                                                                                             halfWidthLeft:guessCenter + halfWidthRight]
-        #plt.plot(signal)
-        try:
+    #profile of every line, averaged with the neighbouring lines, with shape (lines, pixels)
+    lines = np.arange(startLine + averageLines, endLine - averageLines)
+    if averageLines == 0:
+        profiles = np.asarray(fluoData[:, lines], dtype=float).T
+    else:
+        cumulative = np.concatenate((np.zeros((len(fluoData), 1)), np.cumsum(fluoData, axis=1, dtype=float)), axis=1)
+        profiles = ((cumulative[:, lines + averageLines] - cumulative[:, lines - averageLines]) / (2 * averageLines)).T
+    pixelNumber = profiles.shape[1]
+    offsets = np.arange(-halfWidthLeft, halfWidthRight)
+
+    trackingFits = np.full(len(lines), np.nan)
+    for batchStart in range(0, len(lines), batchLines):
+        batch = profiles[batchStart:batchStart + batchLines]
+        windowCenters = np.full(len(batch), guessCenter)
+        for iteration in range(TRACKING_SEED_ITERATIONS):
+            windowCenters = np.clip(windowCenters, halfWidthLeft, pixelNumber - halfWidthRight)
+            x = windowCenters[:, None] + offsets
+            signal = np.take_along_axis(batch, x, axis=1)
             if invert:
-                y = max(signal) - signal
+                y = signal.max(axis=1)[:, None] - signal
             else:
-                y = signal - min(signal)
+                y = signal - signal.min(axis=1)[:, None]
+            seeds = gaussian_moments(x, y)
+            windowCenters = np.where(np.isfinite(seeds[:, 1]), np.nan_to_num(seeds[:, 1]).astype(int), windowCenters)
 
-            fittedParams, fittedCov = curve_fit(gauss, x, y, p0=[guessAmplitude, guessCenter, guessSigma])
-            trackingFits.append(fittedParams[1])
-            guessCenter = int(trackingFits[-1])
-            guessSigma = fittedParams[2]
-            guessAmplitude = fittedParams[0]
-        except:
-            trackingFits.append(np.nan)
-            guessCenter = int(np.mean(pd.Series(trackingFits).dropna()))
+        centers = fit_gaussian_lines(x, y, seeds, processes)[:, 1]
+        trackingFits[batchStart:batchStart + len(batch)] = centers
+        if np.isfinite(centers).any():
+            guessCenter = int(centers[np.isfinite(centers)][-1])
+        elif np.isfinite(trackingFits).any():
+            guessCenter = int(np.nanmean(trackingFits))
 
     trackedFluorescence = pd.Series(trackingFits, index=(np.arange(len(trackingFits)) + startLine) * fluoTimeRes)
     #plt.show()
     return trackedFluorescence
 
 
+def alignment_residues(reference, signal, minShift, maxShift):
+    """
+    Compute the mean squared difference between a shifted reference and a signal for a range of shifts, as
+    (reference.shift(shift) - signal) ** 2 averaged over the points where both are defined. The sums of squares and
+    products at all the shifts are computed at once with FFT (see tools.maths.fft_correlate()). Arrays with more than
+    one dimension are processed along the last axis, one pair per row; rows can be padded with NaN
+
+    Args:
+        reference (numpy.array): reference signal, shifted
+        signal (numpy.array): signal to compare with, same length as the reference
+        minShift (int): first shift, in samples
+        maxShift (int): last shift (included), in samples
+
+    Returns:
+        residues (numpy.array): mean squared difference at each shift, in the last axis. NaN without overlap
+    """
+
+    reference = np.asarray(reference, dtype=float)
+    signal = np.asarray(signal, dtype=float)
+    validReference = np.isfinite(reference).astype(float)
+    validSignal = np.isfinite(signal).astype(float)
+    reference = np.nan_to_num(reference)
+    signal = np.nan_to_num(signal)
+
+    #shifting the reference by s pairs reference[j] with signal[j + s]
+    counts = np.rint(fft_correlate(validReference, validSignal, minShift, maxShift))
+    sumSquares = fft_correlate(reference ** 2, validSignal, minShift, maxShift) + \
+        fft_correlate(validReference, signal ** 2, minShift, maxShift) - \
+        2 * fft_correlate(reference, signal, minShift, maxShift)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        residues = np.where(counts > 0, sumSquares / counts, np.nan)
+
+    return residues
+
+
+def alignment_offset(reference, signal, minShift, maxShift):
+    """
+    Find the shift of a reference that minimizes its mean squared difference with a signal (see alignment_residues())
+    within a bounded range, refined below one sample with a parabola through the minimum and its neighbours. Arrays
+    with more than one dimension are aligned along the last axis, one pair per row
+
+    Args:
+        reference (numpy.array): reference signal, shifted
+        signal (numpy.array): signal to compare with, same length as the reference
+        minShift (int): smallest shift considered, in samples
+        maxShift (int): largest shift considered (included), in samples
+
+    Returns:
+        shift (float or numpy.array): optimal shift of each pair, in samples
+        residues (numpy.array): mean squared difference at each shift from minShift to maxShift
+    """
+
+    residues = alignment_residues(reference, signal, minShift, maxShift)
+
+    return parabolic_peak(residues, minimum=True) + minShift, residues
+
+
+@profiled_stage()
 def align_fluorescence_data(data, fluoData, startLine, endLine=None, fluoTimeRes=0.085356, maximumOffset=4,
                             defaultOffset=2, channel="trapSepX", **kwargs):
     """
     Automatically align the fluorescence and force data by tracking a bead, resampling high-res data and minimizing
-    residues between signals at different time shifts
+    residues between signals at different time shifts (see alignment_offset())
     Args:
         data (pandas.DataFrame): high-res data
         fluoData (numpy.array): array containing the fluorescent image of a given color
@@ -100,15 +349,18 @@ def align_fluorescence_data(data, fluoData, startLine, endLine=None, fluoTimeRes
         endLine (int): line to end the tracking for alignment
         fluoTimeRes (float): time resolution of the fluorescence data
         maximumOffset (float): the maximum shift to look for (in seconds)
+        defaultOffset (float): extra range of negative shifts to look for (in seconds)
+        channel (str): channel of the data to align with the tracked bead
         **kwargs: keyword arguments for the tracking function
 
     Returns:
         fluoOffset (float): time offset in seconds between fluorescence and force signal
     """
+    import matplotlib.pyplot as plt
     trackedFluorescence = track_gaussian_feature(fluoData, startLine, endLine, fluoTimeRes=fluoTimeRes, **kwargs)
 
     lowData = data[["time", "trapSepX", "surfaceSepX"]].copy()
-    lowData.index = lowData["time"]
+    lowData.index = lowData["time"].values
     fluo = pd.DataFrame({"fluo": trackedFluorescence.values * 80}, index=trackedFluorescence.index)
     fluo["time"] = fluo.index
     print(channel)
@@ -117,25 +369,13 @@ def align_fluorescence_data(data, fluoData, startLine, endLine=None, fluoTimeRes
 
     newData = lowData.loc[lowData["fluo"].dropna().index, :]
     newData.index = np.arange(len(newData))
-    shifts = []
-    residues = []
     average = (newData[channel] - newData["fluo"]).mean()
-    for shift in range(-int((maximumOffset + defaultOffset) // fluoTimeRes), int((maximumOffset) // fluoTimeRes)):
-        shifts.append(shift)
-
-        difference = (newData[channel].shift(shift) - newData["fluo"]-average).dropna()**2
-        residues.append(difference.sum() / difference.count())
-
-    def gauss(x, A, mean, sigma, B):
-        """
-        Simple Gaussian function
-        """
-        return A*np.exp(-(x-mean)**2/(2*sigma**2)) + B
-    #plt.plot(shifts, max(residues) - residues, '.')
-    fitParams, fitCov = curve_fit(gauss, shifts, max(residues) - residues)
-    #plt.plot(shifts, gauss(shifts, fitParams[0], fitParams[1], fitParams[2], fitParams[3]))
-    fluoOffsetRough = -shifts[residues.index(min(residues))] * fluoTimeRes
-    fluoOffset = -fitParams[1] * fluoTimeRes
+    minShift = -int((maximumOffset + defaultOffset) // fluoTimeRes)
+    maxShift = int((maximumOffset) // fluoTimeRes) - 1
+    bestShift, residues = alignment_offset(newData[channel].values, (newData["fluo"] + average).values, minShift,
+                                           maxShift)
+    fluoOffsetRough = -(np.nanargmin(residues) + minShift) * fluoTimeRes
+    fluoOffset = -bestShift * fluoTimeRes
     plt.plot(newData["time"] + fluoOffset, newData["fluo"] + average, '.')
     plt.plot(newData["time"], newData[channel])
     #plt.show()
@@ -172,6 +412,7 @@ def plot_contour_fluorescence(data, fluoData, color, signalRegion, topChannel="p
         fontsize (float): fontsize for plots
 
     """
+    import matplotlib.pyplot as plt
 
     sav_fil = lambda x: savgol_filter(x, savgolWindow, savgolOrder)
     fig, (ax1, ax2, ax3) = plt.subplots(3, 1, sharex=True, figsize=(6,8))
@@ -7,6 +7,7 @@ import numpy as np
 import scipy.fftpack as fft
 import os
 import pkg_resources
+from foldometer.tools.profiling import profiled_stage
 
 P_CCD_DEFAULT_FILE_NAME = pkg_resources.resource_filename('foldometer', 'data/p_CCD.xlsx')
 P_QPD_PIEZO_DEFAULT_FILE_NAME = pkg_resources.resource_filename('foldometer', 'data/p_QPD_piezo.xlsx')
@@ -119,6 +120,7 @@ def subtract_noise_from_data(data):
     data.drop(["fourierNoiseCCD", "fourierNoiseQPD", "fourierNoiseCombined"], axis=1, inplace=True)
 
 
+@profiled_stage()
 def correct_signal_noise(data, **kwargs):
     """
     Function to reduce the noise in the signal of the extension, using the data from the piezo mirror and the camera
@@ -4,8 +4,10 @@
 
 import numpy as np
 import pandas as pd
-from scipy import ndimage
 from scipy.signal import savgol_filter
+from foldometer.tools.cache import cached_stage
+from foldometer.tools.profiling import profiled_stage
+from foldometer.tools.schema import REGION_LABELS, FRAME_SCHEMA, region_codes, region_categorical
 
 
 def assign_rough_regions(data, axis="x", **kwargs):
@@ -25,19 +27,121 @@ def assign_rough_regions(data, axis="x", **kwargs):
     """
     pd.set_option('mode.chained_assignment',None)
     axis = axis.upper()
-    data["region"] = ""
 
     mirrorDiff = pd.Series(savgol_filter(data["trapSep" + axis], 71, 1), index=data.index).diff().fillna(
         method="backfill")
 
     sigma = np.max([mirrorDiff.max(), mirrorDiff.min()]) / 20
 
-    #set the criteria for assigning region using the first and second derivative of the trapSepX
-    data.loc[mirrorDiff <= sigma, "region"] = "stationary"
-    data.loc[mirrorDiff > sigma, "region"] = "pulling"
-    data.loc[mirrorDiff < -sigma, "region"] = "retracting"
-    #Column conversion to category
-    data.region.astype("category")
+    #set the criteria for assigning region using the first and second derivative of the trapSepX. The regions are
+    #stored as a categorical column, see foldometer.tools.schema
+    codes = np.select([mirrorDiff < -sigma, mirrorDiff > sigma, mirrorDiff <= sigma],
+                      [REGION_LABELS.index(region) for region in ["retracting", "pulling", "stationary"]],
+                      default=REGION_LABELS.index(""))
+    data["region"] = region_categorical(codes)
+
+    return data
+
+
+def region_segments(regions, pullingCycles=None):
+    """
+    Function to describe the regions of the data as segments: runs of consecutive data points with the same region
+    (and pulling cycle)
+
+    Args:
+        regions (array-like): region of each data point, see assign_rough_regions()
+        pullingCycles (numpy.ndarray): pulling cycle of each data point. If None, the segments of each region are
+            numbered in order, starting at 1 (as ndimage.label does)
+
+    Returns:
+        segments (pandas.DataFrame): start and stop (excluded) positions, region and pulling cycle of each segment
+    """
+
+    codes = region_codes(regions)
+    changes = codes[1:] != codes[:-1]
+    if pullingCycles is not None:
+        pullingCycles = np.asarray(pullingCycles, dtype=float)
+        changes |= pullingCycles[1:] != pullingCycles[:-1]
+    starts = np.flatnonzero(np.concatenate([[True], changes]))[:len(codes)]
+    segments = pd.DataFrame({"start": starts, "stop": np.append(starts[1:], len(codes))[:len(starts)],
+                             "region": region_categorical(codes[starts])})
+    if pullingCycles is None:
+        segments["pullingCycle"] = segments.groupby("region", observed=True).cumcount() + 1.0
+    else:
+        segments["pullingCycle"] = pullingCycles[starts]
+
+    return segments
+
+
+def remove_false_stationary_segments(segments, minRegionLength=10):
+    """
+    Function to remove and rearrange the false stationary segments (transition from pulling to retracting or
+    viceversa): the first half of a stationary segment shorter than minRegionLength joins the previous segment and the
+    rest joins the next one. The stationary segments are then numbered again
+
+    Args:
+        segments (pandas.DataFrame): segments of the data, see region_segments()
+        minRegionLength (int): minimum number of data points to consider a region as valid (otherwise it is removed)
+    Returns:
+        segments (pandas.DataFrame): the segments with fixed stationary regions
+    """
+
+    segments = segments.reset_index(drop=True)
+    lengths = (segments["stop"] - segments["start"]).values
+    stationary = (segments["region"] == "stationary").values
+    short = np.flatnonzero(stationary & (lengths < minRegionLength))
+    hasPrevious = short > 0
+    hasNext = short < len(segments) - 1
+    short = short[hasPrevious | hasNext]
+    hasPrevious, hasNext = hasPrevious[hasPrevious | hasNext], hasNext[hasPrevious | hasNext]
+
+    #the first half (plus one point) takes the region of the previous segment, the rest the one of the next segment.
+    #A segment at the beginning or at the end of the data takes the region of its only neighbour
+    headLengths = np.where(hasNext, np.minimum(lengths[short] // 2 + 1, lengths[short]), lengths[short])
+    splits = segments["start"].values[short] + np.where(hasPrevious, headLengths, 0)
+    heads = pd.DataFrame({"start": segments["start"].values[short], "stop": splits,
+                          "region": segments["region"].values[np.maximum(short - 1, 0)],
+                          "pullingCycle": segments["pullingCycle"].values[np.maximum(short - 1, 0)]})
+    nextSegments = np.minimum(short + 1, len(segments) - 1)
+    tails = pd.DataFrame({"start": splits, "stop": segments["stop"].values[short],
+                          "region": segments["region"].values[nextSegments],
+                          "pullingCycle": segments["pullingCycle"].values[nextSegments]})
+    segments = pd.concat([segments.drop(short), heads, tails], ignore_index=True)
+    segments = segments[segments["stop"] > segments["start"]].sort_values("start", kind="mergesort")
+
+    #join the consecutive segments with the same region and cycle
+    newSegment = (segments["region"] != segments["region"].shift()) | \
+                 (segments["pullingCycle"] != segments["pullingCycle"].shift())
+    segments = segments.groupby(newSegment.cumsum().values).agg(
+        {"start": "first", "stop": "last", "region": "first", "pullingCycle": "first"}).reset_index(drop=True)
+
+    #number the stationary regions again, consecutive stationary segments being the same region
+    stationary = (segments["region"] == "stationary").values
+    stationaryStarts = stationary & ~np.concatenate([[False], stationary[:-1]])
+    segments.loc[stationary, "pullingCycle"] = np.cumsum(stationaryStarts)[stationary].astype(float)
+
+    return segments
+
+
+def expand_segments(segments, data):
+    """
+    Function to write the regions and pulling cycles of the segments to each data point, with the types of
+    foldometer.tools.schema (pulling cycles with missing values are kept as floats)
+
+    Args:
+        segments (pandas.DataFrame): segments of the data, see region_segments()
+        data (pandas.DataFrame): pandas DataFrame containing the data
+
+    Returns:
+        data (pandas.DataFrame): the same data with the columns region and pullingCycle
+    """
+
+    lengths = (segments["stop"] - segments["start"]).values
+    data["region"] = region_categorical(np.repeat(region_codes(segments["region"]), lengths))
+    pullingCycles = segments["pullingCycle"].values.astype(float)
+    if np.isfinite(pullingCycles).all():
+        pullingCycles = pullingCycles.astype(FRAME_SCHEMA["pullingCycle"])
+    data["pullingCycle"] = np.repeat(pullingCycles, lengths)
 
     return data
 
@@ -57,19 +161,18 @@ def label_regions(data, minRegionLength, verbose=True):
     #check if the regions have been assigned
     if "region" not in data.columns.values.tolist():
         raise ValueError("The regions have not been assigned yet. Please see the function assign_rough_regions")
-    #define the column pullingCycle
-    data["pullingCycle"] = 0.0
-    #label the isolated regions
-    for region in list(data["region"].unique()):
-        data["pullingCycle"] += ndimage.label(data["region"] == region)[0]
+    #label the isolated regions, as segments of consecutive data points
+    segments = region_segments(data["region"].values)
 
     #remove and rearrange the false stationary regions (transition from pulling to retracting or viceversa)
-    data = remove_false_stationary(data, minRegionLength)
+    segments = remove_false_stationary_segments(segments, minRegionLength)
     #Start the region counter at 0, not at 1 (labelling starts at 1)
-    data["pullingCycle"] -= 1
+    segments["pullingCycle"] -= 1
+    data = expand_segments(segments, data)
     if verbose:
+        runs = segments[segments["region"] != segments["region"].shift()]
         for region in list(data["region"].unique()):
-            print(ndimage.label(data["region"] == region)[1], region, "regions identified")
+            print((runs["region"] == region).sum(), region, "regions identified")
 
     return data
 
@@ -85,23 +188,14 @@ def remove_false_stationary(data, minRegionLength=10):
         data (pandas.DataFrame): the same data with fixed stationary regions
     """
 
-    for pullingCycle in list(data.loc[data["region"] == "stationary", "pullingCycle"].unique()):
-        regionMask = (data["region"] == "stationary") & (data["pullingCycle"] == pullingCycle)
-        if len(data.loc[regionMask, "pullingCycle"]) < minRegionLength:
-            #make nan the statioanry regions that are too sort (for fill methods)
-            data.loc[regionMask, ["region", "pullingCycle"]] = np.nan
-            #fill first forward half of the region and the other half backwards
-            data = data.fillna(method="ffill", limit=len(data.loc[regionMask])//2+1)
-            data = data.fillna(method="bfill", limit=len(data.loc[regionMask])//2+1)
-    #relabel the stationary regions
-    data.loc[data["region"] == "stationary", "pullingCycle"] = 0
-    data["pullingCycle"] += ndimage.label(data["region"] == "stationary")[0]
+    segments = region_segments(data["region"].values, data["pullingCycle"].values)
+    segments = remove_false_stationary_segments(segments, minRegionLength)
 
-    return data
+    return expand_segments(segments, data)
 
 
-import streamlit as st
-@st.cache()
+@profiled_stage()
+@cached_stage(data="data")
 def assign_regions(data, axis="X", minRegionLength=10, verbose=True, **kwargs):
     """
     Function to assign and include the regions (stationary, pulling or retracting) of the traps, based on mirror
@@ -2,19 +2,19 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-import matplotlib.pyplot as plt
 import math
 from foldometer.ixo.binary import read_file
 from foldometer.physics.thermodynamics import thermal_energy
 from foldometer.physics.hydrodynamics import drag_sphere as dg_sph
 from foldometer.physics.utils import as_Kelvin
+from foldometer.tools.profiling import profiled_stage
 import pandas as pd
 from scipy.signal import welch
 from collections import OrderedDict as od
 from scipy.optimize import curve_fit
 #from foldometer.ixo.binary import *
-import seaborn as sns
 from itertools import count
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 
@@ -34,6 +34,10 @@ MODE = "mle"
 DEFAULTARGS = {"viscosity": VISCOSITY, "temperature": TEMPERATURE, "radius": RADIUS, "radius1": RADIUS, "radius2": RADIUS2,
                "limits": LIMITS, "blockNumber": BLOCKNUMBER, "TSLength": TSLENGTH, "sFreq": SAMPLEFREQUENCY,
                "overlap": OVERLAP, "columnLabel": None, "figure": None, "fmCalibration": None, "plot": PLOT, "mode": MODE}
+#PSD channels used for the calibration and the label of their calibration parameters
+CALIBRATION_CHANNELS = od([("PSD1VxDiff", "PSD1x"), ("PSD1VyDiff", "PSD1y"), ("PSD2VxDiff", "PSD2x"),
+                           ("PSD2VyDiff", "PSD2y")])
+CALIBRATION_LABELS = ["D", "fc", "sigma", "chiSqr", "beta", "stiffness", "errorBeta", "errorStiff", "beadDiameter"]
 
 def lorentzian(f, D, fc):
     """
@@ -175,6 +179,37 @@ def calculate_psd(data, blockNumber=BLOCKNUMBER, sFreq=SAMPLEFREQUENCY, overlap=
     return psd
 
 
+def calculate_psds(data, blockNumber=BLOCKNUMBER, sFreq=SAMPLEFREQUENCY, overlap=OVERLAP):
+    """Calculates the power spectral density of all the columns of the data at once (a single Welch call on the 2D
+    array) and sets the proper pandas format for each of them
+
+    Args:
+        data (pandas.DataFrame): data read from the file, one column per channel
+        blockNumber (float): number of averaged blocks in which the time series is divided for calculating the psd
+        sFreq (float): sample frequency in units of [Hz]
+        overlap (float): number of points for overlapping blocks
+
+    Returns:
+        psds (OrderedDict): power spectrum density of each column, with the same format as calculate_psd()
+    """
+
+    #calculate the length of each block for the Welch algorithm
+    blockLength = len(data.index)//blockNumber
+
+    fRaw, psdRaw = welch(data.values.astype(float), nperseg=blockLength, window="hann", fs=sFreq, noverlap=overlap,
+                         axis=0)
+
+    # if there is a value for 0 Hz, delete it
+    if fRaw[0] == 0:
+        fRaw = fRaw[1:]
+        psdRaw = psdRaw[1:]
+    #set format to pandas
+    psds = od([(label, pd.DataFrame({"psd": psdRaw[:, position], "f": fRaw}))
+               for position, label in enumerate(data.columns)])
+
+    return psds
+
+
 def check_kwargs(kwargs):
     """Fill missing values in the arguments with the default values
 
@@ -224,6 +259,7 @@ def plot_calibration(psd, D, fc, limits=LIMITS, fmCalibration=None, columnLabel=
             "mean": the arithmetic mean of the parameters from LSTSQ and MLE fitting
 
     """
+    import matplotlib.pyplot as plt
 
 
     psdLim = psd[(psd["f"] > limits[0]) & (psd["f"] < limits[1])]
@@ -279,10 +315,12 @@ def lstsq_calibration(psd, n, p0, weights=None, mode="lstsq"):
         * **chiSqr** (float):  Chi squared factor representing the goodness of the fit
     """
 
-    if mode is "lstsq" or "lstsq_corrected":
-        result, errors = curve_fit(lorentzian, psd["f"], psd["psd"], p0=p0)
+    #the standard deviation of each point is taken as the inverse of its weight (the PSD itself for "wlstsq")
+    sigma = None if weights is None else 1 / np.asarray(weights, dtype=float)
+    if mode == "lstsq_corrected":
+        result, errors = curve_fit(corrected_lorentzian, psd["f"], psd["psd"], p0=p0, sigma=sigma)
     else:
-        result, errors = curve_fit(corrected_lorentzian, psd["f"], psd["psd"], p0=p0)
+        result, errors = curve_fit(lorentzian, psd["f"], psd["psd"], p0=p0, sigma=sigma)
 
     if result[1] < 0:
         result[1] = -result[1]
@@ -556,9 +594,7 @@ def calibration_fit(psd, **kwargs):
     #calculate parameters with MLE to use them as initial guess for the rest
     D, fc, errors, chiSqr = mle_calibration(psdLim, kwargs["blockNumber"])
 
-    if kwargs["mode"] is "lstsq" or "lstsq_corrected" or "wlstsq":
-        if kwargs["mode"] is "wlstsq":
-            weights = [1/x for x in lorentzian(psdLim["f"])]
+    if kwargs["mode"] in ["lstsq", "lstsq_corrected"]:
         D, fc, errors, chiSqr = lstsq_calibration(psdLim, kwargs["blockNumber"], p0=[D, fc], mode=kwargs["mode"])
     elif kwargs["mode"] == "wlstsq":
         D, fc, errors, chiSqr = lstsq_calibration(psdLim, kwargs["blockNumber"], p0=[D, fc],
@@ -638,22 +674,16 @@ def calibration_time_series(data, **kwargs):
     return fitParameters
 
 
-def calibration_data(data, metadata=None, fmCalibration=None, **kwargs):
-    """Performs the fitting from a time series data
+def calibration_kwargs(metadata=None, fmCalibration=None, **kwargs):
+    """Fill the keyword arguments of the calibration with the default values and the values from the file
 
     Args:
-        data (pandas.Series): single time series with data
         metadata (pandas.Series): header values read from the file
         fmCalibration (pandas.DataFrame): parameters from the thermal calibration fit performed in Foldometer
         **kwargs: optional keyword arguments. Refer to the documentation of check_kwargs for possible arguments
 
     Returns:
-        fitParameters (orderedDict): values of the fit: diffusion constant (D), corner frequency (fc), \
-        errors of D and fc (sigma), distance calibration factor (beta), trap stiffness, \
-        error of beta (eBeta), error of stiffness (eStiffness)
-
-    Notes:
-        If metadata and fmCalibration are not given, the default values will be used
+        kwargs (dict): keyword arguments for the calibration of the file
     """
     kwargs = check_kwargs(kwargs)
 
@@ -669,17 +699,62 @@ def calibration_data(data, metadata=None, fmCalibration=None, **kwargs):
         if "temperature" not in kwargs:
             kwargs["temperature"] = metadata["temperature"]
 
-
     if fmCalibration is not None:
         kwargs["fmCalibration"] = fmCalibration
 
-    #choose only the relevant columns
-    psdData = data[['PSD1VxDiff', 'PSD1VyDiff', 'PSD2VxDiff', 'PSD2VyDiff']].astype(float)
+    return kwargs
+
+
+def channel_kwargs(kwargs, label):
+    """Keyword arguments for the calibration of a single PSD channel
+
+    Args:
+        kwargs (dict): keyword arguments for the calibration of the file, see calibration_kwargs()
+        label (str): name of the PSD channel
+
+    Returns:
+        channelKwargs (dict): copy of kwargs with the channel label and the radius of the corresponding bead
+    """
+    channelKwargs = dict(kwargs)
+    channelKwargs["columnLabel"] = label
+
+    #Check which radius to use
+    if "PSD1" in label:
+        channelKwargs["radius"] = kwargs["radius1"]
+    else:
+        channelKwargs["radius"] = kwargs["radius2"]
+
+    return channelKwargs
+
+
+@profiled_stage()
+def calibration_data(data, metadata=None, fmCalibration=None, **kwargs):
+    """Performs the fitting from a time series data
+
+    Args:
+        data (pandas.Series): single time series with data
+        metadata (pandas.Series): header values read from the file
+        fmCalibration (pandas.DataFrame): parameters from the thermal calibration fit performed in Foldometer
+        **kwargs: optional keyword arguments. Refer to the documentation of check_kwargs for possible arguments
+
+    Returns:
+        fitParameters (orderedDict): values of the fit: diffusion constant (D), corner frequency (fc), \
+        errors of D and fc (sigma), distance calibration factor (beta), trap stiffness, \
+        error of beta (eBeta), error of stiffness (eStiffness)
+
+    Notes:
+        If metadata and fmCalibration are not given, the default values will be used
+    """
+    kwargs = calibration_kwargs(metadata, fmCalibration, **kwargs)
+    if kwargs["plot"]:
+        import matplotlib.pyplot as plt
+
+    #choose only the relevant columns and calculate all the power spectra at once
+    psds = calculate_psds(data[list(CALIBRATION_CHANNELS)], kwargs["blockNumber"], kwargs["sFreq"], kwargs["overlap"])
 
     #define the ordered dictionary and the labels for the calibration parameters
     calibrationParameters = od()
-    columnLabels = ["D", "fc", "sigma", "chiSqr", "beta", "stiffness", "errorBeta", "errorStiff", "beadDiameter"]
-    for label in columnLabels:
+    for label in CALIBRATION_LABELS:
         calibrationParameters[label] = []
 
     #Prepare the figure to plot the four calibrations in the same canvas
@@ -688,29 +763,22 @@ def calibration_data(data, metadata=None, fmCalibration=None, **kwargs):
         kwargs["figure"] = {'PSD1VxDiff': ax1, 'PSD1VyDiff': ax2, 'PSD2VxDiff': ax3, 'PSD2VyDiff': ax4}
 
     #Perform the calibration for each of the four columns
-    for label, column in psdData.iteritems():
-        kwargs["columnLabel"] = label
-
-        #Check which radius to use
-        if "PSD1" in label:
-            kwargs["radius"] = kwargs["radius1"]
-        else:
-            kwargs["radius"] = kwargs["radius2"]
-
-        fitTimeSeries = calibration_time_series(data=column.astype(float), **kwargs)
+    for label, psd in psds.items():
+        fitParameters = calibration_psd(psd, **channel_kwargs(kwargs, label))
 
         for key in calibrationParameters.keys():
-            calibrationParameters[key].append(fitTimeSeries[key])
+            calibrationParameters[key].append(fitParameters[key])
 
     if kwargs["plot"]:
         plt.show()
 
     #Create the pandas DataFrame
-    calibrationData = pd.DataFrame(calibrationParameters, index=["PSD1x", "PSD1y", "PSD2x", "PSD2y"])
+    calibrationData = pd.DataFrame(calibrationParameters, index=list(CALIBRATION_CHANNELS.values()))
 
     return calibrationData
 
 
+@profiled_stage()
 def calibration_file(file, limits=LIMITS, blockNumber=BLOCKNUMBER, overlap=OVERLAP, plot=PLOT, mode=MODE, **kwargs):
     """
     Function to calibrate a Foldometer data file
@@ -740,3 +808,107 @@ def calibration_file(file, limits=LIMITS, blockNumber=BLOCKNUMBER, overlap=OVERL
                                        overlap=overlap, plot=plot, mode=mode, **kwargs)
 
     return calibrationData
+
+
+def calibration_file_psds(file, **kwargs):
+    """
+    Function to read a Foldometer calibration file and calculate the power spectra of all its PSD channels
+
+    Args:
+        file (str): path of the file containing the data
+        **kwargs: optional keyword arguments. Refer to the documentation of check_kwargs for possible arguments
+
+    Returns:
+        * **kwargs** (dict): keyword arguments for the calibration of the file, see calibration_kwargs()
+        * **psds** (OrderedDict): power spectrum density of each PSD channel
+    """
+
+    metadata, fmCalibration, data, beadData = read_file(file, mode="calibration")
+    kwargs = calibration_kwargs(metadata, **kwargs)
+    psds = calculate_psds(data[list(CALIBRATION_CHANNELS)], kwargs["blockNumber"], kwargs["sFreq"], kwargs["overlap"])
+
+    return kwargs, psds
+
+
+def calibration_channel(file, label, psd, **kwargs):
+    """
+    Function to fit the power spectrum of a single channel, returning a row of the table of calibration_files()
+
+    Args:
+        file (str): path of the file containing the data
+        label (str): name of the PSD channel
+        psd (pandas.DataFrame): two columns: frequency in [Hz] and power spectrum density in [V^2]
+        **kwargs: keyword arguments for the calibration of the channel, see channel_kwargs()
+
+    Returns:
+        fitRow (OrderedDict): file, channel, mode and fit parameters of the channel
+    """
+
+    fitParameters = calibration_psd(psd, **kwargs)
+    fitRow = od([("file", file), ("channel", CALIBRATION_CHANNELS[label]), ("mode", kwargs["mode"])])
+    for key in CALIBRATION_LABELS:
+        if key == "sigma":
+            fitRow["errorD"], fitRow["errorFc"] = fitParameters[key]
+        else:
+            fitRow[key] = fitParameters[key]
+
+    return fitRow
+
+
+@profiled_stage()
+def calibration_files(files, modes=(MODE,), processes=None, limits=LIMITS, blockNumber=BLOCKNUMBER, overlap=OVERLAP,
+                      **kwargs):
+    """
+    Function to calibrate many Foldometer calibration files in parallel. The files are read and their power spectra
+    calculated in a pool of processes, and every channel of every file is fitted with every mode as a separate task
+    in the same pool
+
+    Args:
+        files (list): paths of the files containing the data
+        modes (list): the methods to use for the fitting (see calibration_file()). Default is only MODE
+        processes (int): number of worker processes. If 1, everything runs in the current process. Default is None,
+            the number of CPUs
+        limits (list): frequency limits for consideration in the fitting. Default LIMITS (normally [150,15000] Hz)
+        blockNumber (float): number of averaged blocks in which the time series is divided for calculating the psd
+        overlap (float): number of points for overlapping blocks (Default: 0)
+        **kwargs: optional keyword arguments. Refer to the documentation of check_kwargs for possible arguments
+
+    Returns:
+        calibrationData (pandas.DataFrame): one row per file, channel and mode with the fit parameters and errors
+    """
+
+    if isinstance(modes, str):
+        modes = [modes]
+    kwargs.update({"limits": limits, "blockNumber": blockNumber, "overlap": overlap, "plot": False})
+
+    def fit_tasks(file, fileKwargs, psds):
+        for label, psd in psds.items():
+            for mode in modes:
+                channelKwargs = channel_kwargs(fileKwargs, label)
+                channelKwargs["mode"] = mode
+                yield file, label, psd, channelKwargs
+
+    fitRows = []
+    if processes == 1:
+        for file in files:
+            for file, label, psd, channelKwargs in fit_tasks(file, *calibration_file_psds(file, **kwargs)):
+                fitRows.append(calibration_channel(file, label, psd, **channelKwargs))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            psdFutures = {executor.submit(calibration_file_psds, file, **kwargs): file for file in files}
+            fitFutures = []
+            for psdFuture in as_completed(psdFutures):
+                for file, label, psd, channelKwargs in fit_tasks(psdFutures[psdFuture], *psdFuture.result()):
+                    fitFutures.append(executor.submit(calibration_channel, file, label, psd, **channelKwargs))
+            fitRows = [fitFuture.result() for fitFuture in fitFutures]
+
+    calibrationData = pd.DataFrame(fitRows, columns=["file", "channel", "mode", "D", "fc", "errorD", "errorFc",
+                                                     "chiSqr", "beta", "stiffness", "errorBeta", "errorStiff",
+                                                     "beadDiameter"])
+    #keep the order of the input files, whatever the order the tasks finished in
+    calibrationData["file"] = pd.Categorical(calibrationData["file"], categories=list(dict.fromkeys(files)),
+                                             ordered=True)
+    calibrationData = calibrationData.sort_values(["file", "channel", "mode"], kind="mergesort").reset_index(drop=True)
+    calibrationData["file"] = calibrationData["file"].astype(str)
+
+    return calibrationData
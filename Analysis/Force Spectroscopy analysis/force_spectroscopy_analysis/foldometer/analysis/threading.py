@@ -5,47 +5,177 @@ import pandas as pd
 import seaborn as sns
 from scipy.ndimage import label
 from scipy.signal import savgol_filter, welch
+from scipy.fft import next_fast_len
 
 from foldometer.physics.thermodynamics import thermal_energy
 from foldometer.physics.utils import as_Kelvin
 from foldometer.tools.misc import data_selection, column_indexer
+from foldometer.tools.profiling import profiled_stage
 import numpy as np
 from matplotlib.widgets import SpanSelector
 from scipy.stats import linregress
 
 
+#bin width of the pairwise distance histograms, in the units of the data (nm or aa)
+PAIRWISE_BIN_WIDTH = 0.1
+
+
+def rolling_slopes(x, y, window, center=True):
+    """
+    Function to calculate the least squares slope of y(x) in a rolling window. The sums of x, y, x^2 and x*y of every
+    window are differences of their cumulative sums, so all the slopes are computed at once in O(N)
+
+    Args:
+        x (numpy.array): independent variable (for instance time in seconds), sorted in increasing order
+        y (numpy.array): dependent variable
+        window (int or str): number of points of each window, or a time span like "600ms" (x in seconds)
+        center (bool): if True, the window is centered on each point, otherwise it ends at each point
+
+    Returns:
+        slopes (numpy.array): slope of each window. With windows of a number of points, the slope is NaN for incomplete
+            windows or windows with NaN values, as in pandas rolling. With time windows, incomplete windows at the edges
+            are used and windows with NaN values or less than two points are NaN
+    """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    positions = np.arange(n)
+    if isinstance(window, str):
+        width = pd.Timedelta(window).total_seconds()
+        if center:
+            starts = np.searchsorted(x, x - width / 2, side="left")
+            ends = np.searchsorted(x, x + width / 2, side="right")
+        else:
+            starts = np.searchsorted(x, x - width, side="right")
+            ends = positions + 1
+        complete = np.ones(n, dtype=bool)
+    else:
+        ends = positions + 1 + ((window - 1) // 2 if center else 0)
+        starts = ends - window
+        complete = (starts >= 0) & (ends <= n)
+        starts = np.clip(starts, 0, n)
+        ends = np.clip(ends, 0, n)
+
+    #Removing the mean and the global trend keeps the cumulative sums small, which limits their round-off error. The
+    #slope of the trend is added back at the end
+    missing = np.isnan(y) | np.isnan(x)
+    xc = np.where(missing, 0, x - np.mean(x[~missing]))
+    yc = np.where(missing, 0, y - np.mean(y[~missing]))
+    trend = np.dot(xc, yc) / np.dot(xc, xc) if np.any(xc) else 0
+    yc = np.where(missing, 0, yc - trend * xc)
+
+    def window_sum(values):
+        cumulative = np.concatenate(([0], np.cumsum(values)))
+        return cumulative[ends] - cumulative[starts]
+
+    points = ends - starts
+    sumX = window_sum(xc)
+    sumY = window_sum(yc)
+    covariance = points * window_sum(xc * yc) - sumX * sumY
+    variance = points * window_sum(xc ** 2) - sumX ** 2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slopes = covariance / variance + trend
+    slopes[~complete | (points < 2) | (window_sum(missing) > 0) | (variance <= 0)] = np.nan
+
+    return slopes
+
+
+@profiled_stage()
 def calculate_rolling_slopes(data, proteinLength, dt=None, window=600, columnY="surfaceSepX", selectData=False,
                              ylim=None, center=True, residuals=False):
-        if ylim is None and columnY is "proteinLc":
-            ylim = (-50, proteinLength + 50)
-        if selectData:
-            data = data_selection(data, columnX="time", columnY=columnY, ylim=ylim)
-            data = data[["time", columnY]]
-            data.index = data["time"]
-
-        data = data[["time", columnY]]
-        data.index = data["time"]
+    """
+    Function to calculate the translocation speed as the local slope of a channel against time (see rolling_slopes())
+
+    Args:
+        data (pandas.DataFrame): data with "time" and columnY columns
+        proteinLength (float): length of the protein in nanometers
+        dt (float): sampling period in seconds. If None, calculated as the mean time step. Only used for windows of a
+            number of points, which assume a constant sampling period
+        window (int or str): number of data points to calculate the slope from, or a time span like "600ms"
+        columnY (str): for translocation speed, either surfaceSepX or proteinLc
+        selectData (bool): if True, select a subset of the data
+        ylim (tuple): limits for selecting data. If None, automatically adapt to protein total length
+        center (bool): if True, the window is set in the center of the step, otherwise it ends at each point
+        residuals (bool): not used
+
+    Returns:
+        transSpeed (pandas.Series): slope of each window, indexed by time
+    """
+    if ylim is None and columnY is "proteinLc":
+        ylim = (-50, proteinLength + 50)
+    if selectData:
+        data = data_selection(data, columnX="time", columnY=columnY, ylim=ylim)
+
+    time = data["time"].values
+    if isinstance(window, str):
+        x = time
+    else:
         if not dt:
-            dt = data["time"].diff().mean()
+            dt = np.diff(time).mean()
+        x = np.arange(len(time)) * dt
+
+    return pd.Series(rolling_slopes(x, data[columnY].values, window, center), index=pd.Index(time, name="time"),
+                     name="transSpeed")
+
+
+def pairwise_distance_histogram(values, binWidth=PAIRWISE_BIN_WIDTH, density=True):
+    """
+    Function to calculate the histogram of the distances between all the pairs of points of a trace. The values are
+    counted in bins of binWidth and the autocorrelation of the counts, calculated with FFT, gives the number of pairs
+    at each distance, so the cost grows with N log(N) instead of N^2. Distances are resolved up to the bin width
+
+    Args:
+        values (numpy.array): values of the trace (for instance translocated length). NaN values are ignored
+        binWidth (float): width of the bins of the histogram, in the units of the values
+        density (bool): if True, the histogram is normalized to have an integral of 1. Default is True
+
+    Returns:
+        hist (numpy.array): number of pairs (or probability density) at each distance
+        distances (numpy.array): distances at the center of the bins, multiples of binWidth starting at 0
+    """
+
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    counts = np.bincount(np.floor((values - values.min()) / binWidth).astype(np.intp)).astype(float)
 
-        def summing_window(data):
-            return (data * np.arange(1, len(data)+1)).sum()
-        #print(self.metadata["sampleFreq"])
-        denominator = dt / 12 * (2 * window + window ** 3)
-        slopes = (data[columnY].rolling(window, center=center).apply(summing_window) - window /
-                  2 * data[columnY].rolling(window, center=center).mean() * (window + 1)) / denominator
+    #Zero padding to twice the length makes the circular correlation of the FFT linear
+    fftLength = next_fast_len(2 * len(counts) - 1)
+    countsFFT = np.fft.rfft(counts, fftLength)
+    hist = np.rint(np.fft.irfft(countsFFT * np.conj(countsFFT), fftLength)[:len(counts)])
+    #The pairs in the same bin are counted twice, plus each point with itself
+    hist[0] = (hist[0] - len(values)) / 2
+    distances = np.arange(len(hist)) * binWidth
+    if density:
+        hist /= hist.sum() * binWidth
 
-        data["transSpeed"] = np.nan
-        data.loc[slopes.index, "transSpeed"] = slopes
-        intercepts = data[columnY].rolling(window, center=center).mean() - \
-                     data["transSpeed"] * data["time"].rolling(window, center=center).mean()
-        residuals = data[columnY] - (data["transSpeed"] * data["time"] + intercepts)
-        #residualsSTD =
-        return data["transSpeed"]
+    return hist, distances
 
 
+@profiled_stage()
 def pairwise_calculation(data, proteinLength, selectData=False, channel="proteinLc", mode="nm", order=5, window=21,
-                         bins=None, plot=True):
+                         bins=None, plot=True, binWidth=None):
+    """
+    Function to calculate the distribution of the distances between all the pairs of points of a translocation trace
+    (see pairwise_distance_histogram()) and its power spectrum, which shows the periodicity of the steps
+
+    Args:
+        data (pandas.DataFrame): data of the trace, with "time" and channel columns
+        proteinLength (float): length of the protein in nanometers
+        selectData (bool): if True, select a subset of the data
+        channel (str): either "proteinLc" or "surfaceSepX"
+        mode (str): units of the translocated length of the protein, either "nm" or "aa"
+        order (int): order of the polynomial to use for the Savitzky-Golay filter
+        window (int): number of points to use for the Savitzky-Golay filter
+        bins (int): number of bins of the histogram in the range of the trace, only used if binWidth is None
+        plot (bool): if True, plot the trace, the histogram and the spectrum
+        binWidth (float): width of the bins of the histogram. If None, calculated from bins or PAIRWISE_BIN_WIDTH
+
+    Returns:
+        fRaw (numpy.array): spatial frequencies of the spectrum
+        psdRaw (numpy.array): power spectral density of the pairwise distance histogram
+    """
 
     if channel is "surfaceSepX":
         mode = "nm"
@@ -59,7 +189,6 @@ def pairwise_calculation(data, proteinLength, selectData=False, channel="protein
         data = data.loc[:, ["time", channel]]
         data.index = data["time"]
     sav_fil = lambda x: savgol_filter(x, window, order)
-    pairs = []
     if plot:
         fig = plt.figure(figsize=(8,6))
         ax1 = plt.subplot(121)
@@ -90,18 +219,17 @@ def pairwise_calculation(data, proteinLength, selectData=False, channel="protein
 
             ax1.set_yticks(major_ticks)
 
-    for shift in np.arange(len(data[channel]))[1:]:
-        pairs.extend(stepsData.diff(shift).dropna().values)
-    if not bins:
-        bins = len(pairs) // 500
-    hist, binEdges = np.histogram(pairs, bins=bins, density=True)
+    if binWidth is None:
+        #NaN values are ignored, as in pairwise_distance_histogram()
+        binWidth = (np.nanmax(stepsData.values) - np.nanmin(stepsData.values)) / bins if bins else PAIRWISE_BIN_WIDTH
+    hist, distances = pairwise_distance_histogram(stepsData.values, binWidth)
 
     blockLength = len(hist) // 2
-    fRaw, psdRaw = welch(hist, nperseg=blockLength, window="hann", fs=1/np.diff(binEdges).mean(), noverlap=8)
+    fRaw, psdRaw = welch(hist, nperseg=blockLength, window="hann", fs=1/binWidth, noverlap=8)
     print("Time interval: ", data["time"].min(), data["time"].max())
     if plot:
         ax1.set_xlabel("Time (s)")
-        ax2.hist(pairs, bins=bins, normed=True)
+        ax2.bar(distances, hist, width=binWidth)
         ax2.tick_params(labelleft="off")
         ax3.plot(fRaw, psdRaw, '-')
         ax3.set_ylim(0, max(psdRaw))
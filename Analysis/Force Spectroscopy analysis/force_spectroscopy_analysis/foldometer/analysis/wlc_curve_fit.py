@@ -6,13 +6,18 @@ from foldometer.tools.misc import data_selection
 from foldometer.physics.thermodynamics import thermal_energy
 from foldometer.physics.utils import as_Kelvin
 from foldometer.analysis.tweezers_parameters import PROTEIN_LENGTHS
+from foldometer.tools.profiling import profiled_stage
+from foldometer.tools.schema import compact_frame
 from scipy import ndimage
 from scipy.stats import norm
 import lmfit
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import warnings
+import os
 
 
 FORCE_MARGIN = 0.01
@@ -27,6 +32,20 @@ EXTENSION_OFFSET = 0.01
 FORCE_OFFSET = 0
 MIN_FORCE = 0.1
 MAX_FORCE = 50
+#fraction of the range of a parameter close to its limits where the optimum of a previous curve is not used to start
+WARM_START_MARGIN = 0.01
+#number of consecutive curves in a chain of warm starts, which are fitted together in a worker process. It does not
+#depend on the number of processes, so neither do the fits
+CURVES_PER_GROUP = 10
+#force range (pN), initial number of points and maximum number of points of the tables of the accurate DNA model
+TABLE_MIN_FORCE = 0.1
+TABLE_MAX_FORCE = 100
+TABLE_POINTS = 2 ** 12
+TABLE_MAX_POINTS = 2 ** 16
+#maximum interpolation error of the tables, as extension per unit of DNA contour length
+TABLE_TOLERANCE = 1e-7
+#number of tables kept in memory, one per set of DNA parameters
+TABLE_CACHE_SIZE = 32
 FIXED_PARAMETERS = ["contourLengthDNA", "persistenceLengthProtein", "temperature", "extensionOffset"]
 DEFAULT_PROPERTIES = {"contourLengthDNA": CONTOUR_LENGTH_DNA, "persistenceLengthDNA": PERSISTENCE_LENGTH_DNA,
                       "stretchModulusDNA": STRETCH_MODULUS_DNA, "contourLengthProtein": CONTOUR_LENGTH_PROTEIN,
@@ -74,12 +93,13 @@ def identify_individual_curves(data):
     assert ("unfolding" in data.columns), "In order to perform wlc fits, please analyse unfolding events first. This " \
                                           "can be done with the FoldoMeasurement class method analyse_data() or " \
                                           "manually with find_unfolding_events()"
-    wlcLabels = ndimage.label([not value for value in data["unfolding"]])[0] - 1
+    wlcLabels = ndimage.label(~data["unfolding"].values.astype(bool))[0] - 1
 
     wlcLabels[wlcLabels == -1] = - data["pullingCycle"].max() - 1
     data["wlcRegion"] = data["pullingCycle"] + wlcLabels
     data.loc[data["region"] == "stationary", "wlcRegion"] = -1
     data.loc[data["wlcRegion"] < 0, "wlcRegion"] = -1
+    compact_frame(data)
 
 
 def calculate_force_offset(data, axis="X", forceChannel="force", margin=FORCE_MARGIN):
@@ -172,6 +192,7 @@ def wlc_weights(curve, mean=30, sigma=10, plot=False):
     Returns:
         weights (numpy.array): array containing the weigth for each point of the curve
     """
+    import matplotlib.pyplot as plt
 
     weights = norm(loc=mean, scale=sigma)
     if plot:
@@ -183,7 +204,7 @@ def wlc_weights(curve, mean=30, sigma=10, plot=False):
 
 def wlc_fit_single_curve(model, curve, axis="X", forceChannel="force", distanceChannel="surfaceSep",
                          construct="protein", upperContourLength=10, weightMode="norm", weightNormMean=30,
-                         weightNormSigma=10):
+                         weightNormSigma=10, initialValues=None):
     """
     Function to fit a single pulling or retracting curve to the WLC
 
@@ -199,17 +220,26 @@ def wlc_fit_single_curve(model, curve, axis="X", forceChannel="force", distanceC
         use a normal distribution around weightNormMean with width weightNormSigma
         weightNormMean (float): the center of the weight distribution if weightMode is "norm"
         weightNormSigma (float): the width of the weight distribution is weightMode is "norm"
+        initialValues (dict): starting values for the varying parameters (e.g. the optimum of the previous curve).
+        Values closer to the limits than WARM_START_MARGIN of their range are ignored. None starts from the values of the model. Default is None
     Returns:
         wlcResult (lmfit.model.ModelResult): complete information of the fitting (check lmfit docs for more info)
     """
 
     parameters = model.make_params()
-    if construct is "protein":
+    if construct == "protein":
         proteinMaxLc = parameters["contourLengthProtein"].value + upperContourLength
         parameters["contourLengthProtein"].set(min=0, max=proteinMaxLc)
-    if weightMode is "norm":
+    if initialValues is not None:
+        for key, value in initialValues.items():
+            if key in parameters and parameters[key].vary:
+                #values close to the limits are not used, the fit hardly moves away from them
+                margin = np.nan_to_num(WARM_START_MARGIN * (parameters[key].max - parameters[key].min), posinf=0)
+                if parameters[key].min + margin < value < parameters[key].max - margin:
+                    parameters[key].set(value=value)
+    if weightMode == "norm":
         weights = wlc_weights(curve.loc[:, forceChannel + axis], mean=weightNormMean, sigma=weightNormSigma)
-    elif weightMode is "high":
+    elif weightMode == "high":
         weights = curve.loc[:, forceChannel + axis]
     elif weightMode is None:
         weights = None
@@ -220,9 +250,84 @@ def wlc_fit_single_curve(model, curve, axis="X", forceChannel="force", distanceC
     return wlcResult
 
 
+def wlc_model(construct="protein", **kwargs):
+    """
+    Function to create the lmfit model of the WLC, with the initial values and limits of the parameters
+
+    Args:
+        construct (str): either "protein" or "DNA", to generate a WLC model in accordance
+        **kwargs: keyword arguments already filled with wlc_curve_fit.check_kwargs, including fixedParameters
+
+    Returns:
+        wlcModel (lmfit.model.Model): model of worm-like-chain to be fitted
+    """
+
+    #Create the lmfit model with the series WLC for protein or the single WLC model for DNA
+    if construct == "protein":
+        fittingParamsLabels = ["contourLengthDNA", "persistenceLengthDNA", "stretchModulusDNA",
+                               "contourLengthProtein", "persistenceLengthProtein", "stretchModulusProtein",
+                               "temperature", "extensionOffset"]
+        wlcModel = lmfit.Model(wlc_series_accurate)
+    elif construct == "DNA":
+        fittingParamsLabels = ["contourLengthDNA", "persistenceLengthDNA", "stretchModulusDNA", "temperature",
+                               "extensionOffset"]
+        wlcModel = lmfit.Model(wlc)
+    #Add fitting parameters to the model
+    for key in kwargs.keys():
+        if key in fittingParamsLabels:
+            paramMin = kwargs[key] * (1 - kwargs["parameterRange"])
+            paramMax = kwargs[key] * (1 + kwargs["parameterRange"])
+            if key in kwargs["fixedParameters"]:
+                wlcModel.set_param_hint(key, value=kwargs[key], vary=False, min=paramMin, max=paramMax)
+            else:
+                wlcModel.set_param_hint(key, value=kwargs[key], vary=True, min=paramMin, max=paramMax)
+
+    return wlcModel
+
+
+def wlc_fit_curves(curves, construct="protein", modelKwargs=None, axis="X", forceChannel="force",
+                   distanceChannel="surfaceSep", upperLc=10, weightMode="norm", weightNormMean=30, weightNormSigma=10,
+                   warmStart=True):
+    """
+    Function to fit consecutive force-extension curves to the WLC. Each fit starts from the optimum of the previous
+    curve, which is usually very close and saves most of the iterations. It builds its own model, so it can run in a
+    worker process
+
+    Args:
+        curves (list): (wlcRegion, curve) tuples, with the data of each single force-extension curve
+        construct (str): either "protein" or "DNA", to generate a WLC model in accordance
+        modelKwargs (dict): keyword arguments for wlc_model()
+        axis (str): axis for which calculate the fit, either "X" or "Y"
+        forceChannel (str): either "PSD1Force", "PSD2Force" or "force" (combined signal)
+        distanceChannel (str): either "surfaceSep" (from PSDs) or "trackingSep" (from image tracking)
+        upperLc (float): margin given to the maximum possible contour length of protein
+        weightMode (str): see wlc_fit_single_curve()
+        weightNormMean (float): the center of the weight distribution if weightMode is "norm"
+        weightNormSigma (float): the width of the weight distribution is weightMode is "norm"
+        warmStart (bool): if True, each fit starts from the optimum of the previous curve. Default is True
+
+    Returns:
+        fits (list): (wlcRegion, lmfit.model.ModelResult) tuples in the same order as curves
+    """
+
+    wlcModel = wlc_model(construct, **modelKwargs)
+    fits = []
+    initialValues = None
+    for wlcRegion, curve in curves:
+        fit = wlc_fit_single_curve(wlcModel, curve, axis, forceChannel, distanceChannel, construct, upperLc,
+                                   weightMode, weightNormMean, weightNormSigma, initialValues)
+        fits.append((wlcRegion, fit))
+        if warmStart:
+            initialValues = {key: parameter.value for key, parameter in fit.params.items() if parameter.vary}
+
+    return fits
+
+
+@profiled_stage()
 def wlc_fit_data(data, tmin, tmax, axis="X", forceChannel="force", distanceChannel="surfaceSep", joinFitCurves=True,
                  calculateForceOffset=False, calculateExtensionOffset=True, construct="protein",
-                 protein="MBP", upperLc=10, weightMode="norm", weightNormMean=30, weightNormSigma=10, **kwargs):
+                 protein="MBP", upperLc=10, weightMode="norm", weightNormMean=30, weightNormSigma=10, processes=1,
+                 warmStart=True, **kwargs):
     """
     Function to identify, classify and fit each pulling and retracting curve to the WLC model
 
@@ -236,6 +341,10 @@ def wlc_fit_data(data, tmin, tmax, axis="X", forceChannel="force", distanceChann
         joinFitCurves (bool): offset in the extension in [nm]
         construct (str): either "protein" or "DNA", to generate a WLC model in accordance
         protein (str): name of the protein, to automatically set the proper contour length
+        processes (int): number of worker processes for the fits, which share the groups of CURVES_PER_GROUP
+        consecutive curves. None is the number of CPUs. Default is 1, all the fits run in the current process. The
+        fits are the same with any number of processes
+        warmStart (bool): if True, each fit starts from the optimum of the previous curve of its group. Default is True
         **kwargs: optional keyword arguments. Refer to the documentation of wlc_curve_fit.check_kwargs for arguments
 
     Returns:
@@ -249,32 +358,13 @@ def wlc_fit_data(data, tmin, tmax, axis="X", forceChannel="force", distanceChann
         print("Warning: the contour length of your protein is not registered in the database, falling back to MBP if "
               "not specified")
     kwargs = check_kwargs(kwargs)
-    #kwargs["fixedParameters"] = list(set(kwargs["fixedParameters"].extend(FIXED_PARAMETERS)))
-    kwargs["fixedParameters"].extend(FIXED_PARAMETERS)
-    kwargs["fixedParameters"] = list(set(kwargs["fixedParameters"]))
+    #new list, so neither the caller's list nor the default one are modified
+    kwargs["fixedParameters"] = list(set(list(kwargs["fixedParameters"]) + FIXED_PARAMETERS))
     print(kwargs["fixedParameters"])
 
-
-    #Create the lmfit model with the series WLC for protein or the single WLC model for DNA
-    if construct is "protein":
-        fittingParamsLabels = ["contourLengthDNA", "persistenceLengthDNA", "stretchModulusDNA",
-                               "contourLengthProtein", "persistenceLengthProtein", "stretchModulusProtein",
-                               "temperature", "extensionOffset"]
-        wlcModel = lmfit.Model(wlc_series_accurate)
-    elif construct is "DNA":
-        fittingParamsLabels = ["contourLengthDNA", "persistenceLengthDNA", "stretchModulusDNA", "temperature",
-                               "extensionOffset"]
-        wlcModel = lmfit.Model(wlc)
+    wlcModel = wlc_model(construct, **kwargs)
+    if construct == "DNA":
         calculateExtensionOffset = False
-    #Add fitting parameters to the model
-    for key in kwargs.keys():
-        if key in fittingParamsLabels:
-            paramMin = kwargs[key] * (1 - kwargs["parameterRange"])
-            paramMax = kwargs[key] * (1 + kwargs["parameterRange"])
-            if key in kwargs["fixedParameters"]:
-                wlcModel.set_param_hint(key, value=kwargs[key], vary=False, min=paramMin, max=paramMax)
-            else:
-                wlcModel.set_param_hint(key, value=kwargs[key], vary=True, min=paramMin, max=paramMax)
 
     #separate data in wlc single curves
     # identify_individual_curves(data)
@@ -302,6 +392,8 @@ def wlc_fit_data(data, tmin, tmax, axis="X", forceChannel="force", distanceChann
         data["wlcForce" + axis] = np.nan
         data["wlcExtension" + axis] = np.nan
 
+    curves = []
+    curveMasks = {}
     for wlcRegion in data["wlcRegion"].unique():
         if wlcRegion > -1:
             mask = (data["wlcRegion"] == wlcRegion) & (data["region"] != "stationary")
@@ -310,13 +402,30 @@ def wlc_fit_data(data, tmin, tmax, axis="X", forceChannel="force", distanceChann
                         (maskedData[forceChannel + axis] < kwargs["maxForce"])
             #make the WLC fit only if the segment is longer than 4 data points
             if len(maskedData[forceMask]) > 4:
-                fits[wlcRegion] = wlc_fit_single_curve(wlcModel, maskedData[forceMask], axis, forceChannel,
-                                                       distanceChannel, construct, upperLc, weightMode, weightNormMean,
-                                                       weightNormSigma)
+                curves.append((wlcRegion, maskedData.loc[forceMask, [forceChannel + axis, distanceChannel + axis]]))
+                curveMasks[wlcRegion] = mask
+
+    #consecutive curves are fitted in the same group, so they can start from the optimum of the previous one
+    if processes is None:
+        processes = os.cpu_count() or 1
+    curveGroups = [curves[start: start + CURVES_PER_GROUP] for start in range(0, len(curves), CURVES_PER_GROUP)]
+    fitArgs = (construct, kwargs, axis, forceChannel, distanceChannel, upperLc, weightMode, weightNormMean,
+               weightNormSigma, warmStart)
+    if processes <= 1 or len(curveGroups) <= 1:
+        fitGroups = [wlc_fit_curves(curveGroup, *fitArgs) for curveGroup in curveGroups]
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(curveGroups))) as executor:
+            fitGroups = list(executor.map(wlc_fit_curves, curveGroups,
+                                          *[[arg] * len(curveGroups) for arg in fitArgs]))
+
+    for fitGroup in fitGroups:
+        for wlcRegion, fit in fitGroup:
+            fits[wlcRegion] = fit
             #include the fitted extension and force to the DataFrame
-            if joinFitCurves and len(maskedData[forceMask]) > 4:
+            if joinFitCurves:
+                mask = curveMasks[wlcRegion]
                 data.loc[mask, ["wlcForce" + axis, "wlcExtension" + axis]] = \
-                    include_fit_curves(data[mask], fits[wlcRegion], axis, forceChannel)
+                    include_fit_curves(data[mask], fit, axis, forceChannel)
 
     return data, fits
 
@@ -370,19 +479,169 @@ def wlc_series(force, contourLengthDNA=CONTOUR_LENGTH_DNA, persistenceLengthDNA=
     return contourLengthDNA * (1 - 0.5 * np.sqrt(kbT / (force * persistenceLengthDNA)) + force / stretchModulusDNA) + \
            contourLengthProtein * (1 - 0.5 * np.sqrt(kbT / (force * persistenceLengthProtein))) + extensionOffset
 
+def dna_extension_fraction(force, persistenceLengthDNA=PERSISTENCE_LENGTH_DNA, stretchModulusDNA=STRETCH_MODULUS_DNA,
+                           temperature=TEMPERATURE, table=False):
+    """
+    Function calculating the extension of the DNA handles per unit of contour length with the accurate extensible WLC
+    model used in wlc_series_accurate()
+
+    Args:
+        force (numpy.array): array containing force data
+        persistenceLengthDNA (float): persistence length of the DNA handles
+        stretchModulusDNA (float): stretch modulus of the DNA handles
+        temperature (float): temperature in Celsius
+        table (bool): if True, interpolate in the cached table of the model for these parameters (see
+            dna_extension_table()) instead of evaluating it. Default is False
+
+    Returns:
+        extensionFraction (numpy.array): extension of the DNA handles divided by their contour length
+    """
+
+    if table:
+        return interpolate_dna_extension(force, dna_extension_table(float(persistenceLengthDNA),
+                                                                    float(stretchModulusDNA), float(temperature)))
+
+    kbT = thermal_energy(as_Kelvin(temperature))
+    A = (force * persistenceLengthDNA) / kbT
+    B = np.exp((900 / A) ** (1/4))
+
+    return 4 / 3 * (1 - 1 / np.sqrt(A + 1)) - 10 * B / (np.sqrt(A) * (B -1) ** 2) + \
+           A ** 1.62 / (3.55 + 3.8 * A ** 2.2) + force / stretchModulusDNA
+
+
+@lru_cache(maxsize=TABLE_CACHE_SIZE)
+def dna_extension_table(persistenceLengthDNA=PERSISTENCE_LENGTH_DNA, stretchModulusDNA=STRETCH_MODULUS_DNA,
+                        temperature=TEMPERATURE):
+    """
+    Function to tabulate dna_extension_fraction() on a grid evenly spaced in the logarithm of the force. The grid is
+    refined until the error of the linear interpolation, measured against the exact model in the middle of each
+    interval, is below TABLE_TOLERANCE. The tables are cached for each set of parameters
+
+    Args:
+        persistenceLengthDNA (float): persistence length of the DNA handles
+        stretchModulusDNA (float): stretch modulus of the DNA handles
+        temperature (float): temperature in Celsius
+
+    Returns:
+        table (dict): parameters of the table ("parameters"), logarithm of the first force ("logForceStart") and step
+            ("logForceStep") of the grid, tabulated extension fractions ("values") and maximum interpolation error
+            ("maxError")
+    """
+
+    parameters = (persistenceLengthDNA, stretchModulusDNA, temperature)
+    logStart, logEnd = np.log(TABLE_MIN_FORCE), np.log(TABLE_MAX_FORCE)
+    points = TABLE_POINTS
+    while True:
+        logForce, logStep = np.linspace(logStart, logEnd, points, retstep=True)
+        values = dna_extension_fraction(np.exp(logForce), *parameters)
+        middleValues = dna_extension_fraction(np.exp(logForce[:-1] + logStep / 2), *parameters)
+        maxError = np.max(np.abs((values[:-1] + values[1:]) / 2 - middleValues))
+        if maxError <= TABLE_TOLERANCE or points >= TABLE_MAX_POINTS:
+            break
+        points *= 2
+    if maxError > TABLE_TOLERANCE:
+        warnings.warn("Interpolation error of the DNA extension table is {:.1e}, the exact model will be used "
+                      "instead".format(maxError))
+    values.flags.writeable = False
+
+    return {"parameters": parameters, "logForceStart": logStart, "logForceStep": logStep, "values": values,
+            "maxError": maxError}
+
+
+def interpolate_dna_extension(force, table):
+    """
+    Function to interpolate linearly the extension fraction of the DNA handles in a table made with
+    dna_extension_table(). Forces outside the table, and all of them if the error of the table is above
+    TABLE_TOLERANCE, are evaluated with the exact model
+
+    Args:
+        force (numpy.array): array containing force data
+        table (dict): table made with dna_extension_table()
+
+    Returns:
+        extensionFraction (numpy.array): extension of the DNA handles divided by their contour length
+    """
+
+    if table["maxError"] > TABLE_TOLERANCE:
+        return dna_extension_fraction(force, *table["parameters"])
+
+    forceValues = np.asarray(force, dtype=float)
+    values = table["values"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        position = (np.log(forceValues) - table["logForceStart"]) / table["logForceStep"]
+    inTable = (position >= 0) & (position <= len(values) - 1)
+
+    extensionFraction = np.empty_like(forceValues)
+    position = position[inTable]
+    index = np.minimum(position.astype(np.intp), len(values) - 2)
+    weight = position - index
+    extensionFraction[inTable] = values[index] * (1 - weight) + values[index + 1] * weight
+    if not inTable.all():
+        with np.errstate(divide="ignore", invalid="ignore"):
+            extensionFraction[~inTable] = dna_extension_fraction(forceValues[~inTable], *table["parameters"])
+
+    if isinstance(force, pd.Series):
+        return pd.Series(extensionFraction, index=force.index, name=force.name)
+    return extensionFraction
+
+
 def wlc_series_accurate(force, contourLengthDNA=CONTOUR_LENGTH_DNA, persistenceLengthDNA=PERSISTENCE_LENGTH_DNA,
                         stretchModulusDNA=STRETCH_MODULUS_DNA, contourLengthProtein=CONTOUR_LENGTH_PROTEIN,
                         persistenceLengthProtein=PERSISTENCE_LENGTH_PROTEIN, temperature=TEMPERATURE,
                         extensionOffset=EXTENSION_OFFSET):
+    """
+    Function calculating two WLC in series: one for the DNA handles (accurate extensible WLC, see
+    dna_extension_fraction()) and another for the protein, without any stretch modulus. This is the model function of
+    the WLC fits (see wlc_model()), so all its arguments but the force are fit parameters
+
+    Args:
+        force (numpy.array): array containing force data
+        contourLengthDNA (float): contour length of the DNA handles
+        persistenceLengthDNA (float): persistence length of the DNA handles
+        stretchModulusDNA (float): stretch modulus of the DNA handles
+        contourLengthProtein (float): contour length of the protein
+        persistenceLengthProtein (float): persistence length of the protein
+        temperature (float): temperature in Celsius
+        extensionOffset (float): offset in the distance between surfaces
+
+    Returns:
+        extension (array): array containing the calculated extension from the force according to the WLC model
+    """
+
     kbT = thermal_energy(as_Kelvin(temperature))
-    A = (force * persistenceLengthDNA) / kbT
-    B = np.exp((900 / A) ** (1/4))
 
-    return contourLengthDNA * (4 / 3 * (1 - 1 / np.sqrt(A + 1)) - 10 * B / (np.sqrt(A) * (B -1) ** 2) +
-                               A ** 1.62 / (3.55 + 3.8 * A ** 2.2) + force / stretchModulusDNA) + \
+    return contourLengthDNA * dna_extension_fraction(force, persistenceLengthDNA, stretchModulusDNA, temperature) + \
            contourLengthProtein * (1 - 0.5 * np.sqrt(kbT / (force * persistenceLengthProtein))) + extensionOffset
 
 
+def wlc_series_accurate_table(force, contourLengthDNA=CONTOUR_LENGTH_DNA, persistenceLengthDNA=PERSISTENCE_LENGTH_DNA,
+                              stretchModulusDNA=STRETCH_MODULUS_DNA, contourLengthProtein=CONTOUR_LENGTH_PROTEIN,
+                              persistenceLengthProtein=PERSISTENCE_LENGTH_PROTEIN, temperature=TEMPERATURE,
+                              extensionOffset=EXTENSION_OFFSET):
+    """
+    Function calculating the same two WLC in series as wlc_series_accurate(), with the DNA model interpolated in a
+    cached table (see dna_extension_table()). Use it when the same parameters are evaluated many times, not for fitting
+
+    Args:
+        force (numpy.array): array containing force data
+        contourLengthDNA (float): contour length of the DNA handles
+        persistenceLengthDNA (float): persistence length of the DNA handles
+        stretchModulusDNA (float): stretch modulus of the DNA handles
+        contourLengthProtein (float): contour length of the protein
+        persistenceLengthProtein (float): persistence length of the protein
+        temperature (float): temperature in Celsius
+        extensionOffset (float): offset in the distance between surfaces
+
+    Returns:
+        extension (array): array containing the calculated extension from the force according to the WLC model
+    """
+
+    kbT = thermal_energy(as_Kelvin(temperature))
+
+    return contourLengthDNA * dna_extension_fraction(force, persistenceLengthDNA, stretchModulusDNA, temperature,
+                                                     table=True) + \
+           contourLengthProtein * (1 - 0.5 * np.sqrt(kbT / (force * persistenceLengthProtein))) + extensionOffset
+
 
 def wlc_from_fit(force, fit, accurate=True):
     args = (fit.params["contourLengthDNA"].value, fit.params["persistenceLengthDNA"].value,
@@ -394,6 +653,7 @@ def wlc_from_fit(force, fit, accurate=True):
         return wlc_series(force, *args)
 
 
+@profiled_stage()
 def protein_contour_length(extension, force, contourLengthDNA=CONTOUR_LENGTH_DNA,
                            persistenceLengthDNA=PERSISTENCE_LENGTH_DNA, stretchModulusDNA=STRETCH_MODULUS_DNA,
                            contourLengthProtein=CONTOUR_LENGTH_PROTEIN,
@@ -419,10 +679,11 @@ def protein_contour_length(extension, force, contourLengthDNA=CONTOUR_LENGTH_DNA
            (1 - 0.5 * np.sqrt(kbT / (force * persistenceLengthProtein)))
 
 
+@profiled_stage()
 def protein_contour_length_accurate(extension, force, contourLengthDNA=CONTOUR_LENGTH_DNA,
                            persistenceLengthDNA=PERSISTENCE_LENGTH_DNA, stretchModulusDNA=STRETCH_MODULUS_DNA,
                            contourLengthProtein=CONTOUR_LENGTH_PROTEIN,
-                           persistenceLengthProtein=PERSISTENCE_LENGTH_PROTEIN, temperature=TEMPERATURE):
+                           persistenceLengthProtein=PERSISTENCE_LENGTH_PROTEIN, temperature=TEMPERATURE, table=True):
     """
     Function to calculate the protein contour length from the force and extension data
     Args:
@@ -433,14 +694,15 @@ def protein_contour_length_accurate(extension, force, contourLengthDNA=CONTOUR_L
         stretchModulusDNA (float): stretch modulus of the DNA handles
         persistenceLengthProtein (float): persistence length of the protein
         temperature (float): temperature in Celsius
+        table (bool): if True, the DNA model is interpolated in a cached table (see dna_extension_table()). Default
+            is True
 
     Returns:
         LcProtein (pandas.Series): array with the protein contour length
     """
 
     kbT = thermal_energy(as_Kelvin(temperature))
-    A = (force * persistenceLengthDNA) / kbT
-    B = np.exp((900 / A) ** (1/4))
-    return (extension - contourLengthDNA * (4 / 3 * (1 - 1 / np.sqrt(A + 1)) - 10 * B / (np.sqrt(A) * (B -1) ** 2) +
-                               A ** 1.62 / (3.55 + 3.8 * A ** 2.2) + force / stretchModulusDNA)) / \
-           (1 - 0.5 * np.sqrt(kbT / (force * persistenceLengthProtein)))
\ No newline at end of file
+
+    return (extension - contourLengthDNA * dna_extension_fraction(force, persistenceLengthDNA, stretchModulusDNA,
+                                                                  temperature, table)) / \
+           (1 - 0.5 * np.sqrt(kbT / (force * persistenceLengthProtein)))
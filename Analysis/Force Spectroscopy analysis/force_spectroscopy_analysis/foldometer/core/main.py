@@ -1,34 +1,62 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from foldometer.ixo.binary import read_file, read_header, read_calibration_fit_values
+from foldometer.ixo.binary import read_file, read_header, read_calibration_fit_values, read_time_window
 from foldometer.analysis.thermal_calibration import calibration_file, calibration_data
 from foldometer.analysis.region_classification import assign_regions
 from foldometer.analysis.event_classification import find_unfolding_events
 from foldometer.analysis.noise_reduction import correct_signal_noise
+from foldometer.analysis.drift import remove_drift_cycles, reference_mask, plot_drift, DRIFT_CHANNELS
 from foldometer.analysis.fluorescence import plot_contour_fluorescence, align_fluorescence_data
 from foldometer.ixo.data_conversion import process_data, data_beadData_merging
 from foldometer.ixo.old_setup import read_file_old_setup
 from foldometer.ixo.lumicks_c_trap import *
-from foldometer.tools.misc import data_selection, column_indexer, data_deletion
+from foldometer.tools.misc import data_selection, column_indexer, range_selection
+from foldometer.tools.selection import apply_selection, exclusion
 from foldometer.analysis.tweezers_parameters import MIRRORVOLTDISTANCEFACTOR, get_mirror_values, CCD_PIXEL_NM, PROTEIN_LENGTHS
 from foldometer.analysis.wlc_curve_fit import wlc_fit_data, protein_contour_length, protein_contour_length_accurate
-from foldometer.tools.plots import force_extension_curve
-import gc
+from foldometer.tools.profiling import Profile, profiled_stage
+from foldometer.tools.cache import source_key
 
 from nptdms import TdmsFile
 from nptdms import TdmsFile
 from scipy import ndimage
 from scipy.signal import savgol_filter
-from copy import copy, deepcopy
+from copy import deepcopy
+from collections import OrderedDict as od
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import pkg_resources
 import simplejson as json
-import os
+import weakref
 from pprint import pprint
 
+#Data stages of a measurement and the stage each one is derived from. A derived stage shares the memory of its parent
+#(shallow copy or slice) until its values are changed in place, see Folding.own_stage()
+DATA_STAGES = od([("allRawData", None), ("rawData", "allRawData"), ("allData", "rawData"), ("data", "allData")])
+
+
+def column_arrays(data):
+    """
+    Function to get the arrays holding the values of each column of a DataFrame, without copying them
+
+    Args:
+        data (pandas.DataFrame): DataFrame to inspect
+
+    Returns:
+        arrays (list): one numpy array per column (the codes for categorical columns)
+    """
+
+    arrays = []
+    for position in range(data.shape[1]):
+        values = data.iloc[:, position].values
+        if not isinstance(values, np.ndarray):
+            values = getattr(values, "codes", np.asarray(values))
+        arrays.append(values)
+
+    return arrays
+
+
 def lazyprop(fn):
     attr_name = '_lazy_' + fn.__name__
     @property
@@ -49,6 +77,10 @@ class Folding(object):
         protein (str): Protein used for the experiment. In the newer Foldometer version this is in metadata
         condition (dict): Dictionary containing different conditions like chaperones, buffer, temperature...
         setup (str): which setup was used for the data. Either "ST", "DT" or "LT"
+        timeInterval (list): [tStart, tEnd] to read only that part of the file (only for "DT" and "CT" setups). None
+            reads the whole file
+        profile (bool): if True, the reading of the file and every method of the analysis record their duration, rows
+            and memory in the profile attribute (see foldometer.tools.profiling). Default is False
 
     Attributes:
         axis (str): Axis to perform operations. Default when creating the class is X axis
@@ -57,68 +89,83 @@ class Folding(object):
         allRawData (pandas.DataFrame): DataFrame containing all raw data generated in the setup
         beadTrack (pandas.DataFrame): DataFrame containing all bead tracking data (empty if tracking was disable)
         thermalCalibration (pandas.DataFrame): DataFrame with the thermal calibration parameters used by the class
+        rawData, allData, data (pandas.DataFrame): derived data stages (see DATA_STAGES). They share the memory of the
+            stage they come from until their values are changed, see own_stage() and memory_report()
+        selections (dict): rules of the selections and deletions of each data stage, see apply_selections()
+        sources (dict): source of the data of each stage, which identifies it in the cache of the pipeline stages, see
+            data_source()
+        profile (foldometer.tools.profiling.Profile): records of the profiled stages, see profiling()
     """
 
-    def __init__(self, filePath, protein="unknown", condition={}, setup="DT", fluorescenceFilePath=None):
-        self.protein = protein
-        self.filePath = filePath
-        self.condition = condition
-        self.setup = setup
-        self.axis = "X"
-        self.paramsWLC = {}
+    def __init__(self, filePath, protein="unknown", condition={}, setup="DT", fluorescenceFilePath=None,
+                 timeInterval=None, profile=False):
+        self.profile = Profile(enabled=profile)
+        if profile:
+            self.profile.start()
         try:
-            self.proteinLength = PROTEIN_LENGTHS[self.protein]
-        except:
-            self.proteinLength = None
-
-        #========New setup data format========
-        if self.setup is "DT":
-            self.metadata, self.foldometerCalFit, self.allRawData, self.beadTrack = read_file(self.filePath)
-            self.rawData = deepcopy(self.allRawData)
-            self.thermalCalibration = deepcopy(self.foldometerCalFit)
-            self.offset = self.thermalCalibration["offset"]
-            if "TestingDataFile" not in filePath:
-                #self.thermalCalibration = deepcopy(self.foldometerCalFit)0
-                self.protein = self.metadata["protein"].decode('utf-8')
-                try:
-                    self.condition = json.loads(self.metadata["condition"].decode('utf-8'))
-                except:
-                    self.condition = self.metadata["condition"].decode('utf-8')
-            if self.metadata["fileVersion"] > 40 and len(self.beadTrack["Bead1X"]) > 0:
-                self.beadTrack.loc[:, "Bead1X":"Bead2Y"] *= CCD_PIXEL_NM * 1e9
-
-        #========Old setup data format========
-        elif self.setup is "ST":
-            self.allRawData = read_file_old_setup(self.filePath)
-            self.rawData = deepcopy(self.allRawData)
-            self.allData = deepcopy(self.allRawData)
-            self.data = deepcopy(self.allData)
-
-        #========Lumicks C-Trap data format========
-        elif self.setup is "CT":
-
-            self.allRawData = read_file_lumicks(self.filePath)
-            self.rawData = deepcopy(self.allRawData)
-            self.allData = deepcopy(self.allRawData)
-            self.data = deepcopy(self.allData)
-            self.metadata = {}
-            for spectrumFileName in os.listdir(os.path.split(self.filePath)[0]):
-                if spectrumFileName.endswith("Power Spectrum.tdms") and spectrumFileName[9:15] <= os.path.split(
-                        self.filePath)[1][9:15]:
-                    calibrationFilePath = os.path.join(os.path.split(self.filePath)[0], spectrumFileName)
-            self.pythonCalFit = None
-            self.foldometerCalFit = extract_calibration_parameters(calibrationFilePath)
-            self.foldometerCalFit["beadDiameter"] *= 1000
-            self.foldometerCalFit["beta"] = 0.001 / self.foldometerCalFit["distanceResponse"]
-            self.thermalCalibration = self.foldometerCalFit
-            self.metadata["beadRadius1"] = self.thermalCalibration.loc["PSD1x", "beadDiameter"] / 2
-            self.metadata["beadRadius2"] = self.thermalCalibration.loc["PSD2x", "beadDiameter"] / 2
-            if fluorescenceFilePath is not None:
-                self.fluoData, self.fluoTimeRes = read_fluorescence_file_lumicks(fluorescenceFilePath)
-
-        self.timeInterval = [self.rawData["time"].min(), self.rawData["time"].max()]
-        gc.collect()
+            self.protein = protein
+            self.filePath = filePath
+            self.condition = condition
+            self.setup = setup
+            self.axis = "X"
+            self.paramsWLC = {}
+            self.selections = od([("rawData", []), ("allData", []), ("data", [])])
+            self.sources = od()
+            try:
+                self.proteinLength = PROTEIN_LENGTHS[self.protein]
+            except:
+                self.proteinLength = None
 
+            #========New setup data format========
+            if self.setup is "DT":
+                if timeInterval is None:
+                    self.metadata, self.foldometerCalFit, self.allRawData, self.beadTrack = read_file(self.filePath)
+                else:
+                    self.metadata, self.foldometerCalFit, self.allRawData, self.beadTrack = \
+                        read_time_window(self.filePath, *timeInterval)
+                self.set_source("allRawData", source_key("read_file", self.filePath, timeInterval))
+                self.derive_stage("rawData")
+                self.thermalCalibration = deepcopy(self.foldometerCalFit)
+                self.offset = self.thermalCalibration["offset"]
+                if "TestingDataFile" not in filePath:
+                    #self.thermalCalibration = deepcopy(self.foldometerCalFit)0
+                    self.protein = self.metadata["protein"].decode('utf-8')
+                    try:
+                        self.condition = json.loads(self.metadata["condition"].decode('utf-8'))
+                    except:
+                        self.condition = self.metadata["condition"].decode('utf-8')
+                if self.metadata["fileVersion"] > 40 and len(self.beadTrack["Bead1X"]) > 0:
+                    self.beadTrack.loc[:, "Bead1X":"Bead2Y"] *= CCD_PIXEL_NM * 1e9
+
+            #========Old setup data format========
+            elif self.setup is "ST":
+                self.allRawData = read_file_old_setup(self.filePath)
+                self.set_source("allRawData", source_key("read_file_old_setup", self.filePath))
+                self.derive_stage("rawData")
+                self.derive_stage("allData")
+                self.derive_stage("data")
+
+            #========Lumicks C-Trap data format========
+            elif self.setup is "CT":
+
+                self.allRawData = read_file_lumicks(self.filePath, channels=FD_COMPACT_CHANNELS, timeRange=timeInterval)
+                self.set_source("allRawData", source_key("read_file_lumicks", self.filePath, FD_COMPACT_CHANNELS,
+                                                         timeInterval))
+                self.derive_stage("rawData")
+                self.derive_stage("allData")
+                self.derive_stage("data")
+                self.metadata = {}
+                self.pythonCalFit = None
+                self.foldometerCalFit = calibration_lumicks(power_spectrum_file(self.filePath))
+                self.thermalCalibration = self.foldometerCalFit
+                self.metadata["beadRadius1"] = self.thermalCalibration.loc["PSD1x", "beadDiameter"] / 2
+                self.metadata["beadRadius2"] = self.thermalCalibration.loc["PSD2x", "beadDiameter"] / 2
+                if fluorescenceFilePath is not None:
+                    self.fluoData, self.fluoTimeRes = read_fluorescence_file_lumicks(fluorescenceFilePath)
+
+            self.timeInterval = [self.rawData["time"].min(), self.rawData["time"].max()]
+        finally:
+            self.profile.stop()
 
     def __str__(self):
         return "Foldometer measurement corresponding to the file: %s" % (self.filePath)
@@ -137,7 +184,136 @@ class Folding(object):
             raise ValueError("Axis should be 'x'or 'y'")
         self.axis = str.upper(axis)
 
+    def derive_stage(self, stage, data=None):
+        """
+        Set a data stage as a shallow copy of its parent stage (see DATA_STAGES), sharing the memory of its values.
+        Adding columns or changing the index of the stage does not affect the parent
+
+        Args:
+            stage (str): name of the stage, one of DATA_STAGES
+            data (pandas.DataFrame): data to derive the stage from. Default is the parent stage
+        """
+        parentData = getattr(self, DATA_STAGES[stage], None)
+        if data is None:
+            data = parentData
+        setattr(self, stage, data.copy(deep=False))
+        self.set_source(stage, self.data_source(DATA_STAGES[stage]) if data is parentData else None)
+
+    def own_stage(self, stage):
+        """
+        Copy the values of a data stage if they are shared with any other stage. Call it before changing the values of
+        the stage in place, so the other stages are not affected. The stage loses its source, see data_source()
+
+        Args:
+            stage (str): name of the stage, one of DATA_STAGES
+
+        Returns:
+            data (pandas.DataFrame): the data of the stage, not sharing memory with any other stage
+        """
+        data = getattr(self, stage)
+        otherArrays = [array for otherStage in DATA_STAGES if otherStage != stage and hasattr(self, otherStage)
+                       for array in column_arrays(getattr(self, otherStage))]
+        if any(np.may_share_memory(array, otherArray) for array in column_arrays(data) for otherArray in otherArrays):
+            setattr(self, stage, data.copy())
+        self.set_source(stage, None)
+
+        return getattr(self, stage)
+
+    def set_source(self, stage, source):
+        """
+        Record the source of the data of a stage, see data_source()
+
+        Args:
+            stage (str): name of the stage, one of DATA_STAGES
+            source (str): key of the source (see foldometer.tools.cache.source_key()). None if it is unknown
+        """
+        if source is None:
+            self.sources.pop(stage, None)
+        else:
+            data = getattr(self, stage)
+            self.sources[stage] = (weakref.ref(data), tuple(data.columns), len(data), source)
+
+    def data_source(self, stage):
+        """
+        Source of the data of a stage: the file it was read from and the cached stages it went through (see
+        foldometer.tools.cache). It identifies the data in the cache of the pipeline stages without hashing its values.
+        The source is lost when the data of the stage is replaced, its columns or rows change, or own_stage() is called
+
+        Args:
+            stage (str): name of the stage, one of DATA_STAGES
+
+        Returns:
+            source (str): key of the source, or None if it is unknown
+        """
+        if stage not in self.sources:
+            return None
+        dataReference, columns, rows, source = self.sources[stage]
+        data = getattr(self, stage, None)
+        if dataReference() is not data or tuple(data.columns) != columns or len(data) != rows:
+            return None
+
+        return source
+
+    def run_cached_stage(self, stage, function, parentStage, *args, **kwargs):
+        """
+        Run a cached stage of the pipeline (see foldometer.tools.cache.cached_stage()) on data coming from another
+        stage, identified in the cache by its source, and store the result and its source in a stage
+
+        Args:
+            stage (str): name of the stage where the result is stored, one of DATA_STAGES
+            function (function): cached stage of the pipeline
+            parentStage (str): name of the stage the data passed to the function comes from, one of DATA_STAGES
+            *args: arguments of the function
+            **kwargs: keyword arguments of the function
+        """
+        source = self.data_source(parentStage)
+        setattr(self, stage, function(*args, source=source, **kwargs))
+        self.set_source(stage, function.call_key(*args, source=source, **kwargs))
+
+    def memory_report(self):
+        """
+        Memory held by each data stage. The values shared between stages (shallow copies or slices) are counted only in
+        the first stage holding them, so the sum of "ownBytes" is the memory used by the measurement data
+
+        Returns:
+            report (pandas.DataFrame): for each stage, its parent, the number of rows and columns, the bytes of all its
+            values and the bytes not shared with the previous stages
+        """
+        report = od([(label, []) for label in ["stage", "parent", "rows", "columns", "bytes", "ownBytes"]])
+        countedArrays = []
+        for stage, parent in DATA_STAGES.items():
+            if not hasattr(self, stage):
+                continue
+            data = getattr(self, stage)
+            arrays = column_arrays(data)
+            if not isinstance(data.index, pd.RangeIndex):
+                arrays.append(np.asarray(data.index))
+            ownArrays = [array for array in arrays if not any(np.may_share_memory(array, countedArray)
+                                                               for countedArray in countedArrays)]
+            countedArrays += arrays
+            for label, value in zip(report, [stage, parent, data.shape[0], data.shape[1],
+                                             sum(array.nbytes for array in arrays),
+                                             sum(array.nbytes for array in ownArrays)]):
+                report[label].append(value)
+
+        return pd.DataFrame(report).set_index("stage")
+
+    def profiling(self):
+        """
+        Profile the stages run inside a with statement, also when the measurement was created without profile=True
+
+        Example:
+            >>> with measurement.profiling():
+            ...     measurement.process_data()
+            >>> measurement.profile.to_frame()
+
+        Returns:
+            profile (foldometer.tools.profiling.Profile): the profile of the measurement, as a context manager
+        """
+        return self.profile
+
     # <editor-fold desc="Thermal calibration methods">
+    @profiled_stage()
     def new_thermal_calibration(self, calibrationPath, **kwargs):
         """
         Perform a thermal calibration using Python routines instead of the Foldometer values. Requires a calibration
@@ -184,11 +360,22 @@ class Folding(object):
 
     # </editor-fold>
 
-    def remove_drift(self):
+    @profiled_stage()
+    def remove_drift(self, reference=None, degree=0, plot=True):
         """
-        Removes the drift introduced by the machine in long term
+        Removes the drift introduced by the machine in long term, see foldometer.analysis.drift.remove_drift_cycles().
+        The coefficients of the drift of each cycle are stored in driftCoefficients
+
+        Args:
+            reference: reference part of the data, where the signal should be the same in all the cycles: (minimum,
+                maximum) of MirrorX, index labels or boolean mask (see foldometer.analysis.drift.reference_mask()). If
+                None, it is selected in a plot (setup "DT")
+            degree (int): degree of the polynomial of MirrorX fitted to the reference of each cycle. 0 (default)
+                removes the offset of each cycle
+            plot (bool): if True, the signal before and after the correction is plotted
         """
         if self.setup is "DT":
+            self.own_stage("rawData")
             STATIONARYMIRRORX, STATIONARYMIRRORY = get_mirror_values(self.metadata)
             pd.set_option('mode.chained_assignment', None)
 
@@ -196,88 +383,116 @@ class Folding(object):
 
             self.rawData["trapSepX"] = trapSeparationX
             self.rawData = assign_regions(self.rawData, verbose=False)
-            self.averageData = data_selection(self.rawData, columnX="MirrorX", columnY="PSD1VxDiff")
-
-            grouped1 = self.averageData.groupby(["region", "pullingCycle"])["PSD1VxDiff"]
-            grouped2 = self.averageData.groupby(["region", "pullingCycle"])["PSD2VxDiff"]
-
-            plt.plot(self.rawData["trapSepX"], (self.rawData["PSD1VxDiff"] - self.rawData["PSD2VxDiff"])/2, color="blue")
-            for region in ["pulling", "retracting"]:
-                for pullingCycle in self.averageData.loc[self.averageData["region"]==region, "pullingCycle"].unique():
-                    mask = (self.rawData["region"] == region) & (self.rawData["pullingCycle"] == pullingCycle)
-                    firstPoint = self.averageData.loc[self.averageData["region"]==region, "pullingCycle"].unique()[0]
-                    diff1 = grouped1.get_group((region, pullingCycle)).mean() - grouped1.get_group((region,
-                                                                                                    firstPoint)).mean()
-                    self.rawData.loc[mask, "PSD1VxDiff"] -= diff1
-                    diff2 = grouped2.get_group((region, pullingCycle)).mean() - grouped2.get_group((region,
-                                                                                                    firstPoint)).mean()
-                    self.rawData.loc[mask, "PSD2VxDiff"] -= diff2
-
-            #print(self.rawData.loc[self.averageData.index, "PSD1VxDiff"].groupby("region").mean())
-            self.rawData.loc[self.rawData["region"]=="retracting", "PSD1VxDiff"] -= \
-                self.rawData.loc[self.averageData.index, :].groupby("region").get_group("retracting").PSD1VxDiff.mean()-\
-                    self.rawData.loc[self.averageData.index, :].groupby("region").get_group("pulling").PSD1VxDiff.mean()
-            self.rawData.loc[self.rawData["region"]=="retracting", "PSD2VxDiff"] -= \
-                self.rawData.loc[self.averageData.index, :].groupby("region").get_group("retracting").PSD2VxDiff.mean()-\
-                    self.rawData.loc[self.averageData.index, :].groupby("region").get_group("pulling").PSD2VxDiff.mean()
-
-            plt.plot(self.rawData["trapSepX"], (self.rawData["PSD1VxDiff"] - self.rawData["PSD2VxDiff"])/2, color="red")
-            plt.show()
+            if reference is None:
+                reference = data_selection(self.rawData, columnX="MirrorX", columnY="PSD1VxDiff").index
+            self.averageData = self.rawData.loc[reference_mask(self.rawData, reference, "MirrorX")]
+
+            corrected, self.driftCoefficients = remove_drift_cycles(self.rawData, reference, DRIFT_CHANNELS,
+                                                                    variable="MirrorX", degree=degree)
+            if plot:
+                plot_drift(self.rawData, corrected)
+            self.rawData[DRIFT_CHANNELS] = corrected
 
         elif self.setup is "ST":
-            self.data = correct_signal_noise(self.data)
+            self.data = correct_signal_noise(self.own_stage("data"))
             self.data["forceX"] -= self.data["forceX"].min() - 0.2
 
-    def select_data(self, raw=True, subset=False, columnX="time", columnY="PSD1VxDiff"):
+    def select_data(self, raw=True, subset=False, columnX="time", columnY="PSD1VxDiff", selection=None):
         """
-        Method to select a portion of either the raw or the processed data
+        Method to select a portion of either the raw or the processed data. The selection is recorded in the
+        selections attribute, see apply_selections()
 
         Args:
             raw (bool): if True, the selection is of the raw data directly read from file. If False, select from
             processed data
+            subset (bool): if True, select from the current selection instead of from all the data. Default is False
             columnX (str): name of the column to display in the X axis
             columnY (str): name of the column to display in the Y axis
+            selection (list): rules of the selection (see foldometer.tools.selection), applied without opening the
+                plot. None opens the plot to select a range of columnX
         """
         if raw:
-            if subset:
-                self.rawData = data_selection(self.rawData, columnX=columnX, columnY=columnY)
-            else:
-                self.rawData = data_selection(self.allRawData, columnX=columnX, columnY=columnY)
+            sourceData = self.rawData if subset else self.allRawData
+            if selection is None:
+                selection = [range_selection(sourceData, columnX=columnX, columnY=columnY)]
+            self.rawData = apply_selection(sourceData, selection, view=True)
+            self.selections["rawData"] = (self.selections["rawData"] if subset else []) + list(selection)
         else:
             if columnY not in self.allData.columns:
                 columnY = "forceX"
             try:
-                if subset:
-                    self.data = data_selection(self.data, columnX=columnX, columnY=columnY)
-                else:
-                    self.data = data_selection(self.allData, columnX=columnX, columnY=columnY)
+                sourceData = self.data if subset else self.allData
+                if selection is None:
+                    selection = [range_selection(sourceData, columnX=columnX, columnY=columnY)]
+                self.data = apply_selection(sourceData, selection, view=True)
+                self.selections["data"] = (self.selections["data"] if subset else []) + list(selection)
+                if not subset:
                     self.unfoldingEvents = find_unfolding_events(self.data, self.axis, plot=False)
 
                 self.timeInterval = [self.data["time"].min(), self.data["time"].max()]
             except AttributeError:
                 print("ERROR: please first process your raw data with 'process_data()' or 'analyse_data()' methods")
-        gc.collect()
 
-    def delete_data(self, raw=True, columnX="time", columnY="PSD1VxDiff"):
+    def delete_data(self, raw=True, columnX="time", columnY="PSD1VxDiff", selection=None):
         """
-        Method to select and remove a portion of either the raw or the processed data
+        Method to select and remove a portion of either the raw or the processed data. The deletion is recorded in the
+        selections attribute, see apply_selections()
 
         Args:
             raw (bool): if True, the selection is of the raw data directly read from file. If False, select from
             processed data
             columnX (str): name of the column to display in the X axis
             columnY (str): name of the column to display in the Y axis
+            selection (list): rules of the data points to remove (see foldometer.tools.selection), applied without
+                opening the plot. The points selected by any of the rules are removed. None opens the plot to select
+                a range of columnX
         """
 
         if raw:
-            self.rawData = data_deletion(self.rawData, columnX=columnX, columnY=columnY)
+            if selection is None:
+                selection = [range_selection(self.rawData, columnX=columnX, columnY=columnY)]
+            self.rawData = apply_selection(self.rawData, exclusion(selection))
+            self.selections["rawData"] = self.selections["rawData"] + exclusion(selection)
         else:
             if columnY not in self.allData.columns:
                 columnY = "forceX"
             try:
-                self.allData = data_deletion(self.allData, columnX=columnX, columnY=columnY)
-                self.data = deepcopy(self.allData)
+                if selection is None:
+                    selection = [range_selection(self.allData, columnX=columnX, columnY=columnY)]
+                self.allData = apply_selection(self.allData, exclusion(selection))
+                self.selections["allData"] = self.selections["allData"] + exclusion(selection)
+                self.derive_stage("data")
+                self.selections["data"] = []
+                self.unfoldingEvents = find_unfolding_events(self.data, self.axis, plot=False)
+            except AttributeError:
+                print("ERROR: please first process your raw data with 'process_data()' or 'analyse_data()' methods")
+
+    def apply_selections(self, selections=None):
+        """
+        Method to repeat selections and deletions of data without opening any plot, e.g. the ones exported with
+        export_data_parameters() in a previous analysis. Only the stages with rules are selected again. The raw data
+        is selected from allRawData, so apply its rules before processing the data
+
+        Args:
+            selections (dict): rules of the selections (see foldometer.tools.selection) of each stage: "rawData"
+                (selected from allRawData), "allData" (deleted from allData) and "data" (selected from allData).
+                None repeats the ones in the selections attribute
+        """
+
+        if selections is None:
+            selections = self.selections
+        if selections.get("rawData"):
+            self.rawData = apply_selection(self.allRawData, selections["rawData"], view=True)
+            self.selections["rawData"] = list(selections["rawData"])
+        if selections.get("allData") or selections.get("data"):
+            try:
+                if selections.get("allData"):
+                    self.allData = apply_selection(self.allData, selections["allData"])
+                    self.selections["allData"] = list(selections["allData"])
+                self.data = apply_selection(self.allData, selections.get("data", []), view=True)
+                self.selections["data"] = list(selections.get("data", []))
                 self.unfoldingEvents = find_unfolding_events(self.data, self.axis, plot=False)
+                self.timeInterval = [self.data["time"].min(), self.data["time"].max()]
             except AttributeError:
                 print("ERROR: please first process your raw data with 'process_data()' or 'analyse_data()' methods")
 
@@ -289,6 +504,7 @@ class Folding(object):
         """
         self.rawData = data_beadData_merging(self.beadTrack, self.rawData)
 
+    @profiled_stage()
     def process_data(self, radii=None, beadTracking=False, noiseRemoval=False, calibrationPath=None,):
         """
         Method to convert raw data to forces and distances usign the thermal calibration parameters
@@ -305,30 +521,34 @@ class Folding(object):
             radii = (self.metadata["beadRadius1"], self.metadata["beadRadius2"])
 
         if self.setup == "DT":
-            self.allData = process_data(self.rawData, self.offset, self.thermalCalibration, self.beadTrack, self.metadata,
-                                        beadTracking=beadTracking, radii=radii, noiseRemoval=noiseRemoval)
+            self.run_cached_stage("allData", process_data, "rawData", self.rawData, self.offset,
+                                  self.thermalCalibration, self.beadTrack, self.metadata, beadTracking=beadTracking,
+                                  radii=radii, noiseRemoval=noiseRemoval)
 
         elif self.setup == "CT":
-            _rawDataCopy = self.rawData.copy()
-            self.allData = process_lumicks_data(_rawDataCopy, self.foldometerCalFit, self.pythonCalFit)
+            #the values of the raw data are only changed when using the python calibration
+            _rawDataCopy = self.rawData.copy(deep=self.pythonCalFit is not None)
+            self.run_cached_stage("allData", process_lumicks_data, "rawData", _rawDataCopy, self.foldometerCalFit,
+                                  self.pythonCalFit)
             self.metadata["sampleFreq"] = 1 / self.allData["time"].diff().mean()
             print(self.metadata)
             del _rawDataCopy
 
 
-        self.data = deepcopy((self.allData))
-        gc.collect()
+        self.derive_stage("data")
 
 
+    @profiled_stage()
     def assign_regions(self):
         """
         Method to find and assign pulling, retracting and stationary regions
         """
         try:
-            self.data = assign_regions(self.data)
+            self.run_cached_stage("data", assign_regions, "data", self.data)
         except AttributeError:
                 print("ERROR: please first process your raw data with 'process_data()' or 'analyse_data()' methods")
 
+    @profiled_stage()
     def find_unfolding_events(self, **kwargs):
         """
         Method to find unfolding events
@@ -338,6 +558,7 @@ class Folding(object):
         except AttributeError:
                 print("ERROR: please first find regions of the data with 'assign_regions()' method")
 
+    @profiled_stage()
     def analyse_data(self, beadTracking=False, radii=None, noiseRemoval=False, calibrationPath=None,
                      windowFactor=20, **kwargs):
         """
@@ -355,29 +576,31 @@ class Folding(object):
             radii = (self.metadata["beadRadius1"], self.metadata["beadRadius2"])
 
         if self.setup == "DT":
-            self.allData = process_data(self.rawData, self.offset, self.thermalCalibration, self.beadTrack, self.metadata,
-                                        beadTracking=beadTracking, radii=radii, noiseRemoval=noiseRemoval)
+            self.run_cached_stage("allData", process_data, "rawData", self.rawData, self.offset,
+                                  self.thermalCalibration, self.beadTrack, self.metadata, beadTracking=beadTracking,
+                                  radii=radii, noiseRemoval=noiseRemoval)
 
         elif self.setup == "CT":
-            _rawDataCopy = self.rawData.copy()
-            self.allData = process_lumicks_data(_rawDataCopy, self.foldometerCalFit, self.pythonCalFit)
+            #the values of the raw data are only changed when using the python calibration
+            _rawDataCopy = self.rawData.copy(deep=self.pythonCalFit is not None)
+            self.run_cached_stage("allData", process_lumicks_data, "rawData", _rawDataCopy, self.foldometerCalFit,
+                                  self.pythonCalFit)
             self.metadata["sampleFreq"] = 1 / self.allData["time"].diff().mean()
             print(self.metadata)
             del _rawDataCopy
 
-        self.allData = assign_regions(self.allData)
+        self.run_cached_stage("allData", assign_regions, "allData", self.allData)
 
         #Use a 50 ms window to identify events
         window = int(self.metadata["sampleFreq"] // windowFactor)
         #print(window)
         # self.unfoldingEvents = find_unfolding_events(self.data, self.axis, rollingWindow = window, **kwargs)
 
-        self.data = copy(self.allData)
+        self.derive_stage("data")
         if self.unfoldingEvents is not None:
             self.refoldingRate = len(self.unfoldingEvents["pullingCycle"].unique()) / \
                                    len(self.data.loc[self.data["region"] == "pulling", "pullingCycle"].unique())
             self.pullingCycles = len(self.unfoldingEvents["pullingCycle"].unique())
-        gc.collect()
 
     def remove_force_offset(self, forceOffset=None, forceChannel="force", axis="X"):
         """
@@ -389,6 +612,7 @@ class Folding(object):
             axis (str): either "x" or "y"
         """
         forceChannel += axis
+        self.own_stage("data")
         if forceOffset is None:
             self.data[forceChannel] -= self.forceOffset
         else:
@@ -400,13 +624,16 @@ class Folding(object):
         Converts the index to timedelta
         """
         self.data.index = pd.to_timedelta(self.data.index, unit='s')
+        self.set_source("data", None)
 
     def to_time(self):
         """
         Converts the index to timedelta
         """
         self.data.index = self.data["time"]
+        self.set_source("data", None)
 
+    @profiled_stage()
     def fit_wlc(self, tmin, tmax, recalculateExtensions=False, **kwargs):
         """
         Method to fit the different pulling curves to the WLC using a series of two WLC models by Odjik (1995)
@@ -442,7 +669,7 @@ class Folding(object):
             return extensions, extensionErrors
 
         temporal = self.data["surfaceSepX"].mean()
-        self.data, self.wlcData = wlc_fit_data(self.data, tmin, tmax, protein=self.protein, **kwargs)
+        self.data, self.wlcData = wlc_fit_data(self.own_stage("data"), tmin, tmax, protein=self.protein, **kwargs)
         self.extensionOffset += temporal - self.data["surfaceSepX"].mean() #accumulate extension offsets
 
 
@@ -469,8 +696,8 @@ class Folding(object):
             self.paramsWLC[paramLabel] = np.mean([self.wlcData[fit].params[paramLabel].value
                                                   for fit in self.wlcData])
             kwargs[paramLabel] = self.paramsWLC[paramLabel]
-        gc.collect()
 
+    @profiled_stage()
     def calculate_protein_contour_length(self, proteinLength=None, accurate=True, **kwargs):
         """
         Function to calculate the protein contour length from the force and extension data
@@ -521,6 +748,7 @@ class Folding(object):
         Args:
             **kwargs: Keyword arguments for the main plotting function
         """
+        from foldometer.tools.plots import force_extension_curve
         if rulers is not None:
             try:
                 force_extension_curve(self.data, self.unfoldingEvents, rulers=rulers, wlcParameters=self.paramsWLC,
@@ -541,8 +769,8 @@ class Folding(object):
                         force_extension_curve(self.data, **kwargs)
                     except AttributeError:
                         print("ERROR: please first process your raw data with 'process_data()' or 'analyse_data()' methods")
-        gc.collect()
 
+    @profiled_stage()
     def align_fluorescence(self, color="532nm", startLine=0, endLine=None, maximumOffset=3, channel="trapSepX", **kwargs):
         """
         Calculate the temporal shift of the fluorescence with respect to the PSD data by comparing the time position of the
@@ -558,7 +786,6 @@ class Folding(object):
 
         #except:
         #    print("Error!")
-        gc.collect()
 
     def plot_fluorescence_contour_length(self, color, signalRegion, topChannel="proteinLc", backgroundRegion=None,
                                          plotSignalRegion=False, **kwargs):
@@ -568,7 +795,6 @@ class Folding(object):
                                   proteinLength=self.proteinLength, **kwargs)
         #except:
         #    print("Error: some missing data, calculate contour length and fluorescence offset")
-        gc.collect()
 
     @property
     def unfoldingForce(self):
@@ -603,11 +829,13 @@ class Folding(object):
     def export_data_parameters(self, path):
         """
         Function to export in a text file some analysis parameters, including the extension offset, the force offset,
-        the protein, which time interval was chosen for analysis and the average of the WLC fit parameters
+        the protein, which time interval was chosen for analysis, the selections and deletions of data (see
+        apply_selections()) and the average of the WLC fit parameters
         """
 
         self.dataParameters = {}
-        dataParamsLabels = ["protein", "timeInterval", "forceOffset", "extensionOffset", "paramsWLC", "fluoOffset"]
+        dataParamsLabels = ["protein", "timeInterval", "forceOffset", "extensionOffset", "paramsWLC", "fluoOffset",
+                            "selections"]
         for label in dataParamsLabels:
             if label in self.__dir__():
                 self.dataParameters[label] = json.dumps(self.__getattribute__(label))
@@ -623,7 +851,9 @@ class Folding(object):
         Function to load analysis parameters calculated previously.
         Args:
             parametersFile (str): path to the file containing the analysis parameters. If None, look for same name as data
-            cropData (bool): if True, crop the data according to the time interval loaded
+            cropData (bool): if True, crop the data according to the selections loaded (see apply_selections()), or
+                to the time interval loaded for files without selections. The selections loaded are stored in the
+                loadedSelections attribute
         """
 
         if parametersFile is None:
@@ -640,11 +870,17 @@ class Folding(object):
             self.fluoOffset = json.loads(dataParams["fluoOffset"])
         except:
             pass
-        if cropData:
+        if "selections" in dataParams:
+            self.loadedSelections = json.loads(dataParams["selections"])
+        if cropData and "selections" in dataParams:
+            self.apply_selections(od([("allData", self.loadedSelections.get("allData", [])),
+                                      ("data", self.loadedSelections.get("data", []))]))
+        elif cropData:
             self.data = self.data.loc[self.loadedTimeInterval[0]: self.loadedTimeInterval[1]]
         self.forceOffset = json.loads(dataParams["forceOffset"])
         self.extensionOffset = json.loads(dataParams["extensionOffset"])
         try:
+            self.own_stage("data")
             self.data["forceX"] -= self.forceOffset
             self.data["surfaceSepX"] -= self.extensionOffset
         except:
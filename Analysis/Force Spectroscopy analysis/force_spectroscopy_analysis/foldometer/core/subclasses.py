@@ -12,6 +12,7 @@ from foldometer.physics.utils import as_Kelvin
 from foldometer.analysis.wlc_curve_fit import protein_contour_length
 from foldometer.tools.misc import data_selection
 from foldometer.analysis.threading import calculate_rolling_slopes
+from foldometer.ixo.manifest import folder_files
 from matplotlib.widgets import SpanSelector
 from matplotlib.widgets import Cursor
 from matplotlib.widgets import Button
@@ -69,7 +70,7 @@ class Thread(Folding):
         """
         Calculate the translocation speed of the threading events
         Args:
-            window (int): number of data points to calculate the slope from
+            window (int or str): number of data points to calculate the slope from, or a time span like "600ms"
             columnY (str): for translocation speed, either surfaceSepX or proteinLc
             selectData (bool): if True, select a subset of the data
             ylim (tuple): limits for plotting and selecting data. If None, automatically adapt to protein total length
@@ -263,10 +264,10 @@ class Thread(Folding):
             fileName = self.filePath[:-5]
             fileNumber = self.filePath[-12:-5]
         counter = 1
-        for file in os.listdir(os.path.split(fileName)[0]):
+        for file in folder_files(os.path.split(fileName)[0] or "."):
             if fileNumber in file and "threading_events" in file:
                 counter += 1
-            filePath = fileName + "_threading_events_" + str(counter).zfill(2) + ".txt"
+        filePath = fileName + "_threading_events_" + str(counter).zfill(2) + ".txt"
         columns = ["time", "proteinLc", "threading", "file", "forceX", "transSpeed"]
         try:
                 self.data["file"] = fileNumber
@@ -295,7 +296,7 @@ class LifeTimeMeasurement(Folding):
         noiseData = data_selection(self.data)
         noisePolyFitForce = np.polyfit(noiseData["surfaceSepX"], noiseData["forceX"], deg=5)
         polynomialForce = np.polyval(noisePolyFitForce, self.data["surfaceSepX"])
-        self.data.loc[:, "forceX"] -= polynomialForce
+        self.own_stage("data").loc[:, "forceX"] -= polynomialForce
 
     def identify_binding_events(self, timeRes=20, minimumRegionLength=5, minForce=1, maxForce=50,
                                 timeLimit=60, plot=True):
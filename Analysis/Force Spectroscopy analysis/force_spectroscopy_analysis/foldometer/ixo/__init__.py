@@ -5,6 +5,8 @@ Module for opening and dealing with files (ixo stands for IO), including:
 - Fast and efficient parsing of binary files from the Foldometer software
 - Parsing of txt files from the old setup
 - Data preparation and conversion to force and extension from raw data
+- Batch processing of whole experiment folders in parallel (the foldometer command)
+- Manifest of experiment folders, to find measurements and their calibration and fluorescence files without listing them
 """
 
 import os
@@ -15,6 +17,13 @@ __all__ = [os.path.basename(f)[: -3] for f in SOURCE_FILES]
 
 
 
-from .binary import read_file
-from .data_conversion import process_file, process_data
-from .old_setup import read_file_old_setup
\ No newline at end of file
+from foldometer.tools.lazy import lazy_attributes
+
+__getattr__, __dir__ = lazy_attributes(__name__, dict(
+    {"read_file": ".binary:read_file",
+     "read_time_window": ".binary:read_time_window",
+     "process_file": ".data_conversion:process_file",
+     "process_data": ".data_conversion:process_data",
+     "read_file_old_setup": ".old_setup:read_file_old_setup",
+     "measurements": ".manifest:measurements"},
+    **{module: "." + module for module in __all__ if module != "__init__"}))
@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__doc__ = """\
+Batch processing of whole experiment folders: every measurement in a directory tree (Foldometer binary files and
+C-trap TDMS files) is converted to forces and distances in a pool of worker processes. The calibration of each file is
+computed once, the data is read and processed in chunks (so the memory of a worker does not depend on the size of the
+files) and written column by column, one file per chunk. A progress manifest in the output folder records the files
+already processed, so an interrupted batch continues where it stopped.
+
+Example (from the command line, see "foldometer --help"):
+    $ foldometer D:/projects/DHFR/raw_data -o D:/projects/DHFR/processed --format parquet --processes 8
+
+Example (from Python):
+    >>> from foldometer.ixo.batch import process_folder, read_output
+    >>> progress = process_folder("raw_data", "processed")
+    >>> data = read_output("processed/molecule1")
+"""
+
+from foldometer.ixo.binary import read_header, read_calibration_fit_values, read_file_chunks
+from foldometer.ixo.manifest import load_manifest
+from foldometer.ixo.lumicks_c_trap import read_data_file_lumicks_chunks, power_spectrum_file, calibration_lumicks, \
+    process_lumicks_data, FD_COMPACT_CHANNELS
+from foldometer.ixo.data_conversion import process_data
+from foldometer.tools.cache import set_cache, CACHE_SETTINGS
+from foldometer.tools.schema import region_codes, region_categorical, compact_frame, FRAME_SCHEMA
+from foldometer.tools.selection import apply_selection, load_selection
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import OrderedDict as od
+from datetime import datetime
+import pandas as pd
+import numpy as np
+import argparse
+import fnmatch
+import json
+import time
+import sys
+import os
+
+
+#Number of samples processed at a time. The memory used by a worker is proportional to it
+CHUNK_SIZE = 500000
+#Extensions of the measurement files and the setup they come from
+MEASUREMENT_EXTENSIONS = {".dat": "DT", ".tdms": "CT"}
+#Patterns of the names of files that are not measurements, and of folders that are not searched
+EXCLUDED_NAMES = ["*Power Spectrum*", "*calibration*", "*Calibration*", "*noise*"]
+EXCLUDED_FOLDERS = ["fluo"]
+OUTPUT_FORMATS = ["npz", "parquet", "csv"]
+PROGRESS_MANIFEST_NAME = "foldometer_batch.json"
+CALIBRATION_FILE_NAME = "calibration.csv"
+#Outputs of each chunk, numbered from 0
+PART_PREFIX = "part-"
+PART_FILE_NAME = PART_PREFIX + "{:05d}.{}"
+
+
+def find_measurements(folder, excluded=EXCLUDED_NAMES):
+    """
+    Function to find the measurement files in a directory tree
+
+    Args:
+        folder (str): root of the directory tree
+        excluded (list): patterns (as in fnmatch) of the names of files that are not measurements
+
+    Returns:
+        measurements (list): paths of the files, sorted
+    """
+
+    measurements = []
+    for directory, subdirectories, fileNames in os.walk(folder):
+        subdirectories[:] = [subdirectory for subdirectory in subdirectories if subdirectory not in EXCLUDED_FOLDERS]
+        for fileName in fileNames:
+            if os.path.splitext(fileName)[1] in MEASUREMENT_EXTENSIONS and \
+                    not any(fnmatch.fnmatch(fileName, pattern) for pattern in excluded):
+                measurements.append(os.path.join(directory, fileName))
+
+    return sorted(measurements)
+
+
+def write_part(data, folder, part, outputFormat="npz"):
+    """
+    Function to write the processed data of a chunk
+
+    Args:
+        data (pandas.DataFrame): processed data
+        folder (str): folder of the outputs of the file
+        part (int): number of the chunk
+        outputFormat (str): one of OUTPUT_FORMATS. "npz" stores one array per column (the codes of the regions, see
+            foldometer.tools.schema), "parquet" requires pyarrow or fastparquet
+
+    Returns:
+        partPath (str): path of the written file
+    """
+
+    partPath = os.path.join(folder, PART_FILE_NAME.format(part, outputFormat))
+    if outputFormat == "npz":
+        np.savez(partPath, **od([(column, region_codes(data[column]) if column == "region" else data[column].values)
+                                 for column in data.columns]))
+    elif outputFormat == "parquet":
+        data.to_parquet(partPath, index=False)
+    elif outputFormat == "csv":
+        data.to_csv(partPath, index=False)
+    else:
+        raise ValueError("Unknown output format: " + outputFormat + ". Choose from " + ", ".join(OUTPUT_FORMATS))
+
+    return partPath
+
+
+def read_output(folder, columns=None):
+    """
+    Function to read the processed data of a measurement written by a batch
+
+    Args:
+        folder (str): folder of the outputs of the file
+        columns (list): columns to read. None reads all of them
+
+    Returns:
+        data (pandas.DataFrame): processed data of all the chunks
+    """
+
+    parts = []
+    for fileName in sorted(os.listdir(folder)):
+        partPath = os.path.join(folder, fileName)
+        if not fileName.startswith(PART_PREFIX):
+            continue
+        if fileName.endswith(".npz"):
+            with np.load(partPath) as stored:
+                part = pd.DataFrame(od([(column, stored[column]) for column in (columns or stored.files)]))
+            if "region" in part.columns:
+                part["region"] = region_categorical(part["region"])
+            parts.append(part)
+        elif fileName.endswith(".parquet"):
+            parts.append(pd.read_parquet(partPath, columns=columns))
+        elif fileName.endswith(".csv"):
+            parts.append(pd.read_csv(partPath, usecols=columns))
+
+    #the label columns read from CSV files are strings and floats
+    return compact_frame(pd.concat(parts, ignore_index=True))
+
+
+def process_measurement(filePath, outputFolder, chunkSize=CHUNK_SIZE, outputFormat="npz", columns=None,
+                        calibrationParameters=None, selection=None):
+    """
+    Function to process a measurement file chunk by chunk and write the results. The calibration is computed once for
+    the whole file: the fit stored in binary files (or calibrationParameters) and the power spectrum file recorded
+    before C-trap files
+
+    Args:
+        filePath (str): path of the measurement file
+        outputFolder (str): folder for the outputs of the file. The outputs of a previous run are replaced
+        chunkSize (int): number of samples processed at a time
+        outputFormat (str): one of OUTPUT_FORMATS
+        columns (list): columns of the processed data to write. None writes all of them
+        calibrationParameters (pandas.DataFrame): thermal calibration used for binary files instead of the one stored
+            in them, see foldometer.analysis.thermal_calibration.calibration_file()
+        selection (list): rules of the data written (see foldometer.tools.selection), applied to each chunk of
+            processed data. None writes all the data
+
+    Returns:
+        summary (dict): number of chunks and rows written and the processing time in seconds
+    """
+
+    startTime = time.perf_counter()
+    os.makedirs(outputFolder, exist_ok=True)
+    for fileName in os.listdir(outputFolder):
+        if fileName.startswith(PART_PREFIX):
+            os.remove(os.path.join(outputFolder, fileName))
+
+    setup = MEASUREMENT_EXTENSIONS[os.path.splitext(filePath)[1]]
+    if setup == "DT":
+        with open(filePath, 'rb') as f:
+            header = read_header(f)
+            calibrationFit = read_calibration_fit_values(f, header)
+        offset = calibrationFit["offset"]
+        if calibrationParameters is None:
+            calibrationParameters = calibrationFit
+        radii = (header["beadRadius1"], header["beadRadius2"])
+        processedChunks = (process_data(rawData, offset, calibrationParameters, header=header, radii=radii)
+                           for rawData in read_file_chunks(filePath, chunkSize))
+    else:
+        calibrationFilePath = power_spectrum_file(filePath)
+        if calibrationFilePath is None:
+            raise FileNotFoundError("No power spectrum file recorded before " + filePath)
+        calibrationParameters = calibration_lumicks(calibrationFilePath)
+        processedChunks = (process_lumicks_data(rawData, calibrationParameters)
+                           for rawData in read_data_file_lumicks_chunks(filePath, chunkSize, FD_COMPACT_CHANNELS))
+    calibrationParameters.to_csv(os.path.join(outputFolder, CALIBRATION_FILE_NAME))
+
+    rows = 0
+    part = 0
+    for part, data in enumerate(processedChunks):
+        if selection:
+            data = apply_selection(data, selection)
+        if columns is not None:
+            data = data[columns]
+        write_part(data, outputFolder, part, outputFormat)
+        rows += len(data)
+
+    return {"chunks": part + 1, "rows": rows, "seconds": time.perf_counter() - startTime}
+
+
+def check_batch_selection(selection):
+    """
+    Function to check that the rules of a batch selection only use columns of the processed data. The regions, pulling
+    cycles and events (the label columns of FRAME_SCHEMA) are assigned later in the analysis, not in the batch
+
+    Args:
+        selection: rules of the data written, see process_folder()
+    """
+
+    if not selection:
+        return
+    rules = [rule for rules in selection.values() for rule in (rules or [])] if isinstance(selection, dict) \
+        else selection
+    labelColumns = sorted({rule["column"] for rule in rules if rule["column"] in FRAME_SCHEMA})
+    if labelColumns:
+        raise ValueError("Columns not in the batch outputs: " + ", ".join(labelColumns) + ". Regions and pulling "
+                         "cycles are assigned later in the analysis, use rules on the processed columns, like time "
+                         "windows and force ranges")
+
+
+def _process_measurement_without_cache(*args, **kwargs):
+    """
+    Function to call process_measurement() with the cache of the pipeline stages disabled: the outputs of the batch
+    are already the stored results, and hashing every chunk would only slow the workers down
+    """
+
+    cacheEnabled = CACHE_SETTINGS["enabled"]
+    set_cache(False)
+    try:
+        return process_measurement(*args, **kwargs)
+    finally:
+        set_cache(cacheEnabled)
+
+
+def load_progress(outputFolder):
+    """
+    Function to load the progress manifest of a batch
+
+    Args:
+        outputFolder (str): output folder of the batch
+
+    Returns:
+        progress (dict): for each measurement (path relative to the input folder), its status ("done" or "failed"),
+        the size and modification time of the file, the settings it was processed with, the number of chunks and
+        rows, the processing time and the error, if any. Empty if there is no manifest yet
+    """
+
+    manifestPath = os.path.join(outputFolder, PROGRESS_MANIFEST_NAME)
+    if not os.path.isfile(manifestPath):
+        return od()
+    with open(manifestPath) as f:
+        return json.load(f, object_pairs_hook=od)
+
+
+def save_progress(outputFolder, progress):
+    """
+    Function to save the progress manifest of a batch. The manifest is replaced atomically, so it is never left half
+    written if the batch is interrupted
+
+    Args:
+        outputFolder (str): output folder of the batch
+        progress (dict): see load_progress()
+    """
+
+    manifestPath = os.path.join(outputFolder, PROGRESS_MANIFEST_NAME)
+    with open(manifestPath + ".tmp", "w") as f:
+        json.dump(progress, f, indent=4)
+    os.replace(manifestPath + ".tmp", manifestPath)
+
+
+def process_folder(folder, outputFolder, processes=None, chunkSize=CHUNK_SIZE, outputFormat="npz", columns=None,
+                   calibrationPath=None, excluded=EXCLUDED_NAMES, force=False, verbose=True, selection=None):
+    """
+    Function to process all the measurements of a directory tree in a pool of processes. The outputs of each file
+    are written in a folder with its path relative to the input folder (without extension), see process_measurement().
+    The files already processed with the same settings, and not changed since, are skipped unless force is True
+
+    Args:
+        folder (str): root of the directory tree with the measurements
+        outputFolder (str): folder where the outputs and the progress manifest are written
+        processes (int): number of worker processes. If 1, everything runs in the current process. Default is None,
+            the number of CPUs
+        chunkSize (int): number of samples processed at a time
+        outputFormat (str): one of OUTPUT_FORMATS
+        columns (list): columns of the processed data to write. None writes all of them
+        calibrationPath (str): thermal calibration file used for all the binary files instead of the calibration
+            stored in them. It is fitted once, before starting the workers
+        excluded (list): patterns of the names of files that are not measurements, see find_measurements()
+        force (bool): if True, all the files are processed again. Default is False
+        verbose (bool): if True, print a line for every processed file. Default is True
+        selection: rules of the data written (see foldometer.tools.selection), as a list applied to all the files or
+            as a dictionary with the rules of each file, by its path relative to the folder. Only the processed columns
+            (time, forces, distances) can be used, see check_batch_selection(). None writes all the data
+
+    Returns:
+        progress (pandas.DataFrame): the progress manifest, one row per measurement, see load_progress()
+    """
+
+    if outputFormat not in OUTPUT_FORMATS:
+        raise ValueError("Unknown output format: " + outputFormat + ". Choose from " + ", ".join(OUTPUT_FORMATS))
+    check_batch_selection(selection)
+    os.makedirs(outputFolder, exist_ok=True)
+    progress = load_progress(outputFolder)
+    settings = od([("chunkSize", chunkSize), ("format", outputFormat), ("columns", columns),
+                   ("calibrationPath", calibrationPath)])
+
+    calibrationParameters = None
+    if calibrationPath is not None:
+        from foldometer.analysis.thermal_calibration import calibration_file
+        calibrationParameters = calibration_file(calibrationPath)
+
+    measurements = find_measurements(folder, excluded)
+    tasks = od()
+    for filePath in measurements:
+        relativePath = os.path.relpath(filePath, folder).replace(os.sep, "/")
+        fileStat = os.stat(filePath)
+        fileSelection = selection.get(relativePath) if isinstance(selection, dict) else selection
+        fileState = od([("size", fileStat.st_size), ("modificationTime", fileStat.st_mtime), ("settings", settings),
+                        ("selection", fileSelection)])
+        previous = progress.get(relativePath, {})
+        if not force and previous.get("status") == "done" and \
+                all(previous.get(key) == value for key, value in fileState.items()):
+            continue
+        tasks[relativePath] = (filePath, fileState)
+
+    #the C-trap folders are indexed once here, so the workers find the power spectrum files in their manifests
+    tdmsFolders = {os.path.dirname(filePath) for filePath, _ in tasks.values() if filePath.endswith(".tdms")}
+    for directory in sorted(tdmsFolders):
+        load_manifest(directory)
+
+    if verbose:
+        print("{} measurements found, {} already processed".format(len(measurements), len(measurements) - len(tasks)))
+
+    finished = []
+
+    def record(relativePath, fileState, summary=None, error=None):
+        progress[relativePath] = od(fileState, status="failed" if error else "done",
+                                    finished=datetime.now().isoformat(timespec="seconds"), error=error,
+                                    **(summary or {}))
+        save_progress(outputFolder, progress)
+        finished.append(relativePath)
+        if verbose:
+            message = error if error else "{rows} rows in {chunks} chunks, {seconds:.1f} s".format(**summary)
+            print("[{}/{}] {}: {}".format(len(finished), len(tasks), relativePath, message))
+
+    def arguments(relativePath, filePath):
+        return (filePath, os.path.join(outputFolder, os.path.splitext(relativePath)[0]), chunkSize, outputFormat,
+                columns, calibrationParameters, tasks[relativePath][1]["selection"])
+
+    if processes == 1:
+        for relativePath, (filePath, fileState) in tasks.items():
+            try:
+                record(relativePath, fileState, _process_measurement_without_cache(*arguments(relativePath, filePath)))
+            except Exception as error:
+                record(relativePath, fileState, error=repr(error))
+    elif tasks:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {executor.submit(_process_measurement_without_cache, *arguments(relativePath, filePath)):
+                       relativePath for relativePath, (filePath, fileState) in tasks.items()}
+            for future in as_completed(futures):
+                relativePath = futures[future]
+                try:
+                    record(relativePath, tasks[relativePath][1], future.result())
+                except Exception as error:
+                    record(relativePath, tasks[relativePath][1], error=repr(error))
+
+    return pd.DataFrame.from_dict(progress, orient="index")
+
+
+def main(argv=None):
+    """
+    Entry point of the "foldometer" command, see "foldometer --help"
+
+    Args:
+        argv (list): arguments of the command. None takes them from sys.argv
+
+    Returns:
+        exitCode (int): 0 if all the measurements were processed, 1 if any of them failed
+    """
+
+    parser = argparse.ArgumentParser(prog="foldometer", description="Process all the measurements (Foldometer .dat "
+                                     "and C-trap .tdms files) of a directory tree in parallel. Files already processed "
+                                     "are skipped, so an interrupted batch can be run again to finish it")
+    parser.add_argument("folder", help="root of the directory tree with the measurements")
+    parser.add_argument("-o", "--output", required=True, help="folder for the outputs and the progress manifest")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="number of worker processes (default: the number of CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="number of samples processed at a time (default: %(default)s)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="npz", help="format of the outputs "
+                        "(default: %(default)s, parquet requires pyarrow or fastparquet)")
+    parser.add_argument("--columns", nargs="+", default=None, help="columns to write (default: all)")
+    parser.add_argument("--calibration", default=None,
+                        help="thermal calibration file used for the binary files instead of the stored fit")
+    parser.add_argument("--exclude", nargs="+", default=EXCLUDED_NAMES,
+                        help="patterns of names of files that are not measurements (default: %(default)s)")
+    parser.add_argument("--selection", default=None, help="JSON file with the rules of the data written, for all the "
+                        "files or per file (see foldometer.tools.selection)")
+    parser.add_argument("--force", action="store_true", help="process again the files already processed")
+    arguments = parser.parse_args(argv)
+    selection = load_selection(arguments.selection) if arguments.selection is not None else None
+
+    progress = process_folder(arguments.folder, arguments.output, arguments.processes, arguments.chunk_size,
+                              arguments.format, arguments.columns, arguments.calibration, arguments.exclude,
+                              arguments.force, selection=selection)
+
+    return 1 if len(progress) and (progress["status"] == "failed").any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,74 +1,193 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from struct import unpack
+from struct import unpack, unpack_from
 import numpy as np
 from collections import OrderedDict as od
 import pandas as pd
-import array
+import warnings
+import os
+from foldometer.tools.profiling import profiled_stage
 
 
 CCD_FREQUENCY = 90
+MEASUREMENT_BLOCK_TYPE = 17
+MEASUREMENT_LABELS = ["time", "index", "PSD1VxDiff", "PSD1VxSum", "PSD1VyDiff", "PSD1VySum", "PSD2VxDiff", "PSD2VxSum",
+                      "PSD2VyDiff", "PSD2VySum", "MirrorX", "MirrorY", "Status"]
+BEAD_LABELS = ["frame", "time", "Bead1X", "Bead1Y", "Bead2X", "Bead2Y"]
+
+#Layout of the blocks in the file (native byte order, as written by the Foldometer software). A measurement block is
+#the block type (int), the start time (double), the number of samples (int) and then the samples, 12 ints each. The
+#"time" of the samples is not stored but computed from the sample frequency. A bead block is the block type followed by
+#a single frame
+MEASUREMENT_HEADER_SIZE = 16
+MEASUREMENT_DTYPE = np.dtype([(label, "i4") for label in MEASUREMENT_LABELS[1:]])
+BEAD_DTYPE = np.dtype([("time", "f8"), ("frame", "u8"), ("Bead1X", "f8"), ("Bead1Y", "f8"), ("Bead2X", "f8"),
+                       ("Bead2Y", "f8")])
+BLOCK_INDEX_DTYPE = np.dtype([("offset", "i8"), ("blockType", "i4"), ("nSamples", "i8"), ("startTime", "f8")])
+BLOCK_INDEX_SUFFIX = "_blocks.npz"
+
+
+def scan_blocks(buffer, bufferOffset=0):
+    """
+    Function to walk once through the data blocks of a binary file and record where each block starts, without
+    decoding the data itself. This index is used to preallocate the columns and to read blocks directly.
+    For a description of the blocks, refer to the non-updated Manual
+    (\\SUPPORTSRV\Projects\BioPhysics\Foldometer\Manuals & Datasheets\FoldometerDataFileFormat.pdf)
+
+    Args:
+        buffer (numpy.array): raw bytes of the file (as numpy.uint8), starting at the first data block
+        bufferOffset (int): position in the file of the first byte of the buffer, so that the offsets in the index
+            are absolute positions in the file
+
+    Returns:
+        blockIndex (numpy.array): structured array with the offset, type, number of samples and start time of each
+        block (see BLOCK_INDEX_DTYPE)
+    """
+
+    offsets = []
+    blockTypes = []
+    samples = []
+    startTimes = []
+
+    position = 0
+    bufferSize = len(buffer)
+    while position + 4 <= bufferSize:
+        blockType = unpack_from('=i', buffer, position)[0]
+        if blockType == MEASUREMENT_BLOCK_TYPE:
+            if position + MEASUREMENT_HEADER_SIZE > bufferSize:
+                blockLength = MEASUREMENT_HEADER_SIZE
+            else:
+                startTime, nSamples = unpack_from('=di', buffer, position + 4)
+                blockLength = MEASUREMENT_HEADER_SIZE + nSamples * MEASUREMENT_DTYPE.itemsize
+        else:
+            #Everything that is not a measurement block is a bead block, always a single frame
+            nSamples = 1
+            blockLength = 4 + BEAD_DTYPE.itemsize
+            if position + blockLength <= bufferSize:
+                startTime = unpack_from('=d', buffer, position + 4)[0]
+
+        if position + blockLength > bufferSize:
+            warnings.warn("The last block of the file is incomplete and it has been ignored")
+            break
+
+        offsets.append(position + bufferOffset)
+        blockTypes.append(blockType)
+        samples.append(nSamples)
+        startTimes.append(startTime)
+        position += blockLength
+
+    blockIndex = np.empty(len(offsets), dtype=BLOCK_INDEX_DTYPE)
+    blockIndex["offset"] = offsets
+    blockIndex["blockType"] = blockTypes
+    blockIndex["nSamples"] = samples
+    blockIndex["startTime"] = startTimes
+
+    return blockIndex
 
 
-def read_measurement_block(dataFile, measurementVariables, variableMask, sampleFrequency):
-    """Function to read a measurement data block, always 1 second of data (the number of data points depend on the
-    Sample Frequency). For a description of the data contained in this block, refer to the non-updated Manual
+def measurement_block_times(measurementBlocks, sampleFrequency):
+    """
+    Function to compute the time of the first sample of each measurement block. Due to a finite precision in the
+    computer time generation, only the timestamp of the first block is considered, and the rest are calculated using
+    the sample frequency
+
+    Args:
+        measurementBlocks (numpy.array): index of the measurement blocks of a file, see scan_blocks()
+        sampleFrequency (float): data sampling frequency in order to compute the timestamp
+
+    Returns:
+        blockTimes (numpy.array): time of the first sample of each block
+    """
+
+    blockTimes = np.empty(len(measurementBlocks), dtype=float)
+    lastTime = None
+    for block, (nSamples, startTimeFile) in enumerate(zip(measurementBlocks["nSamples"],
+                                                          measurementBlocks["startTime"])):
+        if lastTime is None:
+            blockTimes[block] = startTimeFile
+        else:
+            blockTimes[block] = lastTime + 1 / sampleFrequency
+        if nSamples > 0:
+            lastTime = (nSamples - 1) / sampleFrequency + blockTimes[block]
+
+    return blockTimes
+
+
+def read_measurement_blocks(buffer, blockIndex, sampleFrequency, labels=MEASUREMENT_LABELS, bufferOffset=0,
+                            blockTimes=None):
+    """
+    Function to read the measurement data blocks (1 second of data each, the number of data points depend on the
+    Sample Frequency) straight into one contiguous array per column. For a description of the data contained in this
+    block, refer to the non-updated Manual
     (\\SUPPORTSRV\Projects\BioPhysics\Foldometer\Manuals & Datasheets\FoldometerDataFileFormat.pdf)
 
     Args:
-        dataFile (file): the opened file from which the data is read
-        measurementVariables (list): list containing all the variables to be extracted from the file.
-            It also contains the variable "time", not read but computed just adding a time step from the very first
-            start time of the first block (and only the first one)
-        variableMask (list): list containing only the indices of variables in measurementVariables to be appended to
-            the dictionary (and DataFrame)
+        buffer (numpy.array): raw bytes of the file (as numpy.uint8)
+        blockIndex (numpy.array): index of the blocks contained in the buffer, see scan_blocks()
         sampleFrequency (float): data sampling frequency in order to compute the timestamp
+        labels (list): variables to be extracted from the file. The variable "time" is not read but computed
+            just adding a time step from the very first start time of the first block (and only the first one)
+        bufferOffset (int): position in the file of the first byte of the buffer
+        blockTimes (numpy.array): time of the first sample of each measurement block in blockIndex. If None, they are
+            calculated from blockIndex with measurement_block_times(), which requires blockIndex to start at the first
+            block of the file
 
+    Returns:
+        data (pandas.DataFrame): information from the PSDs, indexed by time
     """
-    # Define an extend function for increased speed and performance (extend is like appending but for arrays)
-    appendFunctions = [variable.extend for variable in measurementVariables]
-
-    # Read the timestamp at which the block recording started
-    startTimeFile = unpack('d', dataFile.read(8))[0]
-    #Number of samples in the block
-    nSamples = unpack('i', dataFile.read(4))[0]
-    #Due to a finite precision in the computer time generation, only consider the first timestamp, and calculate the
-    #rest using the sample frequency
-    if len(measurementVariables[0]) == 0:
-        startTimeReal = startTimeFile
-    else:
-        startTimeReal = measurementVariables[0][-1] + 1 / sampleFrequency
 
-    #Read the whole block, much more efficient than struct (around 10x faster)
-    block = array.array('i')
-    block.fromfile(dataFile, nSamples*12)
-    blockArray = np.asarray(block).reshape((nSamples, 12))
-    #Append time
-    appendFunctions[0](np.arange(0, nSamples)/sampleFrequency + startTimeReal)
-    #Append the rest of variables depending on the mode chosen, subtract 1 to the index because time is not in the file
-    for variableIndex in variableMask:
-        appendFunctions[variableIndex](tuple(blockArray[:, variableIndex-1]))
+    measurementBlocks = blockIndex[blockIndex["blockType"] == MEASUREMENT_BLOCK_TYPE]
+    totalSamples = int(measurementBlocks["nSamples"].sum())
+    if blockTimes is None:
+        blockTimes = measurement_block_times(measurementBlocks, sampleFrequency)
+
+    #time is always computed, the rest of the columns keep the type of the file
+    fileLabels = [label for label in labels if label != "time"]
+    columns = od([("time", np.empty(totalSamples, dtype=float))])
+    for label in fileLabels:
+        columns[label] = np.empty(totalSamples, dtype=MEASUREMENT_DTYPE[label])
+
+    position = 0
+    for offset, nSamples, blockTime in zip(measurementBlocks["offset"], measurementBlocks["nSamples"], blockTimes):
+        block = np.frombuffer(buffer, dtype=MEASUREMENT_DTYPE, count=nSamples,
+                              offset=offset - bufferOffset + MEASUREMENT_HEADER_SIZE)
+        columns["time"][position: position + nSamples] = np.arange(0, nSamples) / sampleFrequency + blockTime
+        for label in fileLabels:
+            columns[label][position: position + nSamples] = block[label]
+        position += nSamples
+
+    finalColumns = od([(label, columns[label]) for label in MEASUREMENT_LABELS if label in columns])
+    data = pd.DataFrame(finalColumns, index=columns["time"])
 
+    return data
 
-def read_bead_block(dataFile, beadVariables):
-    """Function to read a bead data block, containing the information for a single frame
+
+def read_bead_blocks(buffer, blockIndex, bufferOffset=0):
+    """
+    Function to read all the bead data blocks, each of them containing the information for a single frame
     For a description of the data contained in this block, refer to the Manual
     (\\SUPPORTSRV\Projects\BioPhysics\Foldometer\Manuals & Datasheets\FoldometerDataFileFormat.pdf)
 
     Args:
-        dataFile (file): the opened file from which the data is read
-        beadVariables (list): list containing all the variables regarding the bead
-            to be extracted from the file. It also contains the variable "time", not read but computed
+        buffer (numpy.array): raw bytes of the file (as numpy.uint8)
+        blockIndex (numpy.array): index of the blocks contained in the buffer, see scan_blocks()
+        bufferOffset (int): position in the file of the first byte of the buffer
 
+    Returns:
+        beadTrack (pandas.DataFrame): spatial coordinates of both beads, indexed by time
     """
 
-    startTimeFile = unpack('d', dataFile.read(8))
-    beadVariables[1].append(startTimeFile[0])
-    beadVariables[0].append(unpack('Q', dataFile.read(8))[0])  # Frame number
+    beadOffsets = blockIndex["offset"][blockIndex["blockType"] != MEASUREMENT_BLOCK_TYPE] - bufferOffset + 4
+    #Gather the bytes of all the frames at once and reinterpret them with the layout of the block
+    byteIndex = beadOffsets[:, np.newaxis] + np.arange(BEAD_DTYPE.itemsize)
+    beadBlocks = np.ascontiguousarray(np.asarray(buffer)[byteIndex]).view(BEAD_DTYPE).reshape(-1)
 
-    for variable in beadVariables[2:]:
-        variable.append(unpack('d', dataFile.read(8))[0])
+    beadColumns = od([(label, beadBlocks[label]) for label in BEAD_LABELS])
+    beadColumns["frame"] = beadColumns["frame"].astype(np.int64)
+    beadTrack = pd.DataFrame(beadColumns, index=beadBlocks["time"])
+
+    return beadTrack
 
 
 def read_header(fileObject, version="1.9"):
@@ -176,6 +295,29 @@ def read_calibration_fit_values(fileObject, header):
     return calibrationFit
 
 
+def mode_labels(mode=None):
+    """
+    Function to get the measurement variables read for each of the reading modes
+
+    Args:
+        mode (str): None will read the whole file, "calibration" only the 4 Diff columns and "compact[AXIS]" the
+        2 Diff columns corresponding to that axis. Default is None
+
+    Returns:
+        labels (list): labels of the variables to read, always including "time"
+    """
+
+    if mode == "calibration":
+        labels = ["time", "PSD1VxDiff", "PSD1VyDiff", "PSD2VxDiff", "PSD2VyDiff"]
+    elif mode == "compactX":
+        labels = ["time", "PSD1VxDiff", "PSD2VxDiff", "MirrorX"]
+    else:
+        labels = MEASUREMENT_LABELS
+
+    return labels
+
+
+@profiled_stage()
 def read_file(fileName, mode=None):
     """
     Function to read a binary file from Foldometer software.
@@ -195,65 +337,191 @@ def read_file(fileName, mode=None):
     """
 
     with open(fileName, 'rb') as f:
-
         header = read_header(f)
         calibrationFit = read_calibration_fit_values(f, header)
+        dataOffset = f.tell()
+        #Read all the data blocks at once, the columns are decoded from it without going through Python objects
+        buffer = np.fromfile(f, dtype=np.uint8)
 
+    blockIndex = scan_blocks(buffer, dataOffset)
+    data = read_measurement_blocks(buffer, blockIndex, header["sampleFreq"], mode_labels(mode), dataOffset)
+    beadTrack = read_bead_blocks(buffer, blockIndex, dataOffset)
 
-        #Measurement Data Block Variables Definition
-        #=======================================================
-        measurementVariablesLabels = ["time", "index", "PSD1VxDiff", "PSD1VxSum", "PSD1VyDiff", "PSD1VySum",
-                                      "PSD2VxDiff", "PSD2VxSum", "PSD2VyDiff", "PSD2VySum", "MirrorX",
-                                      "MirrorY", "Status"]
+    return header, calibrationFit, data, beadTrack
 
-        if mode == "calibration":
-            finalVariablesLabels = ["time", "PSD1VxDiff", "PSD1VyDiff", "PSD2VxDiff", "PSD2VyDiff"]
-        elif mode == "compactX":
-            finalVariablesLabels = ["time", "PSD1VxDiff", "PSD2VxDiff", "MirrorX"]
-        else:
-            finalVariablesLabels = measurementVariablesLabels
-        varDict = od([(variable, []) for variable in measurementVariablesLabels])
-        measurementVariables = list(varDict.values())  #for performance improvement in the iteration
-        #Create a mask with the columns to append, in order to save time
-        variableMask = [value for value, key in enumerate(measurementVariablesLabels) if key in
-                        finalVariablesLabels[1:]]
-
-        #=======================================================
-
-        #Bead Data Block Variables Definition
-        #=======================================================
-        beadVariablesLabels = ["frame", "time", "Bead1X", "Bead1Y", "Bead2X", "Bead2Y"]
-        beadDict = od([(variable, []) for variable in beadVariablesLabels])
-        beadVariables = list(beadDict.values())
-        #=======================================================
-        #print(header)
-        #print(calibrationFit)
-
-        #Read the file, create the header, data and bead tracking dataframes
-        #===================================================================
-
-
-        checkByte = f.read(4)
-        while checkByte != b'':
-            #print(checkByte)
-            blockType = unpack('i', checkByte)[0]
-            if blockType == 17:
-                read_measurement_block(f, measurementVariables, variableMask, header["sampleFreq"])
 
-            else:
-                read_bead_block(f, beadVariables)
+def block_index_path(fileName):
+    """
+    Function to get the path of the sidecar file where the block index of a binary file is stored
 
-            checkByte = f.read(4)
+    Args:
+        fileName(str): name of the binary file (including the path)
 
-    finalDict = od([(key, value) for key, value in varDict.items() if key in finalVariablesLabels])
+    Returns:
+        indexPath (str): name of the block index file (including the path)
+    """
+
+    return os.path.splitext(fileName)[0] + BLOCK_INDEX_SUFFIX
+
+
+def index_file(fileName, save=True):
+    """
+    Function to scan once all the block headers of a binary file from Foldometer software and (optionally) store the
+    offset, type and number of samples of each block in a sidecar file next to it, see block_index_path()
+
+    Args:
+        fileName(str): name of the file to be indexed (including the path)
+        save (bool): if True, the index is stored in the sidecar file. Default is True
+
+    Returns:
+        blockIndex (numpy.array): structured array with the offset, type, number of samples and start time of each
+        block (see BLOCK_INDEX_DTYPE)
+    """
+
+    with open(fileName, 'rb') as f:
+        header = read_header(f)
+        read_calibration_fit_values(f, header)
+        dataOffset = f.tell()
+
+    #Memory-map the file, only the pages with block headers are actually read while scanning
+    fileBuffer = np.memmap(fileName, dtype=np.uint8, mode="r")
+    blockIndex = scan_blocks(fileBuffer[dataOffset:], dataOffset)
+    del fileBuffer
+
+    if save:
+        fileStat = os.stat(fileName)
+        try:
+            np.savez(block_index_path(fileName), blockIndex=blockIndex, fileSize=fileStat.st_size,
+                     modificationTime=fileStat.st_mtime)
+        except OSError:
+            warnings.warn("The block index of " + fileName + " could not be saved")
+
+    return blockIndex
+
+
+def load_block_index(fileName):
+    """
+    Function to load the block index of a binary file from its sidecar file. If there is no index yet, or the file
+    changed after indexing it, the file is indexed again with index_file()
+
+    Args:
+        fileName(str): name of the binary file (including the path)
+
+    Returns:
+        blockIndex (numpy.array): structured array with the offset, type, number of samples and start time of each
+        block (see BLOCK_INDEX_DTYPE)
+    """
+
+    indexPath = block_index_path(fileName)
+    if os.path.exists(indexPath):
+        fileStat = os.stat(fileName)
+        with np.load(indexPath) as storedIndex:
+            if storedIndex["fileSize"] == fileStat.st_size and storedIndex["modificationTime"] == fileStat.st_mtime:
+                return storedIndex["blockIndex"]
+
+    return index_file(fileName)
 
-    data = pd.DataFrame(finalDict, index=varDict["time"])
-    beadTrack = pd.DataFrame(beadDict, index=beadDict["time"])
-    #===================================================================
+
+@profiled_stage()
+def read_time_window(fileName, tStart=None, tEnd=None, columns=None):
+    """
+    Function to read only a time interval of a binary file from Foldometer software. Using the block index (see
+    load_block_index()), only the blocks overlapping with the interval are memory-mapped and decoded, so the cost of
+    reading depends on the length of the interval and not on the length of the file
+
+    Args:
+        fileName(str): name of the file to be opened (including the path)
+        tStart (float): first time to be read, in the same units as the "time" column. None reads from the start
+        tEnd (float): last time to be read, in the same units as the "time" column. None reads until the end
+        columns (list): labels of the measurement variables to read (see MEASUREMENT_LABELS). "time" is always
+            included. None reads all the variables. Default is None
+
+    :returns: * **header** (dict) -- dictionary with the metadata of the file
+              * **fitParameters** (pandas.DataFrame) --  parameters from the fit performed in Foldometer
+              * **data** (pandas.DataFrame) --  information from the PSDs within the time interval
+              * **beadTrack** (pandas.DataFrame) --  spatial coordinates of both beads within the time interval
+
+    """
+
+    if columns is None:
+        labels = MEASUREMENT_LABELS
+    else:
+        unknownLabels = [label for label in columns if label not in MEASUREMENT_LABELS]
+        if unknownLabels:
+            raise ValueError("Unknown columns: " + ", ".join(unknownLabels) + ". Choose from " +
+                             ", ".join(MEASUREMENT_LABELS))
+        labels = ["time"] + [label for label in columns if label != "time"]
+    if tStart is None:
+        tStart = -np.inf
+    if tEnd is None:
+        tEnd = np.inf
+
+    with open(fileName, 'rb') as f:
+        header = read_header(f)
+        calibrationFit = read_calibration_fit_values(f, header)
+    sampleFrequency = header["sampleFreq"]
+
+    blockIndex = load_block_index(fileName)
+    measurementBlocks = blockIndex[blockIndex["blockType"] == MEASUREMENT_BLOCK_TYPE]
+    beadBlocks = blockIndex[blockIndex["blockType"] != MEASUREMENT_BLOCK_TYPE]
+    #The times of the blocks depend on all the previous blocks, but they are computed from the index only
+    blockTimes = measurement_block_times(measurementBlocks, sampleFrequency)
+    blockEndTimes = blockTimes + (measurementBlocks["nSamples"] - 1) / sampleFrequency
+    windowMask = (measurementBlocks["nSamples"] > 0) & (blockEndTimes >= tStart) & (blockTimes <= tEnd)
+
+    fileBuffer = np.memmap(fileName, dtype=np.uint8, mode="r")
+    data = read_measurement_blocks(fileBuffer, measurementBlocks[windowMask], sampleFrequency, labels,
+                                   blockTimes=blockTimes[windowMask])
+    data = data.loc[(data["time"] >= tStart) & (data["time"] <= tEnd)]
+    beadMask = (beadBlocks["startTime"] >= tStart) & (beadBlocks["startTime"] <= tEnd)
+    beadTrack = read_bead_blocks(fileBuffer, beadBlocks[beadMask])
+    del fileBuffer
 
     return header, calibrationFit, data, beadTrack
 
 
+def read_file_chunks(fileName, chunkSize, mode=None):
+    """
+    Generator reading the measurement data of a binary file from Foldometer software in consecutive chunks of whole
+    blocks. Using the block index (see load_block_index()), only the blocks of one chunk are memory-mapped and decoded
+    at a time, so the memory needed does not depend on the length of the file. The bead tracking data is not read
+
+    Args:
+        fileName(str): name of the file to be opened (including the path)
+        chunkSize (int): minimum number of samples of each chunk (the last one can be shorter). The chunks end at the
+            end of a block, so they can be up to one block longer
+        mode (str): variables to read, see mode_labels(). Default is None, all of them
+
+    Yields:
+        data (pandas.DataFrame): information from the PSDs of the chunk, indexed by time
+    """
+
+    with open(fileName, 'rb') as f:
+        header = read_header(f)
+    sampleFrequency = header["sampleFreq"]
+
+    blockIndex = load_block_index(fileName)
+    measurementBlocks = blockIndex[(blockIndex["blockType"] == MEASUREMENT_BLOCK_TYPE) & (blockIndex["nSamples"] > 0)]
+    blockTimes = measurement_block_times(measurementBlocks, sampleFrequency)
+    #blocks are added to a chunk until it has at least chunkSize samples
+    chunkStarts = [0]
+    chunkSamples = 0
+    for block, nSamples in enumerate(measurementBlocks["nSamples"]):
+        if chunkSamples >= chunkSize:
+            chunkStarts.append(block)
+            chunkSamples = 0
+        chunkSamples += nSamples
+    chunkEnds = chunkStarts[1:] + [len(measurementBlocks)]
+
+    fileBuffer = np.memmap(fileName, dtype=np.uint8, mode="r")
+    try:
+        for start, end in zip(chunkStarts, chunkEnds):
+            yield read_measurement_blocks(fileBuffer, measurementBlocks[start:end], sampleFrequency, mode_labels(mode),
+                                          blockTimes=blockTimes[start:end])
+    finally:
+        del fileBuffer
+
+
 def binary_to_csv(fileName, newFileName):
     """
     Function to convert a binary file to csv
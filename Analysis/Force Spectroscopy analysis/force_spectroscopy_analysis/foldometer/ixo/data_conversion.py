@@ -15,14 +15,23 @@ from foldometer.analysis.tweezers_parameters import MIRRORVOLTDISTANCEFACTOR, CC
 from foldometer.analysis.region_classification import assign_regions
 from foldometer.analysis.event_classification import find_unfolding_events
 from foldometer.tools.misc import data_selection
-import matplotlib.pyplot as plt
+from foldometer.tools.cache import cached_stage, file_hash
+from foldometer.tools.profiling import profiled_stage
 import pandas as pd
 import numpy as np
 from copy import deepcopy
 import warnings
-import pkg_resources
+import os
 
-noiseFile = pkg_resources.resource_filename('foldometer', 'data/noise.dat')
+#Noise references measured without tethers, packaged in foldometer/data: "<setup>_noise.dat" for each setup, and
+#noise.dat for the others
+NOISE_DATA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+NOISE_FILE = os.path.join(NOISE_DATA_FOLDER, "noise.dat")
+#Degree of the polynomials of the parasitic noise against the mirror position
+NOISE_MODEL_DEGREE = 10
+
+#noise models already fitted (or loaded from the cache) in this process, by (hash of the noise file, degree)
+_noiseModels = {}
 
 
 def calculate_psd_offset(psdData):
@@ -203,29 +212,86 @@ def surface_separation(displacement, trapSeparation, radii=(1050, 1050)):
     return surfaceSeparation
 
 
-def remove_parasitic_noise(rawData, data, header):
+def noise_reference_file(header):
+    """
+    Function to choose the noise reference of a measurement: the one of its setup if it is packaged, the default one
+    otherwise (see NOISE_DATA_FOLDER)
+
+    Args:
+        header (dict): metadata of the measurement, with the path of the file it was recorded in
+
+    Returns:
+        noiseFile (str): path of the noise reference
+    """
+
     try:
-        noiseFileName = 'data/' + str(header["fileName"][-34:-27], 'utf-8') + '_noise.dat'
+        noiseFile = os.path.join(NOISE_DATA_FOLDER, str(header["fileName"][-34:-27], 'utf-8') + '_noise.dat')
+    except (KeyError, TypeError):
+        return NOISE_FILE
 
-        noiseFile = pkg_resources.resource_filename('foldometer', noiseFileName)
-        noiseMetadata, noiseFit, noiseRawData, noiseBead = read_file(noiseFile)
-    except:
-        noiseFile = pkg_resources.resource_filename('foldometer', 'data/noise.dat')
-        noiseMetadata, noiseFit, noiseRawData, noiseBead = read_file(noiseFile)
+    return noiseFile if os.path.isfile(noiseFile) else NOISE_FILE
 
-    print(noiseFile)
 
-    offset = noiseFit["offset"]
+@cached_stage()
+def fit_noise_model(noiseFile, degree=NOISE_MODEL_DEGREE):
+    """
+    Function to fit the parasitic noise of the force of each PSD against the mirror position in a noise reference.
+    The fits are cached on disk by the content of the file, see foldometer.tools.cache
+
+    Args:
+        noiseFile (str): path of the noise reference, see noise_reference_file()
+        degree (int): degree of the polynomials
 
-    noiseData = process_data(noiseRawData, offset, noiseFit, noiseBead, header=header,
-                        radii=[header["beadRadius1"], header["beadRadius2"]], normalized=True, noiseRemoval=False)
-    noisePolyFitPSD1 = np.polyfit(noiseRawData["MirrorX"], noiseData["PSD1ForceX"], deg=10)
-    polynomialPSD1 = np.polyval(noisePolyFitPSD1, rawData["MirrorX"])
-    noisePolyFitPSD2 = np.polyfit(noiseRawData["MirrorX"], noiseData["PSD2ForceX"], deg=10)
-    polynomialPSD2 = np.polyval(noisePolyFitPSD2, rawData["MirrorX"])
+    Returns:
+        noiseModel (dict): numpy.polynomial.Polynomial of the noise of "PSD1ForceX" and "PSD2ForceX"
+    """
 
-    data.loc[:, "PSD1ForceX"] -= polynomialPSD1
-    data.loc[:, "PSD2ForceX"] -= polynomialPSD2
+    noiseMetadata, noiseFit, noiseRawData, noiseBead = read_file(noiseFile)
+    displacement = psd_volts_to_distance(noiseRawData[["PSD1VxDiff", "PSD1VyDiff", "PSD2VxDiff", "PSD2VyDiff"]],
+                                         noiseFit.beta, offsets=noiseFit["offset"], normalized=True,
+                                         normData=noiseRawData[["PSD1VxSum", "PSD1VySum", "PSD2VxSum", "PSD2VySum"]])
+    force = psd_calculate_force(displacement, noiseFit.stiffness)
+
+    return {column: np.polynomial.Polynomial.fit(noiseRawData["MirrorX"].values, force[column].values, degree)
+            for column in ["PSD1ForceX", "PSD2ForceX"]}
+
+
+def noise_model(noiseFile, degree=NOISE_MODEL_DEGREE):
+    """
+    Function to get the model of the parasitic noise of a noise reference, fitted once per process and file content
+    (see fit_noise_model())
+
+    Args:
+        noiseFile (str): path of the noise reference, see noise_reference_file()
+        degree (int): degree of the polynomials
+
+    Returns:
+        noiseModel (dict): numpy.polynomial.Polynomial of the noise of "PSD1ForceX" and "PSD2ForceX"
+    """
+
+    key = (file_hash(noiseFile), degree)
+    if key not in _noiseModels:
+        _noiseModels[key] = fit_noise_model(noiseFile, degree)
+
+    return _noiseModels[key]
+
+
+def remove_parasitic_noise(rawData, data, header):
+    """
+    Function to subtract from the forces the parasitic noise at the mirror position of each data point, see
+    noise_model(). The data is changed in place
+
+    Args:
+        rawData (pandas.DataFrame): data recorded from Foldometer, with the mirror position
+        data (pandas.DataFrame): processed data, with the forces of both PSDs
+        header (dict): metadata of the measurement, see noise_reference_file()
+    """
+
+    noiseModel = noise_model(noise_reference_file(header))
+    mirrorPosition = rawData["MirrorX"].values
+
+    data.loc[:, "PSD1ForceX"] -= noiseModel["PSD1ForceX"](mirrorPosition)
+    data.loc[:, "PSD2ForceX"] -= noiseModel["PSD2ForceX"](mirrorPosition)
 
 
     data.loc[:, "PSD1ForceX"] -= data["PSD1ForceX"].min() - 0.5
@@ -233,8 +299,8 @@ def remove_parasitic_noise(rawData, data, header):
     data.loc[:, "forceX"] = (data.loc[:, "PSD1ForceX"] - data.loc[:, "PSD2ForceX"]) / 2
     data.loc[:, "forceX"] -= data["forceX"].min() - 0.5
 
-import streamlit as st
-@st.cache()
+@profiled_stage()
+@cached_stage(data="rawData")
 def process_data(rawData, offset, calibrationParameters, beadData=None, header=None, radii=(1050, 1050),
                  normalized=True, beadTracking=False, noiseRemoval=False):
     """
@@ -271,7 +337,7 @@ def process_data(rawData, offset, calibrationParameters, beadData=None, header=N
     #data["forceX"] -= data["forceX"].min() - 0.5
 
     #Bead Tracking
-    if len(beadData.index) is 0 and beadTracking:
+    if beadTracking and (beadData is None or len(beadData.index) == 0):
         warnings.warn("WARNING: there is no bead tracking data in this file, proceeding without merging")
         beadTracking = False
 
@@ -283,6 +349,7 @@ def process_data(rawData, offset, calibrationParameters, beadData=None, header=N
         return data
 
 
+@profiled_stage()
 def process_file(fileName, calibrationFileName=None, beadTracking=False, fitParameters=False,
                  noiseRemoval=False, mode=None, normalized=True, **kwargs):
     """
@@ -331,6 +398,7 @@ def process_file(fileName, calibrationFileName=None, beadTracking=False, fitPara
             return data
 
 
+@profiled_stage()
 def data_beadData_merging(beadData, data, factor=0.0074, columns=None):
     """
     Function to merge the PSD and the bead tracking data by interpolating PSD values.
@@ -364,6 +432,7 @@ def data_beadData_merging(beadData, data, factor=0.0074, columns=None):
     return mergedData
 
 
+@profiled_stage()
 def analyse_file(fileName, calName=None, unfoldingEvents=True, beadTracking=False, fitParameters=False,
                  select_data=True, mode=None, unfoldingThreshold=1, unfoldingWindow=15, plotEvents=True,
                  normalized=True, **kwargs):
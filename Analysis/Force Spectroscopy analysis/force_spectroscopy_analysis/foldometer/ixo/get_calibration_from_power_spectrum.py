@@ -2,15 +2,13 @@ from foldometer.ixo.lumicks_c_trap import extract_calibration_parameters
 import os
 from scipy import constants
 import pickle
-import streamlit as st
 import pandas as pd
 
 def get_calibration_from_power_spectrum(folderData, fileName, extension=".csv"):
+    calibrationFilePath = os.path.join(folderData, fileName + " Power Spectrum" + extension)
     if extension==".csv":
-        calibrationFilePath = folderData + "/" + fileName + " Power Spectrum" + extension
         thermalCalibration = pd.read_csv(calibrationFilePath, index_col=0)
     elif extension==".tdms":
-        calibrationFilePath = folderData + "/" + fileName + " Power Spectrum" + extension
         thermalCalibration = extract_calibration_parameters(calibrationFilePath)
         pd.set_option("display.max_rows", None, "display.max_columns", None)
         print(calibrationFilePath)
@@ -22,7 +20,7 @@ def get_calibration_from_power_spectrum(folderData, fileName, extension=".csv"):
         thermalCalibration["diffusionExp"] = thermalCalibration["diffusionTheory"] / (
                 (thermalCalibration["distanceResponse"] * 10 ** -6) ** 2)
     else:
-        print("calibrationPath:" + folderData + "/" + fileName + " Power Spectrum" + extension)
+        print("calibrationPath:" + calibrationFilePath)
         print("thermalCalibration not defined because extension doesn't match the handled case: extension='.csv' extension='.tdms'")
         thermalCalibration = None
     return thermalCalibration
\ No newline at end of file
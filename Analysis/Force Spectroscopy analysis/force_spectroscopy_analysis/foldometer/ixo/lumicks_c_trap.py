@@ -5,10 +5,11 @@ import numpy as np
 from collections import OrderedDict as od
 import pandas as pd
 from nptdms import TdmsFile
-import matplotlib.pyplot as plt
 from foldometer.tools.maths import cross_correlation
-from lmfit.models import GaussianModel, ExponentialModel
-from skimage.filters import threshold_mean
+from foldometer.tools.cache import cached_stage
+from foldometer.tools.profiling import profiled_stage
+from foldometer.analysis.fluorescence import fit_gaussian_lines
+from foldometer.ixo.manifest import load_manifest, name_record, spectrum_file_name
 import os
 
 CHANNEL_LABEL_MAPPING = {"/'Sensor Data'/'Time (ms)'": "time",
@@ -28,6 +29,21 @@ CALIBRATION_LABEL_MAPPING = {'Bead Diameter (um)': "beadDiameter", 'Viscosity (P
                              'Force Response (pN/V)': "alpha", 'Distance Response (um/V)': "distanceResponse",
                              'Trap Stiffness (pN/m)': "stiffness", 'RMSE': "RMSE", 'Applied': "Applied"}
 
+FD_GROUP_NAME = "FD Data"
+FD_CHANNEL_LABEL_MAPPING = od([("Time (ms)", "time"),
+                               ("Distance 1 (um)", "trapSepX"),
+                               ("Distance 2 (um)", "trapSepY"),
+                               ("Force Channel 0 (pN)", "PSD1ForceX"),
+                               ("Force Channel 1 (pN)", "PSD1ForceY"),
+                               ("Force Channel 2 (pN)", "PSD2ForceX"),
+                               ("Force Channel 3 (pN)", "PSD2ForceY")])
+#names of the channels in the file, by column label
+FD_CHANNEL_NAMES = {label: channelName for channelName, label in FD_CHANNEL_LABEL_MAPPING.items()}
+#columns computed from other channels, with the channels needed to compute them
+FD_DERIVED_CHANNELS = od([("MirrorX", ["trapSepX"]), ("forceX", ["PSD1ForceX", "PSD2ForceX"])])
+#columns used in the analysis of pulling experiments, see process_lumicks_data()
+FD_COMPACT_CHANNELS = ["time", "trapSepX", "PSD1ForceX", "PSD2ForceX", "MirrorX", "forceX"]
+
 FLUORESCENCE_LABEL_MAPPING = {"/'Data'/'Actual position X (um)'": "positionX",
                               "/'Data'/'Actual position Y (um)'": "positionY",
                               "/'Data'/'Pixel ch 1'": "638nm",
@@ -48,29 +64,29 @@ def lumicks_file(moleculeNumber, fileNumber=1, experiment="", folder="."):
     """
 
     lumicksFile = {"dataFile": None, "powerSpectrumFile": None, "fluoFile": None}
-    for fileName in os.listdir(folder):
-        if fileName.endswith(str(moleculeNumber).zfill(3) + "-" + str(fileNumber).zfill(3) + ".tdms") and experiment in fileName:
-            lumicksFile["dataFile"] = os.path.join(folder, fileName)
-    for spectrumFileName in os.listdir(folder):
-        if spectrumFileName.endswith("Power Spectrum.tdms") and spectrumFileName[9:15] < os.path.split(lumicksFile["dataFile"])[1][9:15]:
-            lumicksFile["powerSpectrumFile"] = os.path.join(folder, spectrumFileName)
-    try:
-        for fluoFileName in os.listdir(folder+"/fluo/"):
-            if fluoFileName.endswith(str(moleculeNumber).zfill(3) + "-" + str(fileNumber).zfill(3) + ".tdms"):
-                lumicksFile["fluoFile"] = os.path.join(folder, "fluo", fluoFileName)
-    except:
-        pass
+    #the files of the folder are found in its manifest, which is only updated when the folder changes
+    for name, record in load_manifest(folder)["files"].items():
+        if record["molecule"] != moleculeNumber or record["fileNumber"] != fileNumber:
+            continue
+        if record["kind"] == "measurement" and experiment in name:
+            lumicksFile["dataFile"] = os.path.join(folder, name)
+        elif record["kind"] == "fluorescence":
+            lumicksFile["fluoFile"] = os.path.join(folder, name)
+    if lumicksFile["dataFile"] is not None:
+        lumicksFile["powerSpectrumFile"] = power_spectrum_file(lumicksFile["dataFile"])
     return lumicksFile
 
-import streamlit as st
-@st.cache()
-def read_file_lumicks(dataFilePath, fluorescenceFilePath=None):
+@profiled_stage()
+@cached_stage()
+def read_file_lumicks(dataFilePath, fluorescenceFilePath=None, channels=None, timeRange=None):
     """
     Read a data file from C-trap
 
     Args:
         dataFilePath (str): path of the file containing the force data
         fluorescenceFilePath (str): path of the file containing the fluorescence data
+        channels (list): labels of the columns to read, see read_data_file_lumicks(). None reads all the channels
+        timeRange (tuple): (tStart, tEnd) in seconds of the data to be read. None reads the whole file
 
     Returns:
         data (pandas.DataFrame): relevant data for analysis
@@ -85,11 +101,12 @@ def read_file_lumicks(dataFilePath, fluorescenceFilePath=None):
     else:
         fluorescenceFile = TdmsFile(fluorescenceFilePath)
 
-    data = read_data_file_lumicks(dataFilePath)
+    data = read_data_file_lumicks(dataFilePath, channels=channels, timeRange=timeRange)
 
     return data
 
 
+@profiled_stage()
 def extract_calibration_parameters(calibrationFilePath):
     """
     Get stiffness and diffusion coefficients from lumicks calibration file
@@ -101,24 +118,70 @@ def extract_calibration_parameters(calibrationFilePath):
         calibrationFit (pandas.DataFrame): data of the calibrated values
     """
 
-    calibrationFile = TdmsFile(calibrationFilePath)
-    calibrationMap = {"PSD1x": "/'Power Spectrum Data'/'Fitted Power Spectrum Channel 0 (V^2/Hz)'",
-                      "PSD1y": "/'Power Spectrum Data'/'Fitted Power Spectrum Channel 1 (V^2/Hz)'",
-                      "PSD2x": "/'Power Spectrum Data'/'Fitted Power Spectrum Channel 2 (V^2/Hz)'",
-                      "PSD2y": "/'Power Spectrum Data'/'Fitted Power Spectrum Channel 3 (V^2/Hz)'"}
+    calibrationMap = {"PSD1x": "Fitted Power Spectrum Channel 0 (V^2/Hz)",
+                      "PSD1y": "Fitted Power Spectrum Channel 1 (V^2/Hz)",
+                      "PSD2x": "Fitted Power Spectrum Channel 2 (V^2/Hz)",
+                      "PSD2y": "Fitted Power Spectrum Channel 3 (V^2/Hz)"}
     calibrationFit = pd.DataFrame({key: 4*[0] for key in CALIBRATION_LABEL_MAPPING.values()},
                                   index=["PSD1x", "PSD1y", "PSD2x", "PSD2y"])
 
-    for key in calibrationMap:
-        for parameter in CALIBRATION_LABEL_MAPPING:
-            calibrationFit.loc[key, CALIBRATION_LABEL_MAPPING[parameter]] = \
-                calibrationFile.objects[calibrationMap[key]].properties[parameter]
+    #only the properties of the channels are needed, the power spectra are not read
+    with TdmsFile.open(calibrationFilePath) as calibrationFile:
+        for key in calibrationMap:
+            properties = calibrationFile["Power Spectrum Data"][calibrationMap[key]].properties
+            for parameter in CALIBRATION_LABEL_MAPPING:
+                calibrationFit.loc[key, CALIBRATION_LABEL_MAPPING[parameter]] = properties[parameter]
 
     calibrationFit.loc[:, "stiffness"] *= 1e-9
 
     return calibrationFit
 
 
+def power_spectrum_file(dataFilePath, fileNames=None):
+    """
+    Get the power spectrum (calibration) file of a C-trap measurement: the last one in its folder recorded before it,
+    by the recording date and time in the file names (see foldometer.ixo.manifest.spectrum_file_name())
+
+    Args:
+        dataFilePath (str): path of the file containing the force data
+        fileNames (list): names of the files in the folder of the data file. If None, they are taken from the manifest
+            of the folder, see foldometer.ixo.manifest
+
+    Returns:
+        powerSpectrumFilePath (str): path of the power spectrum file. None if there is none
+    """
+
+    folder, dataFileName = os.path.split(dataFilePath)
+    if fileNames is None:
+        files = load_manifest(folder or ".")["files"]
+    else:
+        files = od([(fileName, name_record(fileName)) for fileName in fileNames])
+    spectrumFileName = spectrum_file_name(files.get(dataFileName) or name_record(dataFileName), files)
+    if spectrumFileName is None:
+        return None
+
+    return os.path.join(folder, spectrumFileName)
+
+
+def calibration_lumicks(calibrationFilePath):
+    """
+    Get the calibration of a C-trap measurement from its power spectrum file, in the units used by the analysis
+
+    Args:
+        calibrationFilePath (str): path for the calibration file
+
+    Returns:
+        calibrationFit (pandas.DataFrame): calibrated values, with the bead diameter in nm and the distance calibration
+        factor beta in V/nm
+    """
+
+    calibrationFit = extract_calibration_parameters(calibrationFilePath)
+    calibrationFit["beadDiameter"] *= 1000
+    calibrationFit["beta"] = 0.001 / calibrationFit["distanceResponse"]
+
+    return calibrationFit
+
+
 def read_fluorescence_file_lumicks(fluorescenceFilePath):
     """
     Read and parse a C-trap fluorescence file, only kymographs
@@ -158,53 +221,27 @@ def track_bead_fluorescence_LEGACY(image, startLine=0, correlationLength=1000, l
     Returns:
         meanCorrelation (numpy.array): array with the averaged tracked bead movement based on cross-correlations
     """
+    from skimage.filters import threshold_mean
     if threshold:
         thresh = threshold_mean(image)
         binary = image > thresh
         image = binary
 
-    maxCorrelation = [0]
-
-
-        #compare lines to reference and get the maximum position, which represents the pixel shift
-    for line in np.arange(startLine, startLine + correlationLength):
-
-        positiveCorr = cross_correlation(image[lineInterval[0]:lineInterval[1], line],
-                                                       image[lineInterval[0]:lineInterval[1],line+1])
-        negativeCorr = cross_correlation(image[lineInterval[0]:lineInterval[1], line + 1],
-                                                       image[lineInterval[0]:lineInterval[1], line])
-        corr = np.concatenate((np.flip(negativeCorr, 0), positiveCorr))
-
-
-        x=np.arange(len(corr)) - (len(corr) - 1) / 2
-
-        y=corr - min(corr)
-        #plt.plot(x,y)
-        gauss1  = GaussianModel(prefix='g1_')
-        pars = gauss1.make_params()
-        pars['g1_center'].set(0, min=-10, max=10)
-        pars['g1_sigma'].set(1, min=0.1)
-        pars['g1_amplitude'].set(100, min=2)
-        mod = gauss1
-        #init = mod.eval(pars, x=x)
-        out = mod.fit(y, pars, x=x)
-        #comps = out.eval_components(x=x)
-#print(out.fit_report(min_correl=0.5))
-        #plt.plot(x,y)
-        #plt.plot(x, out.best_fit, 'r-')
-        maxCorrelation.append(out.params["g1_center"].value + maxCorrelation[-1])
-        #print(referenceLine + lineCount, line, out.params["g1_center"].value )
-        #correlationPeaks = np.argmax(positiveCorr)
-        #if correlationPeaks == 0:
-        #    correlationPeaks = -np.argmax(negativeCorr)
-        #correlation.append(correlationPeaks)
-    #maxCorrelation.append(correlation)
-    #print(x)
-    #plt.show()
-    #print(maxCorrelation)
-    #meanCorrelation = np.mean(maxCorrelation, axis=0)
-
-    return np.array(maxCorrelation)
+    #cross-correlation of each line with the next one, with the lag centered at 0
+    lines = np.arange(startLine, startLine + correlationLength)
+    profiles = np.asarray(image[lineInterval[0]:lineInterval[1], lines], dtype=float).T
+    nextProfiles = np.asarray(image[lineInterval[0]:lineInterval[1], lines + 1], dtype=float).T
+    positiveCorr = cross_correlation(profiles, nextProfiles)
+    negativeCorr = cross_correlation(nextProfiles, profiles)
+    correlations = np.concatenate((np.flip(negativeCorr, 1), positiveCorr), axis=1)
+    x = np.tile(np.arange(correlations.shape[1]) - (correlations.shape[1] - 1) / 2, (len(correlations), 1))
+    y = correlations - correlations.min(axis=1)[:, None]
+
+    #the peak of each correlation is the pixel shift between consecutive lines, limited to 10 pixels
+    shifts = np.clip(fit_gaussian_lines(x, y)[:, 1], -10, 10)
+    maxCorrelation = np.concatenate(([0], np.cumsum(np.nan_to_num(shifts))))
+
+    return maxCorrelation
 
 
 def align_fluorescence_data_legacy(data, image, extensionTimeLength=20, fluoResolution=0.087, **kwargs):
@@ -233,42 +270,174 @@ def align_fluorescence_data_legacy(data, image, extensionTimeLength=20, fluoReso
 
     return fluorescenceTimeOffset
 
-def read_data_file_lumicks(dataFilePath, compact=True):
+def fd_read_labels(channels=None):
     """
+    Function to check the channels requested from a C-trap file and get the labels that have to be read from it
 
     Args:
-        dataFilePath (str): path of the file containing the force data
+        channels (list): labels of the columns (see FD_CHANNEL_LABEL_MAPPING and FD_DERIVED_CHANNELS). None means all
+            the channels
+
+    Returns:
+        channels (list): labels of the columns
+        readLabels (list): labels of the channels read from the file, "time" first, including the ones needed for the
+            derived channels
+    """
+
+    allChannels = list(FD_CHANNEL_LABEL_MAPPING.values()) + list(FD_DERIVED_CHANNELS)
+    if channels is None:
+        channels = allChannels
+    unknownChannels = [channel for channel in channels if channel not in allChannels]
+    if unknownChannels:
+        raise ValueError("Unknown channels: " + ", ".join(unknownChannels) + ". Choose from " + ", ".join(allChannels))
+
+    readLabels = ["time"]
+    for channel in channels:
+        for label in FD_DERIVED_CHANNELS.get(channel, [channel]):
+            if label not in readLabels:
+                readLabels.append(label)
+
+    return channels, readLabels
+
+
+def fd_time_index(timeChannel, timeValue, side="left"):
+    """
+    Function to find the sample of the time channel of an open C-trap file where a time would be inserted, as
+    numpy.searchsorted() on the whole channel, reading only a few samples: the position is estimated from the first
+    samples and checked, and found by bisection if the sampling is not regular
+
+    Args:
+        timeChannel (nptdms.TdmsChannel): time channel of the file, in ms
+        timeValue (float): time in seconds
+        side (str): "left" for the first sample not earlier than timeValue, "right" for the first sample later
+
+    Returns:
+        index (int): position of the sample, len(timeChannel) if there is none
+    """
+
+    length = len(timeChannel)
+
+    def earlier(position):
+        #True if the sample at position comes before the insertion point
+        sampleTime = timeChannel[position] / 1000
+        return sampleTime < timeValue if side == "left" else sampleTime <= timeValue
+
+    def is_index(position):
+        return (position == 0 or earlier(position - 1)) and (position == length or not earlier(position))
+
+    if length > 1:
+        firstTimes = timeChannel[0:2] / 1000
+        period = firstTimes[1] - firstTimes[0]
+        if period > 0:
+            guess = int(np.clip(np.ceil((timeValue - firstTimes[0]) / period), 0, length))
+            for position in [guess, guess + 1, guess - 1]:
+                if 0 <= position <= length and is_index(position):
+                    return position
+
+    low, high = 0, length
+    while low < high:
+        middle = (low + high) // 2
+        if earlier(middle):
+            low = middle + 1
+        else:
+            high = middle
+
+    return low
+
+
+def fd_data_slice(group, channels, readLabels, start, stop):
+    """
+    Function to read the samples [start, stop) of the force and distance channels of an open C-trap file
+
+    Args:
+        group (nptdms.TdmsGroup): FD_GROUP_NAME group of the file
+        channels (list): labels of the columns, see fd_read_labels()
+        readLabels (list): labels of the channels read from the file, see fd_read_labels()
+        start (int): first sample
+        stop (int): sample after the last one
 
     Returns:
+        data (pandas.DataFrame): force and distance data, with "time" and the requested columns
+    """
+
+    dictSlice = od([("time", group[FD_CHANNEL_NAMES["time"]][start:stop] / 1000)])
+    for label in readLabels[1:]:
+        dictSlice[label] = group[FD_CHANNEL_NAMES[label]][start:stop]
+
+    data = pd.DataFrame(dictSlice)
+    if "trapSepX" in data:
+        data["trapSepX"] *= 1e3
+    if "MirrorX" in channels:
+        data["MirrorX"] = data.loc[:, "trapSepX"]
+    if "forceX" in channels:
+        data["forceX"] = (data["PSD2ForceX"] - data["PSD1ForceX"]) / 2
+    #the channels only read to compute the derived ones are not returned
+    helperLabels = [label for label in readLabels[1:] if label not in channels]
+    if helperLabels:
+        data = data.drop(columns=helperLabels)
+
+    return data
+
 
+@profiled_stage()
+def read_data_file_lumicks(dataFilePath, compact=True, channels=None, timeRange=None):
     """
-    CHANNEL_LABEL_MAPPING = {"Time (ms)": "time",
-                             "Distance 1 (um)": "trapSepX",
-                             "Distance 2 (um)": "trapSepY",
-                             "Force Channel 0 (pN)": "PSD1ForceX",
-                             "Force Channel 1 (pN)": "PSD1ForceY",
-                             "Force Channel 2 (pN)": "PSD2ForceX",
-                             "Force Channel 3 (pN)": "PSD2ForceY"}
-    group_name = 'FD Data'
-    with TdmsFile.open(dataFilePath) as tdms_file:
-        channel = tdms_file[group_name]["Time (ms)"]
-        n = len(channel)
-        dictSlice = {}
-        for channel_name in CHANNEL_LABEL_MAPPING:
-            channel = tdms_file[group_name][channel_name]
-            dictSlice[CHANNEL_LABEL_MAPPING[channel_name]] = channel[:]
-
-        df = pd.DataFrame(dictSlice)
-        df["time"] /= 1000
-        df["trapSepX"] *= 1e3
-        df["MirrorX"] = df.loc[:, "trapSepX"]
-        df["forceX"] = (df["PSD2ForceX"] - df["PSD1ForceX"]) / 2
-        data = pd.DataFrame(df)
+    Read the force and distance data of a C-trap file. The file is opened in streaming mode, so only the requested
+    channels and the TDMS segments covering the requested time range are read from disk. The limits of the time range
+    are found reading a few samples of the time channel, see fd_time_index()
+
+    Args:
+        dataFilePath (str): path of the file containing the force data
+        channels (list): labels of the columns to read (see FD_CHANNEL_LABEL_MAPPING and FD_DERIVED_CHANNELS). "time"
+            is always included. None reads all the channels. Default is None
+        timeRange (tuple): (tStart, tEnd) in seconds of the data to be read. Any of them can be None to read from the
+            start or until the end. None reads the whole file. Default is None
+
+    Returns:
+        data (pandas.DataFrame): force and distance data
+    """
+
+    channels, readLabels = fd_read_labels(channels)
+
+    with TdmsFile.open(dataFilePath) as tdmsFile:
+        group = tdmsFile[FD_GROUP_NAME]
+        timeChannel = group[FD_CHANNEL_NAMES["time"]]
+        start, stop = 0, len(timeChannel)
+        if timeRange is not None:
+            if timeRange[0] is not None:
+                start = fd_time_index(timeChannel, timeRange[0], side="left")
+            if timeRange[1] is not None:
+                stop = fd_time_index(timeChannel, timeRange[1], side="right")
+
+        data = fd_data_slice(group, channels, readLabels, start, stop)
+
     return data
 
 
-import streamlit as st
-@st.cache()
+def read_data_file_lumicks_chunks(dataFilePath, chunkSize, channels=None):
+    """
+    Generator reading the force and distance data of a C-trap file in consecutive chunks, opening the file only once.
+    Only one chunk of each channel (time included) is in memory at a time
+
+    Args:
+        dataFilePath (str): path of the file containing the force data
+        chunkSize (int): number of samples of each chunk (the last one can be shorter)
+        channels (list): labels of the columns to read, see read_data_file_lumicks()
+
+    Yields:
+        data (pandas.DataFrame): force and distance data of the chunk
+    """
+
+    channels, readLabels = fd_read_labels(channels)
+
+    with TdmsFile.open(dataFilePath) as tdmsFile:
+        group = tdmsFile[FD_GROUP_NAME]
+        for start in range(0, len(group[FD_CHANNEL_NAMES["time"]]), chunkSize):
+            yield fd_data_slice(group, channels, readLabels, start, start + chunkSize)
+
+
+@profiled_stage()
+@cached_stage(data="data")
 def process_lumicks_data(data, calibrationFitCTrap, calibrationFitPython=None):
     if calibrationFitPython is not None:
         print("Using Python calibration")
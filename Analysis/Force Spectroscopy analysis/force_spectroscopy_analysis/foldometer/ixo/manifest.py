@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__doc__ = """\
+Manifest of an experiment folder: an index of its files (and of the ones in its "fluo" subfolder) with their size,
+modification time, kind (measurement, power spectrum, fluorescence) and the numbers and recording date and time encoded
+in their names, and the header metadata of the measurements. It is stored in the folder (see MANIFEST_NAME) and kept in memory,
+and updated incrementally: the folders are only listed again when their modification time changes, and only the
+headers of new or modified files are read. So finding the calibration or fluorescence file of a measurement does not
+list the folder every time, which takes seconds on network shares with thousands of files.
+
+Example:
+    >>> from foldometer.ixo.manifest import measurements
+    >>> experiment = measurements("D:/projects/DHFR/raw_data")
+    >>> experiment.loc[experiment["molecule"] == 3, ["dataFile", "powerSpectrumFile", "fluorescenceFile"]]
+"""
+
+from foldometer.ixo.binary import read_header
+from nptdms import TdmsFile
+from collections import OrderedDict as od
+import pandas as pd
+import numpy as np
+import warnings
+import json
+import time
+import re
+import os
+
+
+MANIFEST_NAME = "foldometer_manifest.json"
+MANIFEST_VERSION = 2
+FLUORESCENCE_FOLDER = "fluo"
+#Folders modified less than this many seconds before they were listed are listed again, as files created in the same
+#second (or within the resolution of the modification times of network shares) would not change their time
+MODIFICATION_TIME_RESOLUTION = 2
+#C-trap file names: "YYYYMMDD-HHMMSS <experiment> <molecule>-<file>.tdms" and "YYYYMMDD-HHMMSS Power Spectrum.tdms"
+LUMICKS_MEASUREMENT_PATTERN = re.compile(r"^(\d{8})-(\d{6}) .*?(\d{3})-(\d{3})\.tdms$")
+LUMICKS_SPECTRUM_PATTERN = re.compile(r"^(\d{8})-(\d{6}) .*Power Spectrum\.tdms$")
+
+#manifests already loaded in this process, by folder
+_manifests = {}
+
+
+def manifest_path(folder):
+    """
+    Function to get the path of the manifest file of an experiment folder
+
+    Args:
+        folder (str): experiment folder
+
+    Returns:
+        manifestPath (str): path of the manifest file
+    """
+
+    return os.path.join(folder, MANIFEST_NAME)
+
+
+def _json_value(value):
+    """
+    Function to convert a header value to a value that can be stored in JSON
+
+    Args:
+        value: value of the header of a file
+
+    Returns:
+        jsonValue: the value as a str, int, float, bool or None
+    """
+
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, (np.integer, np.floating, np.bool_)):
+        return value.item()
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+
+    return str(value)
+
+
+def name_record(fileName, subfolder=""):
+    """
+    Function to describe a file of an experiment folder from its name only
+
+    Args:
+        fileName (str): name of the file
+        subfolder (str): subfolder of the experiment folder where the file is ("" for the folder itself)
+
+    Returns:
+        record (dict): kind of the file ("measurement", "powerSpectrum", "fluorescence" or "other") and the recording
+        date (YYYYMMDD) and time (HHMMSS), molecule and file numbers in its name (C-trap files)
+    """
+
+    record = od([("kind", "other"), ("date", None), ("time", None), ("molecule", None), ("fileNumber", None)])
+    spectrumMatch = LUMICKS_SPECTRUM_PATTERN.match(fileName)
+    measurementMatch = LUMICKS_MEASUREMENT_PATTERN.match(fileName)
+    if spectrumMatch and not subfolder:
+        record.update(kind="powerSpectrum", date=spectrumMatch.group(1), time=spectrumMatch.group(2))
+    elif measurementMatch:
+        record.update(kind="fluorescence" if subfolder == FLUORESCENCE_FOLDER else "measurement",
+                      date=measurementMatch.group(1), time=measurementMatch.group(2),
+                      molecule=int(measurementMatch.group(3)), fileNumber=int(measurementMatch.group(4)))
+    elif fileName.endswith(".dat") and not subfolder:
+        record["kind"] = "measurement"
+
+    return record
+
+
+def file_record(folder, fileName, subfolder=""):
+    """
+    Function to describe a file of an experiment folder for the manifest. The header of measurements is read
+
+    Args:
+        folder (str): experiment folder
+        fileName (str): name of the file
+        subfolder (str): subfolder of the experiment folder where the file is ("" for the folder itself)
+
+    Returns:
+        record (dict): size and modification time of the file, the description of its name (see name_record()) and
+        the header of the measurements
+    """
+
+    filePath = os.path.join(folder, subfolder, fileName)
+    fileStat = os.stat(filePath)
+    record = od([("size", fileStat.st_size), ("modificationTime", fileStat.st_mtime)])
+    record.update(name_record(fileName, subfolder))
+    record["header"] = None
+
+    if record["kind"] == "measurement":
+        try:
+            if fileName.endswith(".dat"):
+                with open(filePath, "rb") as f:
+                    header = read_header(f)
+            else:
+                header = TdmsFile.read_metadata(filePath).properties
+            record["header"] = od([(key, _json_value(value)) for key, value in header.items()])
+        except Exception:
+            #not a measurement after all (calibration, noise or broken files), it is indexed without a header
+            pass
+
+    return record
+
+
+def index_folder(folder, previous=None, save=True):
+    """
+    Function to index an experiment folder and (optionally) store the manifest in it. Only the folders modified
+    since the previous manifest are listed, and only the new or modified files are read
+
+    Args:
+        folder (str): experiment folder
+        previous (dict): previous manifest of the folder, see load_manifest(). None indexes everything
+        save (bool): if True, the manifest is stored in the folder, see manifest_path(). Default is True
+
+    Returns:
+        manifest (dict): "directories" with the modification and indexing times of the folder and its fluorescence
+        subfolder, and "files" with a record (see file_record()) for each file, by its path relative to the folder
+    """
+
+    if previous is None or previous.get("version") != MANIFEST_VERSION:
+        previous = {"directories": {}, "files": {}}
+    manifest = od([("version", MANIFEST_VERSION), ("directories", od()), ("files", od())])
+    #the manifest is created before listing the folder and then rewritten in place, as creating (or renaming) it would
+    #change the modification time of the folder and the next load would list it again
+    if save and not os.path.exists(manifest_path(folder)):
+        try:
+            open(manifest_path(folder), "a").close()
+        except OSError:
+            pass
+
+    for subfolder in ["", FLUORESCENCE_FOLDER]:
+        directory = os.path.join(folder, subfolder)
+        if not os.path.isdir(directory):
+            continue
+        directoryTime = os.stat(directory).st_mtime
+        previousDirectory = previous["directories"].get(subfolder)
+        previousFiles = od([(name, record) for name, record in previous["files"].items()
+                            if os.path.dirname(name) == subfolder])
+        if previousDirectory is not None and not _directory_changed(previousDirectory, directoryTime):
+            manifest["directories"][subfolder] = previousDirectory
+            manifest["files"].update(previousFiles)
+            continue
+
+        manifest["directories"][subfolder] = od([("modificationTime", directoryTime), ("indexTime", time.time())])
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            if not entry.is_file() or entry.name == MANIFEST_NAME:
+                continue
+            name = os.path.join(subfolder, entry.name).replace(os.sep, "/") if subfolder else entry.name
+            previousRecord = previousFiles.get(name)
+            entryStat = entry.stat()
+            if previousRecord is not None and previousRecord["size"] == entryStat.st_size and \
+                    previousRecord["modificationTime"] == entryStat.st_mtime:
+                manifest["files"][name] = previousRecord
+            else:
+                manifest["files"][name] = file_record(folder, entry.name, subfolder)
+
+    if save and manifest != previous:
+        try:
+            with open(manifest_path(folder), "w") as f:
+                json.dump(manifest, f)
+        except OSError:
+            warnings.warn("The manifest of " + folder + " could not be saved")
+
+    return manifest
+
+
+def _directory_changed(directoryRecord, directoryTime):
+    """
+    Function to check if a folder has to be listed again
+
+    Args:
+        directoryRecord (dict): modification and indexing time of the folder in the manifest
+        directoryTime (float): current modification time of the folder
+
+    Returns:
+        changed (bool): True if the folder was modified, or if it was indexed too soon after a modification to be sure
+    """
+
+    return directoryRecord["modificationTime"] != directoryTime or \
+        directoryRecord["indexTime"] - directoryTime < MODIFICATION_TIME_RESOLUTION
+
+
+def load_manifest(folder):
+    """
+    Function to get the up-to-date manifest of an experiment folder: from memory or from the manifest file, updated
+    with index_folder() if the folder changed (or indexed from scratch if there is no manifest yet)
+
+    Args:
+        folder (str): experiment folder
+
+    Returns:
+        manifest (dict): see index_folder()
+    """
+
+    folder = os.path.abspath(folder)
+    manifest = _manifests.get(folder)
+    if manifest is None and os.path.isfile(manifest_path(folder)):
+        try:
+            with open(manifest_path(folder)) as f:
+                manifest = json.load(f, object_pairs_hook=od)
+        except ValueError:
+            #empty or being written by another process
+            manifest = None
+
+    changed = manifest is None or manifest.get("version") != MANIFEST_VERSION
+    if not changed:
+        for subfolder in ["", FLUORESCENCE_FOLDER]:
+            directory = os.path.join(folder, subfolder)
+            directoryRecord = manifest["directories"].get(subfolder)
+            if os.path.isdir(directory) != (directoryRecord is not None) or (directoryRecord is not None and
+                    _directory_changed(directoryRecord, os.stat(directory).st_mtime)):
+                changed = True
+                break
+    if changed:
+        manifest = index_folder(folder, manifest)
+    _manifests[folder] = manifest
+
+    return manifest
+
+
+def folder_files(folder, subfolder="", kind=None):
+    """
+    Function to get the names of the files of an experiment folder from its manifest, without listing it
+
+    Args:
+        folder (str): experiment folder
+        subfolder (str): subfolder of the experiment folder ("" for the folder itself)
+        kind (str): only the files of this kind, see file_record(). None returns all of them
+
+    Returns:
+        fileNames (list): names of the files, sorted
+    """
+
+    return [os.path.basename(name) for name, record in load_manifest(folder)["files"].items()
+            if os.path.dirname(name) == subfolder and (kind is None or record["kind"] == kind)]
+
+
+def spectrum_file_name(dataRecord, files):
+    """
+    Function to choose the power spectrum (calibration) file of a C-trap measurement: the last one recorded before it,
+    comparing the recording dates and times of their records
+
+    Args:
+        dataRecord (dict): record of the file containing the force data, see name_record()
+        files (dict): records of the files in the folder, by name
+
+    Returns:
+        spectrumFileName (str): name of the power spectrum file. None if there is none
+    """
+
+    if dataRecord["date"] is None:
+        return None
+    recorded = (dataRecord["date"], dataRecord["time"])
+    spectrumFiles = [((record["date"], record["time"]), name) for name, record in files.items()
+                     if record["kind"] == "powerSpectrum" and (record["date"], record["time"]) <= recorded]
+    if not spectrumFiles:
+        return None
+
+    return max(spectrumFiles)[1]
+
+
+def measurements(folder):
+    """
+    Function to get the measurements of an experiment folder, with their calibration and fluorescence files and their
+    header metadata, from its manifest
+
+    Args:
+        folder (str): experiment folder
+
+    Returns:
+        measurements (pandas.DataFrame): one row per measurement with the paths of the data file, of the power spectrum
+        file and of the fluorescence file (C-trap measurements), the recording date and time, molecule and file
+        numbers, the size and modification time, and one column per value of the header
+    """
+
+    files = load_manifest(folder)["files"]
+    fluorescenceFiles = {(record["molecule"], record["fileNumber"]): name for name, record in files.items()
+                         if record["kind"] == "fluorescence"}
+
+    rows = []
+    for name, record in files.items():
+        if record["kind"] != "measurement":
+            continue
+        row = od([("dataFile", os.path.join(folder, name)), ("powerSpectrumFile", None), ("fluorescenceFile", None)])
+        if name.endswith(".tdms"):
+            spectrumFileName = spectrum_file_name(record, files)
+            if spectrumFileName is not None:
+                row["powerSpectrumFile"] = os.path.join(folder, spectrumFileName)
+            fluorescenceName = fluorescenceFiles.get((record["molecule"], record["fileNumber"]))
+            if fluorescenceName is not None:
+                row["fluorescenceFile"] = os.path.join(folder, fluorescenceName)
+        for key in ["date", "time", "molecule", "fileNumber", "size", "modificationTime"]:
+            row[key] = record[key]
+        row.update(record["header"] or {})
+        rows.append(row)
+
+    return pd.DataFrame(rows)
@@ -9,19 +9,20 @@ import glob
 SOURCE_FILES = glob.glob(os.path.dirname(__file__) + "/*.py")
 __all__ = [os.path.basename(f)[: -3] for f in SOURCE_FILES]
 
-# imports
-from .thermodynamics import thermal_energy
-
-from .hydrodynamics import drag_sphere
-
-from .viscosity import (dynamic_viscosity_of_mixture,
-                        water_dynamic_viscosity,
-                        water_density,
-                        glycerol_dynamic_viscosity,
-                        glycerol_density)
+from foldometer.tools.lazy import lazy_attributes
 
-from .constants import (kB, h, NA, c, vacuumPermittivity)
-
-from . import polymer #, electrostatics, materials
-
-from .utils import (mass_sphere, volume_sphere, as_Celsius, as_Kelvin)
+# imports
+__getattr__, __dir__ = lazy_attributes(__name__, dict(
+    {"thermal_energy": ".thermodynamics:thermal_energy",
+     "drag_sphere": ".hydrodynamics:drag_sphere",
+     "dynamic_viscosity_of_mixture": ".viscosity:dynamic_viscosity_of_mixture",
+     "water_dynamic_viscosity": ".viscosity:water_dynamic_viscosity",
+     "water_density": ".viscosity:water_density",
+     "glycerol_dynamic_viscosity": ".viscosity:glycerol_dynamic_viscosity",
+     "glycerol_density": ".viscosity:glycerol_density",
+     "mass_sphere": ".utils:mass_sphere",
+     "volume_sphere": ".utils:volume_sphere",
+     "as_Celsius": ".utils:as_Celsius",
+     "as_Kelvin": ".utils:as_Kelvin"},
+    **{constant: ".constants:" + constant for constant in ["kB", "h", "NA", "c", "vacuumPermittivity"]},
+    **{module: "." + module for module in __all__ if module != "__init__"}))
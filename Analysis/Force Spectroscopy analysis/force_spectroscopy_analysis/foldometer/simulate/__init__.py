@@ -10,4 +10,6 @@ __doc__ = """\
 Module for general numerical simulations
 """
 
-from . import trap
+from foldometer.tools.lazy import lazy_attributes
+
+__getattr__, __dir__ = lazy_attributes(__name__, {module: "." + module for module in __all__ if module != "__init__"})
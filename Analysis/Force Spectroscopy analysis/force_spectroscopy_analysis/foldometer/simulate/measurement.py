@@ -0,0 +1,550 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__doc__ = """\
+Synthetic pulling measurements written in the file formats read by foldometer: the binary files of the Foldometer
+software (see foldometer.ixo.binary.read_file()) and the TDMS files of the Lumicks C-trap (see
+foldometer.ixo.lumicks_c_trap.read_data_file_lumicks()). The traps follow pulling cycles (stationary, pulling,
+stationary, retracting) of a tether made of DNA handles and a protein with a number of domains, which unfold under force
+and refold at the start of each cycle. The force follows the series WLC model (wlc_series_accurate()), and the thermal
+noise of the beads comes from the trap simulator (simulate_traps()). The true values of every sample and the unfolding
+events are written next to the files, see write_ground_truth()
+"""
+
+from foldometer.analysis.wlc_curve_fit import wlc_series_accurate_table, CONTOUR_LENGTH_DNA, PERSISTENCE_LENGTH_DNA, \
+    STRETCH_MODULUS_DNA, CONTOUR_LENGTH_PROTEIN, PERSISTENCE_LENGTH_PROTEIN, EXTENSION_OFFSET
+from foldometer.analysis.tweezers_parameters import MIRRORVOLTDISTANCEFACTOR, get_mirror_values
+from foldometer.ixo.binary import MEASUREMENT_DTYPE, MEASUREMENT_BLOCK_TYPE
+from foldometer.ixo.lumicks_c_trap import FD_GROUP_NAME, FD_CHANNEL_LABEL_MAPPING, CALIBRATION_LABEL_MAPPING
+from foldometer.simulate.trap import simulate_traps
+from foldometer.physics.hydrodynamics import drag_sphere, diffusion_coefficient
+from foldometer.physics.thermodynamics import thermal_energy
+from foldometer.physics.utils import as_Kelvin
+from foldometer.tools.schema import REGION_LABELS, FRAME_SCHEMA, region_codes, region_categorical, compact_frame
+from collections import OrderedDict as od
+from datetime import datetime, timedelta
+from struct import pack
+from nptdms import TdmsWriter, ChannelObject
+import numpy as np
+import pandas as pd
+import json
+import os
+
+
+#Default protocol and tether, similar to a pulling experiment of MBP with two 1.3kb DNA handles
+SAMPLE_FREQUENCY = 1000
+PULLING_SPEED = 100
+STATIONARY_TIME = 2
+FORCE_RANGE = (1, 50)
+BEAD_RADIUS = 1050
+TRAP_STIFFNESS = 0.3
+VISCOSITY = 1e-9
+TEMPERATURE = 25
+#Bell model of the unfolding of each domain: rate at zero force in [1/s] and distance to the transition state in [nm]
+UNFOLDING_RATE = 1e-3
+UNFOLDING_DISTANCE = 1
+#Grid of forces in [pN] where the trap separation of the tether is calculated and inverted
+FORCE_GRID_POINTS = 2 ** 12
+FORCE_GRID_RANGE = (0.1, 200)
+
+#Conversion of the bead displacements to the integers of the binary files: PSD counts per nm (beta) and PSD offsets
+PSD_COUNTS_PER_NM = 100
+PSD_OFFSETS = od([("PSD1x", 120), ("PSD1y", -80), ("PSD2x", -150), ("PSD2y", 60)])
+PSD_SUM = 1
+BINARY_FILE_VERSION = 45
+BINARY_BLOCK_TIME = 1
+#The Foldometer software writes the date at a fixed position of the file name, see get_mirror_values()
+BINARY_FILE_NAME_PREFIX = "SyntheticFoldometer"
+#Distance response of the C-trap PSDs in [um/V], and number of samples written in each segment of a TDMS file
+TDMS_DISTANCE_RESPONSE = 0.5
+TDMS_SEGMENT_SIZE = 2 ** 16
+MEASUREMENT_TIME = datetime(2018, 1, 1, 12, 0, 0)
+#Kymograph of the moving bead: time between lines in [s], pixel size in [nm], width of the spot in pixels and photon
+#counts at the center of the spot and in the background
+KYMOGRAPH_TIME_RESOLUTION = 0.085356
+KYMOGRAPH_PIXEL_SIZE = 80
+KYMOGRAPH_PIXELS = 100
+KYMOGRAPH_SPOT_WIDTH = 3
+KYMOGRAPH_BRIGHTNESS = (50, 2)
+GROUND_TRUTH_SUFFIXES = ("_truth.npz", "_truth.json")
+
+
+def pulling_protocol(minTrapSep, maxTrapSep, cycles=10, pullingSpeed=PULLING_SPEED, stationaryTime=STATIONARY_TIME,
+                     sampleFrequency=SAMPLE_FREQUENCY):
+    """
+    Function to generate the trap separation of a series of pulling cycles. Each cycle is a stationary region at the
+    minimum separation, a pulling region, a stationary region at the maximum separation and a retracting region. The
+    measurement ends with a last stationary region
+
+    Args:
+        minTrapSep (float): trap separation in [nm] at the start of each cycle
+        maxTrapSep (float): trap separation in [nm] at the end of each pulling region
+        cycles (int): number of pulling cycles
+        pullingSpeed (float): speed of the trap in [nm/s] while pulling and retracting
+        stationaryTime (float): duration in [s] of each stationary region
+        sampleFrequency (float): sample frequency in [Hz]
+
+    Returns:
+        protocol (pandas.DataFrame): time, trap separation, region and pulling cycle of each sample
+    """
+
+    stationarySamples = int(round(stationaryTime * sampleFrequency))
+    movingSamples = int(round((maxTrapSep - minTrapSep) / pullingSpeed * sampleFrequency))
+    cycleSeparation = np.concatenate((np.full(stationarySamples, float(minTrapSep)),
+                                      minTrapSep + (maxTrapSep - minTrapSep) * np.arange(movingSamples) /
+                                      movingSamples,
+                                      np.full(stationarySamples, float(maxTrapSep)),
+                                      maxTrapSep - (maxTrapSep - minTrapSep) * np.arange(movingSamples) /
+                                      movingSamples))
+    cycleRegion = np.repeat(region_codes(["stationary", "pulling", "stationary", "retracting"]),
+                            [stationarySamples, movingSamples, stationarySamples, movingSamples])
+
+    trapSep = np.concatenate((np.tile(cycleSeparation, cycles), np.full(stationarySamples, float(minTrapSep))))
+    region = np.concatenate((np.tile(cycleRegion, cycles), np.full(stationarySamples, cycleRegion[0])))
+    pullingCycle = np.minimum(np.arange(len(trapSep)) // len(cycleSeparation), cycles - 1)
+
+    protocol = pd.DataFrame(od([("time", np.arange(len(trapSep)) / sampleFrequency),
+                                ("trapSepX", trapSep),
+                                ("region", region_categorical(region)),
+                                ("pullingCycle", pullingCycle.astype(FRAME_SCHEMA["pullingCycle"]))]))
+
+    return protocol
+
+
+def tether_separation(force, contourLengthProtein=0, radii=(BEAD_RADIUS, BEAD_RADIUS),
+                      stiffness=(TRAP_STIFFNESS, TRAP_STIFFNESS), temperature=TEMPERATURE, **wlcParameters):
+    """
+    Function to calculate the trap separation at which a tether is under a given force: the extension of the series
+    WLC (see wlc_series_accurate()), the radii of the beads and the displacements of the beads from the traps
+
+    Args:
+        force (numpy.array): force in [pN]
+        contourLengthProtein (float): contour length of the unfolded part of the protein in [nm]
+        radii (tuple): radius of each bead in [nm]
+        stiffness (tuple): stiffness of each trap in [pN/nm]
+        temperature (float): temperature in Celsius
+        **wlcParameters: parameters of the DNA handles and the protein accepted by wlc_series_accurate()
+
+    Returns:
+        trapSep (numpy.array): trap separation in [nm]
+    """
+
+    extension = wlc_series_accurate_table(force, contourLengthProtein=contourLengthProtein, temperature=temperature,
+                                          **wlcParameters)
+
+    return extension + radii[0] + radii[1] + force * (1 / stiffness[0] + 1 / stiffness[1])
+
+
+def tether_force(trapSep, contourLengthProtein=0, radii=(BEAD_RADIUS, BEAD_RADIUS),
+                 stiffness=(TRAP_STIFFNESS, TRAP_STIFFNESS), temperature=TEMPERATURE, **wlcParameters):
+    """
+    Function to calculate the force of a tether at a given trap separation, inverting tether_separation() on a grid of
+    forces (see FORCE_GRID_RANGE). Separations below the grid are given its minimum force
+
+    Args:
+        trapSep (numpy.array): trap separation in [nm]
+        contourLengthProtein (float): contour length of the unfolded part of the protein in [nm]
+        radii (tuple): radius of each bead in [nm]
+        stiffness (tuple): stiffness of each trap in [pN/nm]
+        temperature (float): temperature in Celsius
+        **wlcParameters: parameters of the DNA handles and the protein accepted by wlc_series_accurate()
+
+    Returns:
+        force (numpy.array): force in [pN]
+    """
+
+    forceGrid = np.geomspace(*FORCE_GRID_RANGE, FORCE_GRID_POINTS)
+    separationGrid = tether_separation(forceGrid, contourLengthProtein, radii, stiffness, temperature,
+                                       **wlcParameters)
+
+    return np.interp(trapSep, separationGrid, forceGrid)
+
+
+def synthetic_measurement(cycles=10, domains=1, domainContourLength=CONTOUR_LENGTH_PROTEIN, forceRange=FORCE_RANGE,
+                          pullingSpeed=PULLING_SPEED, stationaryTime=STATIONARY_TIME,
+                          sampleFrequency=SAMPLE_FREQUENCY, radius=BEAD_RADIUS, trapStiffness=TRAP_STIFFNESS,
+                          viscosity=VISCOSITY, temperature=TEMPERATURE, unfoldingRate=UNFOLDING_RATE,
+                          unfoldingDistance=UNFOLDING_DISTANCE, contourLengthDNA=CONTOUR_LENGTH_DNA,
+                          persistenceLengthDNA=PERSISTENCE_LENGTH_DNA, stretchModulusDNA=STRETCH_MODULUS_DNA,
+                          persistenceLengthProtein=PERSISTENCE_LENGTH_PROTEIN, extensionOffset=EXTENSION_OFFSET,
+                          seed=None):
+    """
+    Function to simulate a pulling measurement. The trap separation follows pulling_protocol() between the separations
+    where the folded tether is at the limits of forceRange. The domains of the protein unfold one by one with the rate
+    of the Bell model, unfoldingRate * exp(force * unfoldingDistance / kbT) each, and all of them refold at the start
+    of each cycle. The beads are displaced from the traps by the force of the tether plus the thermal noise of
+    simulate_traps()
+
+    Args:
+        cycles (int): number of pulling cycles
+        domains (int): number of domains of the protein
+        domainContourLength (float): increase of the contour length in [nm] when a domain unfolds
+        forceRange (tuple): forces in [pN] of the folded tether at the minimum and maximum trap separations
+        pullingSpeed (float): speed of the trap in [nm/s] while pulling and retracting
+        stationaryTime (float): duration in [s] of each stationary region
+        sampleFrequency (float): sample frequency in [Hz]
+        radius (float or tuple): radius of the beads in [nm], or of each of them
+        trapStiffness (float or list): stiffness of the traps in [pN/nm], or [[k1x, k1y], [k2x, k2y]]
+        viscosity (float): dynamic viscosity in [pN/nm^2 s]
+        temperature (float): temperature in Celsius
+        unfoldingRate (float): unfolding rate of each domain at zero force in [1/s]
+        unfoldingDistance (float): distance to the transition state in [nm]
+        contourLengthDNA (float): contour length of the DNA handles in [nm]
+        persistenceLengthDNA (float): persistence length of the DNA handles in [nm]
+        stretchModulusDNA (float): stretch modulus of the DNA handles in [pN]
+        persistenceLengthProtein (float): persistence length of the unfolded protein in [nm]
+        extensionOffset (float): offset in the distance between surfaces in [nm]
+        seed (int): seed of the random number generator. Default is None
+
+    :returns: * **data** (pandas.DataFrame) -- true force, separations and state of the protein of each sample, and
+                the displacement of each bead from its trap (PSD1xD, PSD1yD, PSD2xD, PSD2yD) in [nm]
+              * **events** (pandas.DataFrame) -- time, force and trap separation of each unfolding event
+              * **parameters** (collections.OrderedDict) -- parameters of the simulation
+    """
+
+    radii = np.broadcast_to(np.asarray(radius, dtype=float), (2,))
+    stiffness = np.broadcast_to(np.asarray(trapStiffness, dtype=float), (2, 2))
+    wlcParameters = {"contourLengthDNA": contourLengthDNA, "persistenceLengthDNA": persistenceLengthDNA,
+                     "stretchModulusDNA": stretchModulusDNA, "persistenceLengthProtein": persistenceLengthProtein,
+                     "extensionOffset": extensionOffset}
+    tether = {"radii": tuple(radii), "stiffness": tuple(stiffness[:, 0]), "temperature": temperature}
+    tether.update(wlcParameters)
+
+    minTrapSep, maxTrapSep = tether_separation(np.asarray(forceRange, dtype=float), **tether)
+    data = pulling_protocol(minTrapSep, maxTrapSep, cycles, pullingSpeed, stationaryTime, sampleFrequency)
+    trapSep = data["trapSepX"].values
+    dt = 1 / sampleFrequency
+    kbT = thermal_energy(as_Kelvin(temperature))
+
+    #Force of the tether at every sample for each number of unfolded domains
+    stateForces = [tether_force(trapSep, state * domainContourLength, **tether) for state in range(domains + 1)]
+    randomGenerator = np.random.default_rng(seed)
+    unfolded = np.zeros(len(trapSep), dtype=np.int16)
+    events = []
+    cycleStarts = np.searchsorted(data["pullingCycle"].values, np.arange(cycles + 1))
+    cycleStarts[-1] = len(trapSep)
+    for pullingCycle in range(cycles):
+        position, cycleEnd = cycleStarts[pullingCycle], cycleStarts[pullingCycle + 1]
+        for state in range(domains):
+            #The next domain unfolds where the integrated rate reaches an exponentially distributed threshold
+            rate = (domains - state) * unfoldingRate * np.exp(stateForces[state][position:cycleEnd] *
+                                                              unfoldingDistance / kbT)
+            unfoldingSample = np.searchsorted(np.cumsum(rate * dt), randomGenerator.exponential())
+            if unfoldingSample >= cycleEnd - position:
+                break
+            position += unfoldingSample
+            unfolded[position:cycleEnd] = state + 1
+            events.append(od([("pullingCycle", pullingCycle), ("time", data["time"].values[position]),
+                              ("trapSepX", trapSep[position]), ("force", stateForces[state][position]),
+                              ("forceAfter", stateForces[state + 1][position]), ("unfoldedDomains", state + 1),
+                              ("region", str(data["region"].values[position]))]))
+
+    force = np.choose(unfolded, stateForces)
+    data["force"] = force
+    data["surfaceSepX"] = trapSep - radii[0] - radii[1] - force * (1 / stiffness[0, 0] + 1 / stiffness[1, 0])
+    data["unfoldedDomains"] = unfolded
+    data["proteinLc"] = unfolded * domainContourLength
+
+    #Thermal motion of each bead in each axis, on top of the displacement caused by the tether
+    noise = simulate_traps(len(trapSep), dt, radii[:, np.newaxis], viscosity, stiffness, temperature,
+                           seed=randomGenerator.integers(2 ** 32))[0, ..., 0]
+    data["PSD1xD"] = force / stiffness[0, 0] + noise[0, 0]
+    data["PSD1yD"] = noise[0, 1]
+    data["PSD2xD"] = -force / stiffness[1, 0] + noise[1, 0]
+    data["PSD2yD"] = noise[1, 1]
+
+    events = pd.DataFrame(events, columns=["pullingCycle", "time", "trapSepX", "force", "forceAfter",
+                                           "unfoldedDomains", "region"])
+    parameters = od([("cycles", cycles), ("domains", domains), ("domainContourLength", domainContourLength),
+                     ("forceRange", list(forceRange)), ("minTrapSep", minTrapSep), ("maxTrapSep", maxTrapSep),
+                     ("pullingSpeed", pullingSpeed), ("stationaryTime", stationaryTime),
+                     ("sampleFrequency", sampleFrequency), ("radii", radii.tolist()),
+                     ("stiffness", stiffness.tolist()), ("viscosity", viscosity), ("temperature", temperature),
+                     ("unfoldingRate", unfoldingRate), ("unfoldingDistance", unfoldingDistance), ("seed", seed)])
+    parameters.update(wlcParameters)
+
+    return data, events, parameters
+
+
+def synthetic_kymograph(data, timeResolution=KYMOGRAPH_TIME_RESOLUTION, pixelSize=KYMOGRAPH_PIXEL_SIZE,
+                        pixels=KYMOGRAPH_PIXELS, timeOffset=0, seed=None):
+    """
+    Function to simulate the kymograph of the fluorescence of the moving bead of a measurement, as read by
+    read_fluorescence_file_lumicks(): a Gaussian spot that follows the trap separation, with Poisson noise
+
+    Args:
+        data (pandas.DataFrame): simulated data, see synthetic_measurement()
+        timeResolution (float): time between consecutive lines in [s]
+        pixelSize (float): size of the pixels in [nm]
+        pixels (int): number of pixels of each line
+        timeOffset (float): delay in [s] of the kymograph with respect to the data: the line at time t shows the bead
+            at time t - timeOffset
+        seed (int): seed of the random number generator. Default is None
+
+    Returns:
+        image (numpy.array): photon counts with shape (pixels, lines)
+    """
+
+    time = data["time"].values
+    lineTimes = time[0] + np.arange(int((time[-1] - time[0]) // timeResolution) + 1) * timeResolution
+    position = np.interp(lineTimes - timeOffset, time, data["trapSepX"].values)
+    center = pixels / 2 + (position - position.mean()) / pixelSize
+    expected = KYMOGRAPH_BRIGHTNESS[1] + KYMOGRAPH_BRIGHTNESS[0] * \
+        np.exp(-(np.arange(pixels)[:, np.newaxis] - center) ** 2 / (2 * KYMOGRAPH_SPOT_WIDTH ** 2))
+
+    return np.random.default_rng(seed).poisson(expected)
+
+
+def calibration_values(parameters):
+    """
+    Function to calculate the calibration values of the four PSDs that correspond to the parameters of a simulation,
+    as a thermal calibration would find them
+
+    Args:
+        parameters (dict): parameters of the simulation, see synthetic_measurement()
+
+    Returns:
+        calibration (pandas.DataFrame): radius, stiffness, drag, diffusion coefficient and corner frequency of each PSD
+    """
+
+    calibration = pd.DataFrame(index=["PSD1x", "PSD1y", "PSD2x", "PSD2y"])
+    calibration["beadRadius"] = np.repeat(parameters["radii"], 2)
+    calibration["stiffness"] = np.ravel(parameters["stiffness"])
+    calibration["dragCoeff"] = [drag_sphere(radius, parameters["viscosity"]) for radius in calibration["beadRadius"]]
+    calibration["diffCoeff"] = [diffusion_coefficient(radius, parameters["temperature"], parameters["viscosity"])
+                                for radius in calibration["beadRadius"]]
+    calibration["cornerFrequency"] = calibration["stiffness"] / (2 * np.pi * calibration["dragCoeff"])
+
+    return calibration
+
+
+def _pascal_string(value):
+    """
+    Function to pack a string as in the header of the binary files: its length in one byte and then its bytes
+
+    Args:
+        value (str): string to be packed, at most 255 bytes long once encoded
+
+    Returns:
+        packed (bytes): packed string
+    """
+
+    encoded = value.encode("utf-8")[:255]
+
+    return pack("=B", len(encoded)) + encoded
+
+
+def write_binary_measurement(filePath, data, parameters, protein="synthetic", condition=None,
+                             measurementTime=MEASUREMENT_TIME):
+    """
+    Function to write a simulated measurement in the binary format of the Foldometer software, see
+    foldometer.ixo.binary.read_file(). The displacements are stored as PSD counts (see PSD_COUNTS_PER_NM and
+    PSD_OFFSETS) and the trap separation as mirror counts, in measurement blocks of BINARY_BLOCK_TIME. The calibration
+    in the header is the true one
+
+    Args:
+        filePath (str): path of the file to be written
+        data (pandas.DataFrame): simulated data, see synthetic_measurement()
+        parameters (dict): parameters of the simulation, see synthetic_measurement()
+        protein (str): name of the protein written in the header
+        condition (dict): experimental condition written in the header. Default is the parameters of the simulation
+        measurementTime (datetime.datetime): date of the measurement, which sets the position of the stationary mirror
+    """
+
+    if condition is None:
+        condition = parameters
+    calibration = calibration_values(parameters)
+    sampleFrequency = parameters["sampleFrequency"]
+    fileName = BINARY_FILE_NAME_PREFIX + measurementTime.strftime("%Y-%m-%d_%H%M%S_") + os.path.basename(filePath)
+    stationaryMirrorX, stationaryMirrorY = get_mirror_values({"fileName": fileName.encode("utf-8")})
+
+    header = pack("=i", BINARY_FILE_VERSION) + _pascal_string(fileName) + \
+        _pascal_string("{:g} Hz".format(sampleFrequency)) + pack("=d", sampleFrequency) + \
+        _pascal_string("synthetic") + _pascal_string("foldometer.simulate") + \
+        pack("=Q", int(measurementTime.timestamp())) + _pascal_string(measurementTime.isoformat(" ")) + \
+        _pascal_string(protein) + _pascal_string(json.dumps(condition)) + \
+        pack("=5d", parameters["temperature"] + 273, parameters["viscosity"] * 1e6, 0, 0, 0)
+    #Values of the live calibration of each PSD, in the units of the file (see read_calibration_fit_values())
+    for psd in calibration.index:
+        header += pack("=13d", 0, 0.001 / PSD_COUNTS_PER_NM, 1, calibration.loc[psd, "cornerFrequency"],
+                       calibration.loc[psd, "diffCoeff"], calibration.loc[psd, "dragCoeff"],
+                       calibration.loc[psd, "stiffness"], 0, 0, calibration.loc[psd, "stiffness"] * 1000,
+                       calibration.loc[psd, "beadRadius"] * 1e-9, calibration.loc[psd, "dragCoeff"],
+                       calibration.loc[psd, "diffCoeff"])
+    header += pack("=4d", *PSD_OFFSETS.values())
+
+    samples = np.zeros(len(data), dtype=MEASUREMENT_DTYPE)
+    samples["index"] = np.arange(len(data))
+    for psd, offset in PSD_OFFSETS.items():
+        column = psd[:4] + "V" + psd[-1]
+        samples[column + "Diff"] = np.rint(offset + PSD_COUNTS_PER_NM * data[psd + "D"].values)
+        samples[column + "Sum"] = PSD_SUM
+    samples["MirrorX"] = np.rint(stationaryMirrorX + data["trapSepX"].values / MIRRORVOLTDISTANCEFACTOR)
+    samples["MirrorY"] = stationaryMirrorY
+
+    blockSize = int(round(BINARY_BLOCK_TIME * sampleFrequency))
+    startTime = data["time"].values[0]
+    with open(filePath, "wb") as f:
+        f.write(header)
+        for start in range(0, len(samples), blockSize):
+            block = samples[start: start + blockSize]
+            f.write(pack("=idi", MEASUREMENT_BLOCK_TYPE, startTime + start / sampleFrequency, len(block)))
+            f.write(block.tobytes())
+
+
+def write_tdms_measurement(folder, data, parameters, name="synthetic", moleculeNumber=1, fileNumber=1,
+                           measurementTime=MEASUREMENT_TIME):
+    """
+    Function to write a simulated measurement as the files of the Lumicks C-trap: a power spectrum file with the
+    calibration and a data file with the force and distance channels (see FD_CHANNEL_LABEL_MAPPING), written in
+    segments of TDMS_SEGMENT_SIZE samples. The names of the files follow the ones expected by lumicks_file()
+
+    Args:
+        folder (str): folder where the files are written
+        data (pandas.DataFrame): simulated data, see synthetic_measurement()
+        parameters (dict): parameters of the simulation, see synthetic_measurement()
+        name (str): name of the experiment, included in the file names
+        moleculeNumber (int): number of the molecule, included in the file name
+        fileNumber (int): number of the file, included in the file name
+        measurementTime (datetime.datetime): time of the measurement, the calibration is one minute earlier
+
+    Returns:
+        lumicksFile (dict): paths of the data file and the power spectrum file
+    """
+
+    calibration = calibration_values(parameters)
+    calibrationTime = measurementTime - timedelta(minutes=1)
+    lumicksFile = {"dataFile": os.path.join(folder, "{} {} {}-{}.tdms".format(
+                       measurementTime.strftime("%Y%m%d-%H%M%S"), name, str(moleculeNumber).zfill(3),
+                       str(fileNumber).zfill(3))),
+                   "powerSpectrumFile": os.path.join(folder, calibrationTime.strftime("%Y%m%d-%H%M%S") +
+                                                     " Power Spectrum.tdms")}
+
+    #Fitted Lorentzian spectrum of each PSD in [V^2/Hz], with the calibration values as properties
+    frequencies = np.geomspace(1, parameters["sampleFrequency"] / 2, 200)
+    spectrumChannels = []
+    for channel, psd in enumerate(calibration.index):
+        distanceResponse = TDMS_DISTANCE_RESPONSE * 1000
+        spectrum = calibration.loc[psd, "diffCoeff"] / distanceResponse ** 2 / \
+            (np.pi ** 2 * (calibration.loc[psd, "cornerFrequency"] ** 2 + frequencies ** 2))
+        properties = od([('Bead Diameter (um)', 2 * calibration.loc[psd, "beadRadius"] / 1000),
+                         ('Viscosity (Pa*s)', parameters["viscosity"] * 1e6),
+                         ('Temperature (C)', float(parameters["temperature"])),
+                         ('Lower Bound (Hz)', float(frequencies[0])), ('Upper Bound (Hz)', float(frequencies[-1])),
+                         ('Exclusion Ranges (Hz)', ""),
+                         ('Corner Frequency (Hz)', calibration.loc[psd, "cornerFrequency"]),
+                         ('Force Response (pN/V)', calibration.loc[psd, "stiffness"] * distanceResponse),
+                         ('Distance Response (um/V)', TDMS_DISTANCE_RESPONSE),
+                         ('Trap Stiffness (pN/m)', calibration.loc[psd, "stiffness"] * 1e9),
+                         ('RMSE', 0.0), ('Applied', True)])
+        assert list(properties) == list(CALIBRATION_LABEL_MAPPING)
+        spectrumChannels.append(ChannelObject("Power Spectrum Data",
+                                              "Fitted Power Spectrum Channel {} (V^2/Hz)".format(channel),
+                                              spectrum, properties=properties))
+    with TdmsWriter(lumicksFile["powerSpectrumFile"]) as tdmsWriter:
+        tdmsWriter.write_segment(spectrumChannels)
+
+    #The C-trap stores the force of the traps on the beads, the opposite of the displacements times the stiffness
+    stiffness = calibration["stiffness"]
+    columns = od([("time", data["time"].values * 1000),
+                  ("trapSepX", data["trapSepX"].values / 1000),
+                  ("trapSepY", np.zeros(len(data))),
+                  ("PSD1ForceX", -stiffness["PSD1x"] * data["PSD1xD"].values),
+                  ("PSD1ForceY", -stiffness["PSD1y"] * data["PSD1yD"].values),
+                  ("PSD2ForceX", -stiffness["PSD2x"] * data["PSD2xD"].values),
+                  ("PSD2ForceY", -stiffness["PSD2y"] * data["PSD2yD"].values)])
+    with TdmsWriter(lumicksFile["dataFile"]) as tdmsWriter:
+        for start in range(0, len(data), TDMS_SEGMENT_SIZE):
+            tdmsWriter.write_segment([ChannelObject(FD_GROUP_NAME, channelName,
+                                                    columns[label][start: start + TDMS_SEGMENT_SIZE])
+                                      for channelName, label in FD_CHANNEL_LABEL_MAPPING.items()])
+
+    return lumicksFile
+
+
+def write_ground_truth(basePath, data, events, parameters):
+    """
+    Function to write the true values of a simulated measurement next to its files: the values of each sample in
+    basePath + "_truth.npz" and the parameters and unfolding events in basePath + "_truth.json"
+
+    Args:
+        basePath (str): path of the files without the suffix
+        data (pandas.DataFrame): simulated data, see synthetic_measurement()
+        events (pandas.DataFrame): unfolding events, see synthetic_measurement()
+        parameters (dict): parameters of the simulation, see synthetic_measurement()
+
+    Returns:
+        truthFiles (tuple): paths of the two files
+    """
+
+    truthFiles = tuple(basePath + suffix for suffix in GROUND_TRUTH_SUFFIXES)
+    columns = od([(label, data[label].values) for label in ["time", "trapSepX", "force", "surfaceSepX",
+                                                            "proteinLc", "unfoldedDomains", "pullingCycle"]])
+    columns["region"] = data["region"].cat.codes.values
+    np.savez(truthFiles[0], regionLabels=np.array(REGION_LABELS), **columns)
+    with open(truthFiles[1], "w") as f:
+        json.dump(od([("parameters", parameters), ("events", events.to_dict(orient="records"))]), f, indent=4,
+                  default=lambda value: value.item() if isinstance(value, np.generic) else str(value))
+
+    return truthFiles
+
+
+def read_ground_truth(basePath):
+    """
+    Function to read the true values of a simulated measurement written with write_ground_truth()
+
+    Args:
+        basePath (str): path of the files without the suffix
+
+    :returns: * **truth** (pandas.DataFrame) -- true values of each sample
+              * **events** (pandas.DataFrame) -- unfolding events
+              * **parameters** (dict) -- parameters of the simulation
+    """
+
+    with np.load(basePath + GROUND_TRUTH_SUFFIXES[0]) as stored:
+        truth = pd.DataFrame(od([(label, stored[label]) for label in stored.files
+                                 if label not in ["region", "regionLabels"]]))
+        truth["region"] = pd.Categorical.from_codes(stored["region"], list(stored["regionLabels"]))
+    compact_frame(truth)
+    with open(basePath + GROUND_TRUTH_SUFFIXES[1]) as f:
+        stored = json.load(f, object_pairs_hook=od)
+    events = pd.DataFrame(stored["events"], columns=["pullingCycle", "time", "trapSepX", "force", "forceAfter",
+                                                     "unfoldedDomains", "region"])
+
+    return truth, events, stored["parameters"]
+
+
+def generate_measurement_files(folder, name="synthetic", formats=("binary", "tdms"), protein="synthetic",
+                               measurementTime=MEASUREMENT_TIME, **kwargs):
+    """
+    Function to simulate a measurement (see synthetic_measurement()) and write it in the requested formats, together
+    with its ground truth
+
+    Args:
+        folder (str): folder where the files are written. It is created if needed
+        name (str): name of the measurement, used in the names of the files
+        formats (tuple): formats to be written, "binary" (Foldometer) and/or "tdms" (C-trap)
+        protein (str): name of the protein written in the binary header
+        measurementTime (datetime.datetime): time of the measurement written in the files
+        **kwargs: parameters of the simulation accepted by synthetic_measurement()
+
+    Returns:
+        files (dict): paths of the written files: "binary", "tdms" (see write_tdms_measurement()) and "truth"
+    """
+
+    unknownFormats = [fileFormat for fileFormat in formats if fileFormat not in ["binary", "tdms"]]
+    if unknownFormats:
+        raise ValueError("Unknown formats: " + ", ".join(unknownFormats) + ". Choose from binary, tdms")
+
+    os.makedirs(folder, exist_ok=True)
+    data, events, parameters = synthetic_measurement(**kwargs)
+    files = {}
+    if "binary" in formats:
+        files["binary"] = os.path.join(folder, name + ".dat")
+        write_binary_measurement(files["binary"], data, parameters, protein=protein,
+                                 measurementTime=measurementTime)
+    if "tdms" in formats:
+        files["tdms"] = write_tdms_measurement(folder, data, parameters, name=name, measurementTime=measurementTime)
+    files["truth"] = write_ground_truth(os.path.join(folder, name), data, events, parameters)
+
+    return files
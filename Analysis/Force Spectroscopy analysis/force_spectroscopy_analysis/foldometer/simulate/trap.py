@@ -3,6 +3,7 @@ from collections import namedtuple
 
 import numpy as np
 import pandas as pd
+from scipy.signal import lfilter
 
 from foldometer.physics import drag_sphere, mass_sphere
 from foldometer.physics.hydrodynamics import diffusion_coefficient
@@ -11,6 +12,9 @@ __doc__ = """\
 Simulation of optical trap time series according to Norrelykke et al.
 """
 
+#number of samples per trap and realization generated at once by simulate_traps()
+SIMULATION_CHUNK_SIZE = 2 ** 20
+
 
 def eigenvalues(dragCoefficient=drag_sphere(1000),
                 massSphere=mass_sphere(1000),
@@ -178,6 +182,145 @@ def step(eigenvalues=eigenvalues(), aValues=aValues(), alpha=alpha()):
     return step
 
 
+def filter_coefficients(timeStep=0.001, radius=1000, viscosity=1e-9, trapStiffness=0.1, temperature=25):
+    """
+    Calculates the coefficients of the exact discretization of Norrelykke et al. written as a linear filter. The state
+    s = (x, v) follows s[i + 1] = exp(-M * ∆t) * s[i] + step[i], where each step is a combination of two independent
+    standard normal numbers (see step()). Eliminating the other component of the state, each of x and v is a filter
+    with the same autoregressive part (order 2) applied to the two random sequences
+
+    Args:
+        timeStep (float): Difference between two time points in [s]; delta time (Default: 0.001 s)
+        radius (float): Radius of trapped sphere in [nm]. (Default: 1000)
+        viscosity (float): Dynamic viscosity in [pN/nm^2 s] (Default: 1e-9 pN/nm^2 s)
+        trapStiffness (float): Stiffness of simulated trap, k, in [pN/nm]. (Default: 0.1 pN/nm)
+        temperature (float): Temperature in [°C]. (Default: 25 °C)
+
+    Returns:
+        b (np.array(2, 2, 3)): numerator coefficients for each state component (x, v) and random sequence
+        a (np.array(3)): denominator coefficients, common to all of them
+    """
+    drag = drag_sphere(radius=radius, dynamicViscosity=viscosity)
+    mass = mass_sphere(radius=radius)
+    D = diffusion_coefficient(radius=radius, temperature=temperature, dynamicViscosity=viscosity)
+
+    l = eigenvalues(dragCoefficient=drag, massSphere=mass, trapStiffness=trapStiffness)
+    c = cValues(eigenvalues=l, timeStep=timeStep)
+    M = np.asarray(exp_Matrix(eigenvalues=l, cValues=c))
+    A = aValues(diffusionCoefficient=D, eigenvalues=l, cValues=c)
+    alphaValue = alpha(eigenvalues=l, cValues=c)
+
+    # contribution of each random number to the step of (x, v), as in step()
+    v1 = np.array([-1, l.plus])
+    v2 = np.array([1, -l.minus])
+    noise = np.column_stack(((A.plus * v1 + A.minus * v2) * np.sqrt(1 + alphaValue),
+                             (A.plus * v1 - A.minus * v2) * np.sqrt(1 - alphaValue)))
+
+    # adjugate of (z - M) in powers of 1/z, for the step of each component
+    adjugate = np.array([[[0, 1, -M[1, 1]], [0, 0, M[0, 1]]],
+                         [[0, 0, M[1, 0]], [0, 1, -M[0, 0]]]])
+    b = np.einsum("ojk,jn->onk", adjugate, noise)
+    a = np.array([1, -np.trace(M), np.linalg.det(M)])
+
+    return b, a
+
+
+def filter_trap_noise(noise, b, a, memory=None):
+    """
+    Calculates the state of a trap from the random numbers of its steps with the filter of filter_coefficients(). Long
+    series can be calculated in consecutive chunks by passing the memory returned by the previous chunk
+
+    Args:
+        noise (np.array): standard normal random numbers, with shape (..., samples, 2). The state at each sample
+            depends on the random numbers of the previous samples
+        b (np.array(2, 2, 3)): numerator coefficients from filter_coefficients()
+        a (np.array(3)): denominator coefficients from filter_coefficients()
+        memory (tuple): last random numbers and filter state of the previous chunk. None for the first chunk
+
+    Returns:
+        state (np.array): x and v at each sample, with shape (..., samples, 2)
+        memory (tuple): memory for the next chunk
+    """
+    samples = noise.shape[-2]
+    if memory is None:
+        memory = (np.zeros(noise.shape[:-2] + (2, 2)), np.zeros(noise.shape[:-2] + (2, 2)))
+    previousNoise, filterState = memory
+
+    # moving average part, with the last random numbers of the previous chunk
+    extendedNoise = np.concatenate((previousNoise, noise), axis=-2)
+    forcing = sum(np.einsum("...ij,oj->...io", extendedNoise[..., 2 - k:2 - k + samples, :], b[:, :, k])
+                  for k in range(3))
+
+    state = np.empty(noise.shape)
+    newFilterState = np.empty(filterState.shape)
+    for component in range(2):
+        state[..., component], newFilterState[..., component, :] = \
+            lfilter([1], a, forcing[..., component], axis=-1, zi=filterState[..., component, :])
+
+    return state, (extendedNoise[..., -2:, :], newFilterState)
+
+
+def simulate_traps(dataPoints=1e3, timeStep=0.001, radius=1000, viscosity=1e-9, trapStiffness=0.1, temperature=25,
+                   realizations=1, seed=None, filePath=None, chunkSize=SIMULATION_CHUNK_SIZE):
+    """
+    Simulates the position and velocity time series of spheres in many independent optical traps (or axes of a trap)
+    at once, with the filter form of the model (see filter_coefficients()). The parameters can be arrays, which are
+    broadcast together to the shape of the traps. Long series are generated in chunks and can be written directly to
+    disk
+
+    Args:
+        dataPoints (int): Number of data points in each time series. (Default: 1e3)
+        timeStep (float): Difference between two time points in [s]; delta time (Default: 0.001 s)
+        radius (float or array): Radius of trapped sphere in [nm]. (Default: 1000)
+        viscosity (float or array): Dynamic viscosity in [pN/nm^2 s] (Default: 1e-9 pN/nm^2 s)
+        trapStiffness (float or array): Stiffness of simulated trap, k, in [pN/nm]. For instance [[kx1, ky1],
+            [kx2, ky2]] for the two axes of two traps. (Default: 0.1 pN/nm)
+        temperature (float or array): Temperature in [°C]. (Default: 25 °C)
+        realizations (int): Number of independent series of each trap. (Default: 1)
+        seed (int): Seed of the random number generators. The same seed gives the same series for any chunkSize.
+            (Default: None)
+        filePath (str): Path of a .npy file where the series are written. If None, they are kept in memory
+        chunkSize (int): Number of data points generated at once for each trap and realization
+
+    Returns:
+        state (np.array): x in [nm] and v in [nm/s] of each realization, trap and data point, with shape
+            (realizations, *traps, dataPoints, 2). A memory map of the file if filePath is given
+    """
+    assert timeStep > 0
+    assert np.all(np.asarray(radius) > 0)
+    assert dataPoints > 0
+
+    dataPoints = int(dataPoints)
+    parameters = np.broadcast_arrays(*[np.asarray(parameter, dtype=float) for parameter in
+                                       (radius, viscosity, trapStiffness, temperature)])
+    trapShape = parameters[0].shape
+    shape = (realizations,) + trapShape + (dataPoints, 2)
+    if filePath is None:
+        state = np.empty(shape)
+    else:
+        state = np.lib.format.open_memmap(filePath, mode="w+", dtype=float, shape=shape)
+
+    #one independent random stream per trap and realization, consumed in order, so the series do not depend on the
+    #chunk size
+    seedSequences = np.random.SeedSequence(seed).spawn(int(np.prod(trapShape)) * realizations)
+    for trapNumber, trap in enumerate(np.ndindex(trapShape)):
+        trapRadius, trapViscosity, trapStiffnessValue, trapTemperature = [parameter[trap] for parameter in parameters]
+        b, a = filter_coefficients(timeStep, trapRadius, trapViscosity, trapStiffnessValue, trapTemperature)
+        randomGenerators = [np.random.default_rng(seedSequence) for seedSequence in
+                            seedSequences[trapNumber * realizations: (trapNumber + 1) * realizations]]
+        memory = None
+        for start in range(0, dataPoints, chunkSize):
+            stop = min(start + chunkSize, dataPoints)
+            noise = np.stack([randomGenerator.standard_normal((stop - start, 2))
+                              for randomGenerator in randomGenerators])
+            state[(slice(None),) + trap + (slice(start, stop),)], memory = filter_trap_noise(noise, b, a, memory)
+
+    if filePath is not None:
+        state.flush()
+
+    return state
+
+
 def simulate_trap(dataPoints=1e3,
                   timeStep=0.001,
                   radius=1000,
@@ -204,29 +347,15 @@ def simulate_trap(dataPoints=1e3,
     assert radius > 0
     assert dataPoints > 0
 
-    # boundary conditions
-    drag = drag_sphere(radius=radius, dynamicViscosity=viscosity)
-    mass = mass_sphere(radius=radius)
-    D = diffusion_coefficient(radius=radius, temperature=temperature, dynamicViscosity=viscosity)
-
-    l = eigenvalues(dragCoefficient=drag, massSphere=mass, trapStiffness=trapStiffness)
-
-    c = cValues(eigenvalues=l, timeStep=timeStep)
-
-    expM = exp_Matrix(eigenvalues=l, cValues=c).T
-
-    A = aValues(diffusionCoefficient=D, eigenvalues=l, cValues=c)
+    dataPoints = int(dataPoints)
+    b, a = filter_coefficients(timeStep, radius, viscosity, trapStiffness, temperature)
 
-    alphaValue = alpha(eigenvalues=l, cValues=c)
+    # two random numbers per step, in the same order as step(); the last state does not need a step
+    noise = np.concatenate((np.random.randn(dataPoints - 1, 2), np.zeros((1, 2))))
 
     state = np.zeros((dataPoints, 3))
-    state[:, 0] = np.arange(0, timeStep * dataPoints, timeStep)
-
-    for i in range(int(dataPoints) - 1):
-
-        singleStep = step(eigenvalues=l, aValues=A, alpha=alphaValue)
-
-        state[i + 1, 1:3] = state[i, 1:3] * expM + singleStep
+    state[:, 0] = np.arange(0, timeStep * dataPoints, timeStep)[:dataPoints]
+    state[:, 1:3] = filter_trap_noise(noise, b, a)[0]
 
     state = pd.DataFrame(state, columns=['t', 'x', 'v'])
     return state
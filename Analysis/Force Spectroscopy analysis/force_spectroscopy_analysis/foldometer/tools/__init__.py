@@ -10,5 +10,7 @@ __doc__ = """\
 Module containing different tools for general purpose
 """
 
-from . import maths, plots, misc
+from foldometer.tools.lazy import lazy_attributes
+
+__getattr__, __dir__ = lazy_attributes(__name__, {module: "." + module for module in __all__ if module != "__init__"})
 
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__doc__ = """\
+On-disk cache for the stages of the processing pipeline. Each call to a cached stage is identified by the stage name,
+the version of the package and a hash of its arguments, so reopening an experiment that was already processed only
+loads the stored results. Arguments that are paths to files are identified by the path, size and modification time of
+the file, and small arguments by their content. The data a stage works on is not hashed: it is identified by its source
+(see source_key()), the file it was read from and the stages and parameters it went through, which the caller carries
+from the reader (see foldometer.core.main.Folding). Calls without a source are not cached. DataFrames are stored column
+by column in npz files, any other result is pickled.
+
+The cache is disabled by default. FOLDOMETER_CACHE=1 (or set_cache() from Python) enables it. The results are stored in
+~/.cache/foldometer (FOLDOMETER_CACHE_DIR), and when they take more than 2 GB (FOLDOMETER_CACHE_SIZE, in bytes) the
+least recently used ones are deleted.
+"""
+
+from foldometer import __version__
+from collections import OrderedDict as od
+from functools import wraps
+import numpy as np
+import pandas as pd
+import hashlib
+import inspect
+import pickle
+import shutil
+import json
+import warnings
+import os
+
+
+CACHE_SETTINGS = {"enabled": os.environ.get("FOLDOMETER_CACHE", "0") == "1",
+                  "directory": os.environ.get("FOLDOMETER_CACHE_DIR",
+                                              os.path.join(os.path.expanduser("~"), ".cache", "foldometer")),
+                  "maxSize": int(float(os.environ.get("FOLDOMETER_CACHE_SIZE", 2e9)))}
+HASH_CHUNK_SIZE = 2 ** 24
+MANIFEST_NAME = "manifest.json"
+#Format of the results of the stages, part of the keys so results stored in an older format are computed again
+RESULT_FORMAT = 2
+
+#hashes of the files already read in this process, indexed by (path, size, modification time)
+_fileHashes = {}
+
+
+def set_cache(enabled=True, directory=None, maxSize=None):
+    """
+    Function to enable or disable the cache of the pipeline stages and to choose where the results are stored
+
+    Args:
+        enabled (bool): if False, the stages are always computed and nothing is stored. Default is True
+        directory (str): folder where the results are stored. If None, the current folder is kept
+        maxSize (int): maximum size of the stored results in bytes, see evict_results(). If None, the current maximum
+            is kept
+    """
+
+    CACHE_SETTINGS["enabled"] = enabled
+    if directory is not None:
+        CACHE_SETTINGS["directory"] = directory
+    if maxSize is not None:
+        CACHE_SETTINGS["maxSize"] = maxSize
+
+
+def clear_cache(stage=None):
+    """
+    Function to delete the stored results of the pipeline stages
+
+    Args:
+        stage (str): name of the stage to be cleared. If None, the results of all the stages are deleted
+    """
+
+    directory = CACHE_SETTINGS["directory"]
+    if stage is not None:
+        directory = os.path.join(directory, stage)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+
+
+def file_hash(filePath):
+    """
+    Function to calculate the hash of the content of a file. The hash is only calculated once per process, as long as
+    the size and modification time of the file do not change
+
+    Args:
+        filePath (str): path of the file
+
+    Returns:
+        fileHash (str): hexadecimal SHA-1 digest of the content of the file
+    """
+
+    fileStat = os.stat(filePath)
+    fileKey = (os.path.abspath(filePath), fileStat.st_size, fileStat.st_mtime_ns)
+    if fileKey not in _fileHashes:
+        hasher = hashlib.sha1()
+        with open(filePath, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        _fileHashes[fileKey] = hasher.hexdigest()
+
+    return _fileHashes[fileKey]
+
+
+def file_identity(filePath):
+    """
+    Function to identify a file without reading it: a new version of the file changes its size or modification time
+
+    Args:
+        filePath (str): path of the file
+
+    Returns:
+        identity (tuple): absolute path, size and modification time in ns of the file
+    """
+
+    fileStat = os.stat(filePath)
+
+    return os.path.abspath(filePath), fileStat.st_size, fileStat.st_mtime_ns
+
+
+def _update_hash(hasher, value):
+    """
+    Function to add the content of an argument of a stage to a hash, going through containers recursively
+
+    Args:
+        hasher (hashlib.sha1): hash object to be updated
+        value: argument of the stage
+    """
+
+    hasher.update(type(value).__name__.encode())
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        hasher.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+        if isinstance(value, pd.DataFrame):
+            hasher.update(repr(list(zip(value.columns, value.dtypes))).encode())
+        else:
+            hasher.update(repr((value.name, value.dtype)).encode())
+    elif isinstance(value, np.ndarray):
+        hasher.update(repr((value.shape, value.dtype)).encode())
+        hasher.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=repr):
+            _update_hash(hasher, key)
+            _update_hash(hasher, value[key])
+    elif isinstance(value, (list, tuple)):
+        hasher.update(str(len(value)).encode())
+        for item in value:
+            _update_hash(hasher, item)
+    elif isinstance(value, str) and os.path.isfile(value):
+        hasher.update(repr(file_identity(value)).encode())
+    else:
+        hasher.update(repr(value).encode())
+
+
+def stage_key(stage, arguments):
+    """
+    Function to calculate the key identifying a call to a pipeline stage
+
+    Args:
+        stage (str): name of the stage
+        arguments (dict): arguments of the call, by name
+
+    Returns:
+        key (str): hexadecimal SHA-1 digest of the stage, package version, result format and arguments
+    """
+
+    hasher = hashlib.sha1()
+    _update_hash(hasher, (stage, __version__, RESULT_FORMAT))
+    _update_hash(hasher, arguments)
+
+    return hasher.hexdigest()
+
+
+def source_key(*parts):
+    """
+    Function to calculate the key identifying the source of some data: the file it was read from and how, e.g.
+    source_key("read_file", filePath, timeInterval). The data derived from it by a cached stage has the key of that call
+    as source, see cached_stage()
+
+    Args:
+        *parts: reader, paths of the files and parameters of the reading
+
+    Returns:
+        key (str): hexadecimal SHA-1 digest of the parts
+    """
+
+    hasher = hashlib.sha1()
+    _update_hash(hasher, parts)
+
+    return hasher.hexdigest()
+
+
+def _storable_frame(data):
+    """
+    Function to check if a DataFrame can be stored column by column in a npz file
+
+    Args:
+        data (pandas.DataFrame): DataFrame to be stored
+
+    Returns:
+        storable (bool): True if all the columns are plain numpy arrays or categorical columns, and the index is a plain
+        numpy array
+    """
+
+    return not isinstance(data.index, pd.MultiIndex) and not isinstance(data.columns, pd.MultiIndex) and \
+        all(isinstance(dtype, (np.dtype, pd.CategoricalDtype)) for dtype in data.dtypes) and \
+        isinstance(data.index.dtype, np.dtype)
+
+
+def _save_frame(filePath, data):
+    """
+    Function to store a DataFrame column by column in a npz file. Categorical columns are stored as their codes and
+    categories
+
+    Args:
+        filePath (str): path of the file
+        data (pandas.DataFrame): DataFrame to be stored
+    """
+
+    arrays = od()
+    for position in range(data.shape[1]):
+        column = data.iloc[:, position]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            arrays["column{}".format(position)] = column.cat.codes.values
+            arrays["categories{}".format(position)] = np.array(list(column.cat.categories) + [None], dtype=object)[:-1]
+            arrays["ordered{}".format(position)] = column.cat.ordered
+        else:
+            arrays["column{}".format(position)] = column.values
+    np.savez(filePath, columns=np.array(list(data.columns) + [None], dtype=object)[:-1], index=data.index.values,
+             indexName=np.array([data.index.name], dtype=object), **arrays)
+
+
+def _load_frame(filePath):
+    """
+    Function to load a DataFrame stored with _save_frame()
+
+    Args:
+        filePath (str): path of the file
+
+    Returns:
+        data (pandas.DataFrame): stored DataFrame
+    """
+
+    with np.load(filePath, allow_pickle=True) as stored:
+        columns = list(stored["columns"])
+        arrays = od()
+        for position in range(len(columns)):
+            arrays[position] = stored["column{}".format(position)]
+            if "categories{}".format(position) in stored.files:
+                arrays[position] = pd.Categorical.from_codes(arrays[position],
+                                                             categories=stored["categories{}".format(position)],
+                                                             ordered=bool(stored["ordered{}".format(position)]))
+        data = pd.DataFrame(arrays, index=pd.Index(stored["index"], name=stored["indexName"][0]))
+    data.columns = columns
+
+    return data
+
+
+def _save_result(directory, result):
+    """
+    Function to store the result of a stage in a folder. Results that are tuples are stored item by item
+
+    Args:
+        directory (str): folder where the result is stored
+        result: result of the stage
+    """
+
+    container = "tuple" if isinstance(result, tuple) else "single"
+    items = result if container == "tuple" else (result,)
+    manifest = {"container": container, "items": []}
+    for position, item in enumerate(items):
+        if isinstance(item, pd.DataFrame) and _storable_frame(item):
+            fileName = "{}.npz".format(position)
+            _save_frame(os.path.join(directory, fileName), item)
+        else:
+            fileName = "{}.pkl".format(position)
+            with open(os.path.join(directory, fileName), "wb") as f:
+                pickle.dump(item, f, protocol=pickle.HIGHEST_PROTOCOL)
+        manifest["items"].append(fileName)
+    with open(os.path.join(directory, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f)
+
+
+def _load_result(directory):
+    """
+    Function to load the result of a stage stored with _save_result()
+
+    Args:
+        directory (str): folder where the result is stored
+
+    Returns:
+        result: stored result of the stage
+    """
+
+    with open(os.path.join(directory, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    items = []
+    for fileName in manifest["items"]:
+        if fileName.endswith(".npz"):
+            items.append(_load_frame(os.path.join(directory, fileName)))
+        else:
+            with open(os.path.join(directory, fileName), "rb") as f:
+                items.append(pickle.load(f))
+
+    return tuple(items) if manifest["container"] == "tuple" else items[0]
+
+
+def _directory_size(directory):
+    """
+    Function to calculate the size of the files in a folder
+
+    Args:
+        directory (str): folder
+
+    Returns:
+        size (int): total size of its files in bytes
+    """
+
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+
+def evict_results(maxSize=None, keep=None):
+    """
+    Function to delete the least recently used results of the stages until the ones left take at most maxSize bytes.
+    The time a result was last used is the modification time of its manifest, updated every time it is loaded
+
+    Args:
+        maxSize (int): maximum size of the stored results in bytes. Default is CACHE_SETTINGS["maxSize"]
+        keep (str): folder of a result that is never deleted (the one just stored)
+
+    Returns:
+        deleted (int): number of results deleted
+    """
+
+    if maxSize is None:
+        maxSize = CACHE_SETTINGS["maxSize"]
+    results = []
+    cacheDirectory = CACHE_SETTINGS["directory"]
+    if not os.path.isdir(cacheDirectory):
+        return 0
+    for stageEntry in os.scandir(cacheDirectory):
+        if not stageEntry.is_dir():
+            continue
+        for resultEntry in os.scandir(stageEntry.path):
+            manifestPath = os.path.join(resultEntry.path, MANIFEST_NAME)
+            try:
+                results.append((os.stat(manifestPath).st_mtime, _directory_size(resultEntry.path), resultEntry.path))
+            except OSError:
+                #being written or deleted by another process
+                continue
+
+    totalSize = sum(size for _, size, _ in results)
+    deleted = 0
+    for _, size, directory in sorted(results):
+        if totalSize <= maxSize:
+            break
+        if keep is not None and os.path.abspath(directory) == os.path.abspath(keep):
+            continue
+        shutil.rmtree(directory, ignore_errors=True)
+        totalSize -= size
+        deleted += 1
+
+    return deleted
+
+
+def cached_stage(stage=None, ignore=(), data=None):
+    """
+    Decorator to store on disk the results of a stage of the pipeline, see the module documentation. Arguments with
+    side effects only (like plotting) should be ignored for the key. The stages working on data accept a "source"
+    keyword argument with the key of the source of the data (see source_key()), which identifies the data instead of its
+    values. The key of a call, which is the source of its result, is given by the call_key attribute of the stage,
+    called with the same arguments
+
+    Args:
+        stage (str): name of the stage, used for the folder where its results are stored. Default is the function name
+        ignore (tuple): names of the arguments that are not used to identify the call
+        data (str): name of the argument with the data, identified by its source. Calls without a source are not cached
+
+    Returns:
+        decorator (function): decorator for the function of the stage
+    """
+
+    def decorator(function):
+        stageName = stage or function.__name__
+        signature = inspect.signature(function)
+
+        def call_key(*args, **kwargs):
+            source = kwargs.pop("source", None) if data is not None else None
+            if data is not None and source is None:
+                return None
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            keyArguments = od([(name, source if name == data else value)
+                               for name, value in arguments.arguments.items() if name not in ignore])
+
+            return stage_key(stageName, keyArguments)
+
+        @wraps(function)
+        def cached_function(*args, **kwargs):
+            key = call_key(*args, **kwargs) if CACHE_SETTINGS["enabled"] else None
+            if data is not None:
+                kwargs.pop("source", None)
+            if key is None:
+                return function(*args, **kwargs)
+            directory = os.path.join(CACHE_SETTINGS["directory"], stageName, key)
+            if os.path.isfile(os.path.join(directory, MANIFEST_NAME)):
+                try:
+                    result = _load_result(directory)
+                except Exception as error:
+                    warnings.warn("Cached result of " + stageName + " could not be loaded, computing it again: " +
+                                  str(error))
+                else:
+                    #mark the result as recently used, see evict_results()
+                    try:
+                        os.utime(os.path.join(directory, MANIFEST_NAME))
+                    except OSError:
+                        pass
+                    return result
+
+            result = function(*args, **kwargs)
+
+            #Write in a temporary folder first so an interrupted write never leaves a partial result
+            temporaryDirectory = directory + ".tmp{}".format(os.getpid())
+            try:
+                os.makedirs(temporaryDirectory, exist_ok=True)
+                _save_result(temporaryDirectory, result)
+                if os.path.isdir(directory):
+                    shutil.rmtree(directory)
+                os.replace(temporaryDirectory, directory)
+            except Exception as error:
+                shutil.rmtree(temporaryDirectory, ignore_errors=True)
+                warnings.warn("Result of " + stageName + " could not be cached: " + str(error))
+            evict_results(keep=directory)
+
+            return result
+
+        cached_function.uncached = function
+        cached_function.call_key = call_key
+
+        return cached_function
+
+    return decorator
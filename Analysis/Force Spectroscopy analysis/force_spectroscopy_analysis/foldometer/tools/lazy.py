@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__doc__ = """\
+Lazy loading of the attributes of the packages of foldometer. A package declares where each of its public names lives
+and the module holding it is imported the first time the name is used, so importing foldometer (or reading a file with
+foldometer.ixo.binary) does not load the plotting, fitting and GUI dependencies of the rest of the package.
+
+Example (in the __init__.py of a package):
+    >>> from foldometer.tools.lazy import lazy_attributes
+    >>> __getattr__, __dir__ = lazy_attributes(__name__, {"read_file": ".binary:read_file", "binary": ".binary"})
+"""
+
+import importlib
+import sys
+
+
+def lazy_attributes(packageName, attributes):
+    """
+    Function to create the module level __getattr__ and __dir__ functions (PEP 562) of a package with lazy attributes
+
+    Args:
+        packageName (str): full name of the package (__name__ in its __init__.py)
+        attributes (dict): for each name, "module:attribute" to get an attribute of a module, or "module" to get the
+            module itself. Module names starting with "." are relative to the package
+
+    Returns:
+        __getattr__ (function): function importing the module of a name the first time it is accessed
+        __dir__ (function): function listing the names of the package, loaded or not
+    """
+
+    def __getattr__(name):
+        if name not in attributes:
+            raise AttributeError("module '{}' has no attribute '{}'".format(packageName, name))
+        moduleName, _, attributeName = attributes[name].partition(":")
+        value = importlib.import_module(moduleName, packageName)
+        if attributeName:
+            value = getattr(value, attributeName)
+        #the next accesses find the name in the package and do not go through __getattr__
+        setattr(sys.modules[packageName], name, value)
+
+        return value
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[packageName])) | set(attributes))
+
+    return __getattr__, __dir__
@@ -4,6 +4,7 @@
 import numpy as np
 import pandas as pd
 from scipy.signal import savgol_filter
+from scipy.fft import next_fast_len
 
 
 def column_derivative(columnY, columnX, smooth=True, returnAll=False, **kwargs):
@@ -84,10 +85,72 @@ def include_derivative(data, columnY, columnX="time", smooth=True, force=False,
     return data
 
 
+def fft_correlate(x, y, minLag, maxLag):
+    """
+    Compute the sums of products of two arrays at a range of lags with FFT, in O(N log(N)) for all the lags. Arrays
+    with more than one dimension are correlated along the last axis, row by row (with broadcasting)
+
+    Args:
+        x (array_like): input array
+        y (array_like): input array
+        minLag (int): first lag, can be negative
+        maxLag (int): last lag (included)
+
+    Returns:
+        res (numpy.array): array with the lags in the last axis, res[..., i] = sum over j of x[..., j] * y[..., j + lag]
+            for lag = minLag + i. Lags without overlap between the arrays give 0
+    """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    fftLength = next_fast_len(x.shape[-1] + y.shape[-1] - 1)
+    correlation = np.fft.irfft(np.conj(np.fft.rfft(x, fftLength)) * np.fft.rfft(y, fftLength), fftLength)
+
+    #negative lags are wrapped at the end of the circular correlation
+    lags = np.arange(minLag, maxLag + 1)
+    overlap = (lags > -x.shape[-1]) & (lags < y.shape[-1])
+    res = np.zeros(correlation.shape[:-1] + lags.shape)
+    res[..., overlap] = correlation[..., lags[overlap] % fftLength]
+
+    return res
+
+
+def parabolic_peak(values, minimum=False):
+    """
+    Find the position of the maximum (or minimum) of sampled values with sub-sample precision, from the vertex of the
+    parabola through the extreme sample and its neighbours. Arrays with more than one dimension are processed along the
+    last axis. Extremes at the edges are not refined
+
+    Args:
+        values (array_like): sampled values, NaN values are ignored
+        minimum (bool): if True, find the minimum instead of the maximum
+
+    Returns:
+        position (numpy.array): position of the peak in samples, NaN for rows without any valid value
+    """
+
+    values = np.asarray(values, dtype=float)
+    if minimum:
+        values = -values
+    valid = ~np.all(np.isnan(values), axis=-1)
+    filled = np.where(np.isnan(values), -np.inf, values)
+    index = np.argmax(filled, axis=-1)
+    padded = np.pad(filled, [(0, 0)] * (filled.ndim - 1) + [(1, 1)], constant_values=-np.inf)
+    left, center, right = [np.take_along_axis(padded, np.expand_dims(index + shift, -1), -1)[..., 0]
+                           for shift in range(3)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        curvature = left - 2 * center + right
+        offset = np.where(np.isfinite(curvature) & (curvature < 0), 0.5 * (left - right) / curvature, 0)
+    position = index + np.clip(offset, -0.5, 0.5)
+
+    return np.where(valid, position, np.nan)
+
+
 def cross_correlation(x, y, maxLag=None, lagStep=1):
     """
     Compute the correlation coefficients of two one dimensional arrays with a given maximum lag.\
-    The input vectors are converted to numpy arrays.
+    The input vectors are converted to numpy arrays. The products at all the lags are computed at once with FFT (see
+    fft_correlate()). Arrays with more than one dimension are correlated along the last axis, row by row
     http://en.wikipedia.org/wiki/Pearson_product-moment_correlation_coefficient
     Or see: Chatfield, 2004, The analysis of time series
 
@@ -101,31 +164,26 @@ def cross_correlation(x, y, maxLag=None, lagStep=1):
         res (numpy.array): A one dimensional vector of length maxLag + 1 (to account for zero lag).
     """
 
-    if maxLag is None:
-        maxLag = len(x) // 4
-
     # convert input to numpy array for speed
-    x = np.array(x)
-    y = np.array(y)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    if maxLag is None:
+        maxLag = x.shape[-1] // 4
 
-    # prepare output array
-    xcorr = []
     # check length of y
-    if len(y) < maxLag + 1:
+    if y.shape[-1] < maxLag + 1:
         raise ValueError('y array is too short.')
 
     # pre-computing mean and denominator
-    mx = np.mean(x)
-    my = np.mean(y)
-    denominator = np.sqrt(np.sum((x - mx) ** 2) * np.sum((y - my) ** 2))
-
-    # compute correlation coefficient for each lag
-    for i in np.arange(0, maxLag + 1, lagStep):
-        dx = x[:len(x) - i] - mx
-        dy = y[i:] - my
-        nom = np.sum(dx * dy)
-        xcorr.append(nom / denominator)
-    return xcorr
+    dx = x - np.mean(x, axis=-1, keepdims=True)
+    dy = y - np.mean(y, axis=-1, keepdims=True)
+    denominator = np.sqrt(np.sum(dx ** 2, axis=-1) * np.sum(dy ** 2, axis=-1))
+
+    #only the first len(x) - lag points of x overlap with y at each lag
+    xcorr = fft_correlate(dx, dy[..., :x.shape[-1]], 0, maxLag)[..., ::lagStep]
+
+    return xcorr / np.expand_dims(denominator, -1)
 
 
 def goodness_fit(y, residuals):
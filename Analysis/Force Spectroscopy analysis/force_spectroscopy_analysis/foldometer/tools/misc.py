@@ -3,9 +3,9 @@
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.widgets import SpanSelector
 import warnings
+from foldometer.tools.schema import region_codes, region_categorical
+from foldometer.tools.selection import range_rule, apply_selection
 
 warnings.filterwarnings('ignore')
 
@@ -46,19 +46,22 @@ def format_pulling_cycles(pulls, initialPull, totalPulls):
     return pulls
 
 
-def data_selection(data, columnX="time", columnY="forceX", ylim=None):
+def range_selection(data, columnX="time", columnY="forceX", ylim=None, exclude=False):
     """
-    Opens a plot and allows to select a portion of the data by dragging the mouse. Pressing any key will confirm the
+    Opens a plot and allows to select a range of the X axis by dragging the mouse. Pressing any key will confirm the
     selection and close the window
 
     Args:
         data (pandas.DataFrame): DataFrame with the data source to select from
         columnX (str): column to display in the X axis
         columnY (str): column to display in the Y axis
+        exclude (bool): if True, the rule removes the selected range instead of keeping it. Default is False
 
     Returns:
-        subData (pandas.DataFrame): selected subset of original data
+        rule (dict): rule selecting the range of columnX, see foldometer.tools.selection.range_rule()
     """
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import SpanSelector
 
     fig = plt.figure(figsize=(8, 6))
     ax = fig.add_subplot(111)
@@ -70,6 +73,7 @@ def data_selection(data, columnX="time", columnY="forceX", ylim=None):
 
     fig.suptitle("Press any key to confirm selection and close this window", fontsize=14, fontweight='bold')
     ax.set_title("Select data by dragging the mouse")
+    selected = {"indmin": 0, "indmax": len(x) - 1, "span": None}
 
     def onselect(xmin, xmax):
         """
@@ -79,19 +83,15 @@ def data_selection(data, columnX="time", columnY="forceX", ylim=None):
             xmin (int): minimum index of selection
             xmax (int): maximum index of selection
         """
-        global indmin
-        global indmax
-        global span
 
-        try:
-            span.remove()
+        if selected["span"] is not None:
+            selected["span"].remove()
             fig.canvas.draw()
-        except:
-            pass
 
         indmin, indmax = np.searchsorted(x, (xmin, xmax))
-        indmax = min(len(x) - 1, indmax)
-        ax.axvspan(x.values[int(indmin)], x.values[int(indmax)], facecolor="red", alpha=0.5)
+        selected["indmin"], selected["indmax"] = int(indmin), min(len(x) - 1, int(indmax))
+        selected["span"] = ax.axvspan(x.values[selected["indmin"]], x.values[selected["indmax"]], facecolor="red",
+                                      alpha=0.5)
         fig.canvas.draw()
 
     # set useblit True on gtkagg for enhanced performance
@@ -108,32 +108,43 @@ def data_selection(data, columnX="time", columnY="forceX", ylim=None):
         else:
             pass
 
-    idCol = column_indexer(data)
-    mask = (data[columnX] >= data.iloc[indmin, idCol[columnX]]) & \
-           (data[columnX] <= data.iloc[indmax, idCol[columnX]])
-    subData = data.loc[mask, :]
+    return range_rule(columnX, x.values[selected["indmin"]], x.values[selected["indmax"]], exclude)
 
-    return subData
 
-
-def data_deletion(data, columnX="time", columnY="forceX"):
+def data_selection(data, columnX="time", columnY="forceX", ylim=None, view=False):
     """
     Opens a plot and allows to select a portion of the data by dragging the mouse. Pressing any key will confirm the
-    selection and close the window
+    selection and close the window. To repeat the selection without the plot, see foldometer.tools.selection
 
     Args:
         data (pandas.DataFrame): DataFrame with the data source to select from
         columnX (str): column to display in the X axis
         columnY (str): column to display in the Y axis
+        view (bool): if True and the selected rows are contiguous, return a slice sharing the memory of data instead
+            of a copy. Default is False
 
     Returns:
         subData (pandas.DataFrame): selected subset of original data
     """
 
-    subset = data_selection(data, columnX, columnY)
+    return apply_selection(data, [range_selection(data, columnX, columnY, ylim)], view)
+
+
+def data_deletion(data, columnX="time", columnY="forceX"):
+    """
+    Opens a plot and allows to select a portion of the data by dragging the mouse. Pressing any key will confirm the
+    selection and close the window. To repeat the deletion without the plot, see foldometer.tools.selection
+
+    Args:
+        data (pandas.DataFrame): DataFrame with the data source to select from
+        columnX (str): column to display in the X axis
+        columnY (str): column to display in the Y axis
+
+    Returns:
+        subData (pandas.DataFrame): original data without the selected portion
+    """
 
-    data = data.drop(subset.index)
-    return data
+    return apply_selection(data, [range_selection(data, columnX, columnY, exclude=True)])
 
 
 def resample_data(data, time, unit='s'):
@@ -148,10 +159,12 @@ def resample_data(data, time, unit='s'):
         data.index = pd.to_timedelta(data.index, unit=unit)
 
     if "region" in data.columns:
-        regionDict = {"pulling": 0, "retracting": 1, "stationary": 2}
-        data["region"] = data["region"].map(regionDict)
-        dataResampled = data.resample(rule=str(time)+'ms').mean()
-        dataResampled["region"] = dataResampled["region"].map({v: k for k, v in regionDict.items()})
+        #the regions are resampled as their codes, the bins with more than one region are left without region
+        codes = pd.Series(region_codes(data["region"]), index=data.index).replace(-1, np.nan)
+        dataResampled = data.assign(region=codes).resample(rule=str(time)+'ms').mean()
+        codesResampled = codes.resample(rule=str(time)+'ms')
+        lowestCode, highestCode = codesResampled.min().values, codesResampled.max().values
+        dataResampled["region"] = region_categorical(np.where(lowestCode == highestCode, lowestCode, -1))
     else:
         dataResampled = data.resample(rule=str(time)+'ms').mean()
 
@@ -11,7 +11,7 @@ import string
 from foldometer.tools.maths import cross_correlation
 from foldometer.tools.misc import format_pulling_cycles
 #from foldometer.physics.polymer import wlc, wlc_series
-from foldometer.analysis.wlc_curve_fit import wlc, wlc_series, wlc_from_fit, wlc_series_accurate
+from foldometer.analysis.wlc_curve_fit import wlc, wlc_series, wlc_from_fit, wlc_series_accurate_table
 from foldometer.tools.misc import column_indexer, resample_data
 from scipy.signal import savgol_filter
 from scipy.signal import medfilt
@@ -291,12 +291,12 @@ def force_extension_curve(data, unfoldingData=None, wlcData=None, axis="x", forc
         print("ye")
         forceArray = np.arange(0.5, 60, 0.2)
         for length in rulers:
-            axForceExtension.plot(wlc_series_accurate(forceArray,
-                                                      wlcParameters["contourLengthDNA"],
-                                                      wlcParameters["persistenceLengthDNA"],
-                                                      wlcParameters["stretchModulusDNA"],
-                                                      length, wlcParameters["persistenceLengthProtein"],
-                                                      ), forceArray, color="gray")
+            axForceExtension.plot(wlc_series_accurate_table(forceArray,
+                                                            wlcParameters["contourLengthDNA"],
+                                                            wlcParameters["persistenceLengthDNA"],
+                                                            wlcParameters["stretchModulusDNA"],
+                                                            length, wlcParameters["persistenceLengthProtein"]),
+                                  forceArray, color="gray")
         #ruler = pd.read_csv(sMBP_1300_DIG_BIOTIN_RULER, sep="\t", decimal=",", dtype=float)
         #ruler = ruler.ix[ruler.iloc[:, 3] < 40, :]
         #ruler.iloc[:,[0, 1, 2]] *= 1e3
@@ -349,7 +349,8 @@ def grid_plotting(data, events=None, wlcFits=False, colWrap=4, xlim=(600,1000),
     offsetedData["surfaceSepX"] += extensionOffset
     offsetedData["forceX"] += forceOffset
 
-    g = sns.FacetGrid(offsetedData[condition], hue="region", col="pullingCycle", col_wrap=colWrap, palette="Set2")
+    g = sns.FacetGrid(offsetedData[condition], hue="region", col="pullingCycle", col_wrap=colWrap, palette="Set2",
+                      hue_order=list(offsetedData.loc[condition, "region"].unique()))
 
     g.map_dataframe(force_extension_grid)
     g.set(xlim=xlim)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__doc__ = """\
+Opt-in profiling of the stages of the processing pipeline. While a Profile is active (used as a context manager, or
+enabled in a Folding measurement), every call to a profiled stage records its wall time, CPU time, rows in and out and
+the increase of the resident memory (RSS) of the process at its peak. Stages called inside other stages are recorded
+too, with the name of the enclosing stage. Nothing is measured while no profile is active
+
+Example:
+    >>> import foldometer as fm
+    >>> measurement = fm.Folding("fileName.dat")
+    >>> with measurement.profiling():
+    ...     measurement.process_data()
+    ...     measurement.assign_regions()
+    >>> measurement.profile.to_csv("profile.csv")
+"""
+
+from collections import OrderedDict as od
+from functools import wraps
+import threading
+import json
+import time
+import os
+
+
+#Interval in seconds between the measurements of the resident memory while a stage runs
+RSS_SAMPLING_INTERVAL = 0.01
+#Attributes holding the data of an object (like a Folding measurement), from the most to the least processed
+ROW_ATTRIBUTES = ["data", "allData", "rawData", "allRawData"]
+PROFILE_LABELS = ["stage", "parent", "depth", "start", "wallTime", "cpuTime", "rowsIn", "rowsOut", "peakRSSDelta"]
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+#profiles collecting records and stages running, in the order they were started
+_activeProfiles = []
+_openStages = []
+_samplerLock = threading.Lock()
+
+
+def resident_memory():
+    """
+    Function to get the resident memory (RSS) of the process, from /proc on Linux or from psutil if it is installed
+
+    Returns:
+        rss (int): resident memory in bytes. None if it cannot be measured
+    """
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+def _sample_memory():
+    """
+    Function run in a background thread while there are stages running, updating the peak resident memory of all of
+    them. It stops when the last stage finishes
+    """
+
+    while True:
+        rss = resident_memory()
+        with _samplerLock:
+            if not _openStages:
+                return
+            for record in _openStages:
+                record["_peakRSS"] = max(record["_peakRSS"], rss)
+        time.sleep(RSS_SAMPLING_INTERVAL)
+
+
+def count_rows(*values):
+    """
+    Function to get the number of rows of the data passed to or returned by a stage: the largest number of rows of
+    the DataFrames, Series and arrays among the values (and inside tuples and lists), or of the data of an object (see
+    ROW_ATTRIBUTES)
+
+    Args:
+        *values: arguments or results of a stage
+
+    Returns:
+        rows (int): number of rows. None if none of the values holds data
+    """
+
+    rows = None
+    for value in values:
+        if isinstance(value, (tuple, list)):
+            valueRows = count_rows(*value)
+        elif hasattr(value, "shape") and len(value.shape) > 0:
+            valueRows = int(value.shape[0])
+        else:
+            valueRows = next((count_rows(getattr(value, attribute)) for attribute in ROW_ATTRIBUTES
+                              if hasattr(getattr(value, attribute, None), "shape")), None)
+        if valueRows is not None:
+            rows = valueRows if rows is None else max(rows, valueRows)
+
+    return rows
+
+
+class Profile(object):
+    """
+    Records of the stages run while the profile is active. A profile is activated with start() (or entering it as a
+    context manager) and deactivated with stop(); the records of successive activations are kept together
+
+    Args:
+        enabled (bool): if True, the stages that are methods of the object owning the profile (see profiled_stage())
+            activate it while they run. Default is False
+
+    Attributes:
+        records (list): one dictionary per recorded call, with the values in PROFILE_LABELS
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.records = []
+        self.creationTime = time.perf_counter()
+
+    def __repr__(self):
+        return "Profile with %d records" % len(self.records)
+
+    def start(self):
+        """
+        Activate the profile, so the stages record themselves in it
+        """
+        if self not in _activeProfiles:
+            _activeProfiles.append(self)
+
+    def stop(self):
+        """
+        Deactivate the profile
+        """
+        if self in _activeProfiles:
+            _activeProfiles.remove(self)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exception):
+        self.stop()
+
+    def clear(self):
+        """
+        Delete all the records
+        """
+        self.records = []
+
+    def to_frame(self):
+        """
+        Records of the profile as a table
+
+        Returns:
+            report (pandas.DataFrame): one row per recorded call, in the order the calls started, with the stage, the
+            enclosing stage (parent), the nesting depth, the start time and the wall and CPU times in seconds, the rows
+            in and out and the increase of the resident memory at the peak in bytes
+        """
+        #pandas is not imported with the module, which is loaded by every stage, also by the light ones
+        import pandas as pd
+        return pd.DataFrame(sorted(self.records, key=lambda record: record["start"]), columns=PROFILE_LABELS)
+
+    def to_json(self, filePath=None):
+        """
+        Export the records of the profile as JSON
+
+        Args:
+            filePath (str): path of the file. If None, the JSON is only returned
+
+        Returns:
+            jsonProfile (str): the records as a JSON list
+        """
+        jsonProfile = json.dumps([od([(label, record[label]) for label in PROFILE_LABELS])
+                                  for record in sorted(self.records, key=lambda record: record["start"])], indent=4)
+        if filePath is not None:
+            with open(filePath, "w") as f:
+                f.write(jsonProfile)
+
+        return jsonProfile
+
+    def to_csv(self, filePath):
+        """
+        Export the records of the profile as CSV
+
+        Args:
+            filePath (str): path of the file
+        """
+        self.to_frame().to_csv(filePath, index=False)
+
+
+def profiling(enabled=False):
+    """
+    Function to create a profile, to be used as a context manager around the calls to be profiled
+
+    Args:
+        enabled (bool): see Profile
+
+    Returns:
+        profile (Profile): new profile
+    """
+
+    return Profile(enabled)
+
+
+def profiled_stage(stage=None):
+    """
+    Decorator to record the calls to a stage of the pipeline in the active profiles, see the module documentation. If
+    the stage is a method of an object with an enabled Profile in its "profile" attribute, that profile is active while
+    the method runs
+
+    Args:
+        stage (str): name of the stage. Default is the qualified name of the function (Class.method for methods)
+
+    Returns:
+        decorator (function): decorator for the function of the stage
+    """
+
+    def decorator(function):
+        stageName = stage or function.__qualname__
+
+        @wraps(function)
+        def profiled_function(*args, **kwargs):
+            ownerProfile = getattr(args[0], "profile", None) if args else None
+            activateOwner = isinstance(ownerProfile, Profile) and ownerProfile.enabled and \
+                ownerProfile not in _activeProfiles
+            if not _activeProfiles and not activateOwner:
+                return function(*args, **kwargs)
+
+            if activateOwner:
+                ownerProfile.start()
+            profiles = list(_activeProfiles)
+            with _samplerLock:
+                parent = _openStages[-1]["stage"] if _openStages else None
+                record = {"stage": stageName, "parent": parent, "depth": len(_openStages),
+                          "rowsIn": count_rows(*(list(args) + list(kwargs.values()))),
+                          "_startRSS": resident_memory(), "_peakRSS": resident_memory()}
+                startSampler = not _openStages and record["_startRSS"] is not None
+                _openStages.append(record)
+            if startSampler:
+                threading.Thread(target=_sample_memory, daemon=True).start()
+
+            startTime = time.perf_counter()
+            startCPU = time.process_time()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                wallTime = time.perf_counter() - startTime
+                cpuTime = time.process_time() - startCPU
+                with _samplerLock:
+                    _openStages.remove(record)
+                if activateOwner:
+                    ownerProfile.stop()
+
+            #the result of methods changing their object in place is the object itself
+            record["rowsOut"] = count_rows(args[0] if result is None and args else result)
+            record["wallTime"] = wallTime
+            record["cpuTime"] = cpuTime
+            if record["_startRSS"] is None:
+                record["peakRSSDelta"] = None
+            else:
+                record["peakRSSDelta"] = max(record["_peakRSS"], resident_memory()) - record["_startRSS"]
+            for profile in profiles:
+                profile.records.append(dict(record, start=startTime - profile.creationTime))
+
+            return result
+
+        return profiled_function
+
+    return decorator
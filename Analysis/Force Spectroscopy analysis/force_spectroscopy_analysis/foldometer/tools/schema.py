@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__doc__ = """\
+Types of the label columns of the processed data: the region of each sample is a categorical column (int8 codes) and
+the pulling cycles, WLC regions and events are int32 numbers, instead of Python strings and floats on every sample.
+On measurements of 1e7 samples the region column alone goes from hundreds of MB to 10 MB, and comparisons like
+data["region"] == "pulling" compare the codes instead of the strings.
+
+The stages of the analysis write the columns with these types. compact_frame() converts data read from exported files
+(CSV files, pickles of older versions) and plain_frame() converts them back to strings and floats.
+
+Example:
+    >>> from foldometer.tools.schema import compact_frame
+    >>> data = compact_frame(pd.read_csv("processed.csv"))
+"""
+
+from collections import OrderedDict as od
+from pandas.api.types import is_dtype_equal
+import pandas as pd
+import numpy as np
+
+
+#Regions of the data, "" being the data points not assigned yet. They are sorted as the strings were, so sorting and
+#the maximum of a group give the same results
+REGION_LABELS = ["", "pulling", "retracting", "stationary"]
+REGION_DTYPE = pd.CategoricalDtype(REGION_LABELS, ordered=True)
+#Type of each label column of the processed data
+FRAME_SCHEMA = od([("region", REGION_DTYPE),
+                   ("pullingCycle", np.dtype(np.int32)),
+                   ("wlcRegion", np.dtype(np.int32)),
+                   ("eventID", np.dtype(np.int32)),
+                   ("unfolding", np.dtype(bool))])
+
+
+def region_codes(regions):
+    """
+    Function to get the codes of the regions (position in REGION_LABELS)
+
+    Args:
+        regions (array-like): regions as strings or as a categorical column
+
+    Returns:
+        codes (numpy.ndarray): int8 code of each region, -1 for missing or unknown regions
+    """
+
+    return pd.Categorical(regions, dtype=REGION_DTYPE).codes
+
+
+def region_categorical(codes):
+    """
+    Function to get the regions from their codes
+
+    Args:
+        codes (array-like): code of each region, see region_codes()
+
+    Returns:
+        regions (pandas.Categorical): regions
+    """
+
+    return pd.Categorical.from_codes(np.asarray(codes, dtype=np.int8), dtype=REGION_DTYPE)
+
+
+def compact_frame(data):
+    """
+    Function to convert the label columns of the data to the types of FRAME_SCHEMA. Numbers with missing values are
+    kept as floats
+
+    Args:
+        data (pandas.DataFrame): processed data
+
+    Returns:
+        data (pandas.DataFrame): the same data with the converted columns
+    """
+
+    for column, dtype in FRAME_SCHEMA.items():
+        if column not in data.columns or is_dtype_equal(data[column].dtype, dtype):
+            continue
+        if isinstance(dtype, pd.CategoricalDtype):
+            data[column] = pd.Categorical(data[column], dtype=REGION_DTYPE)
+        elif data[column].notna().all():
+            data[column] = data[column].astype(dtype)
+
+    return data
+
+
+def plain_frame(data):
+    """
+    Function to convert the label columns of the data to the types of previous versions: strings for the regions and
+    floats for the numbers
+
+    Args:
+        data (pandas.DataFrame): processed data
+
+    Returns:
+        plainData (pandas.DataFrame): copy of the data with the converted columns
+    """
+
+    plainData = data.copy()
+    for column, dtype in FRAME_SCHEMA.items():
+        if column not in plainData.columns:
+            continue
+        if isinstance(dtype, pd.CategoricalDtype):
+            plainData[column] = np.asarray(plainData[column], dtype=object)
+        elif dtype.kind == "i":
+            plainData[column] = plainData[column].astype(float)
+
+    return plainData
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__doc__ = """\
+Selections of data described by rules instead of by mouse drags, so they can be stored (they are plain JSON) and
+applied again without a graphical interface, e.g. in batch pipelines. A rule keeps the data points with the values of
+a column in a range ("range" rules: time windows, pulling cycles, force ranges...) or in a list ("values" rules:
+regions...), or removes them if "exclude" is True. A selection is a list of rules: the data points kept are the ones
+kept by all of them.
+
+The interactive selections (foldometer.tools.misc.data_selection() and the select_data() and delete_data() methods of
+Folding) are recorded as range rules, so they can be exported with the analysis parameters and replayed.
+
+Example:
+    >>> from foldometer.tools.selection import time_window, cycle_range, region_rule, force_range, apply_selection
+    >>> selection = [time_window(12, 340), cycle_range(2, 9), region_rule("pulling"), force_range(maximum=40)]
+    >>> subData = apply_selection(data, selection)
+"""
+
+from collections import OrderedDict as od
+import numpy as np
+import json
+
+
+#Kinds of rules: the values of a column in a range (both ends included) or in a list
+RULE_KINDS = ["range", "values"]
+
+
+def _json_value(value):
+    """
+    Function to convert a value of a rule to a value that can be stored in JSON
+
+    Args:
+        value: value of a column
+
+    Returns:
+        jsonValue: the value as a str, int, float, bool or None
+    """
+
+    if isinstance(value, (np.integer, np.floating, np.bool_)):
+        return value.item()
+
+    return value
+
+
+def range_rule(column, minimum=None, maximum=None, exclude=False):
+    """
+    Function to create a rule selecting the data points with the values of a column in a range
+
+    Args:
+        column (str): column of the data
+        minimum (float): minimum value of the range (included). None for no minimum
+        maximum (float): maximum value of the range (included). None for no maximum
+        exclude (bool): if True, the data points in the range are removed instead. Default is False
+
+    Returns:
+        rule (dict): the rule
+    """
+
+    return od([("kind", "range"), ("column", column), ("minimum", _json_value(minimum)),
+               ("maximum", _json_value(maximum)), ("exclude", exclude)])
+
+
+def values_rule(column, values, exclude=False):
+    """
+    Function to create a rule selecting the data points with the values of a column in a list
+
+    Args:
+        column (str): column of the data
+        values: value or list of values
+        exclude (bool): if True, the data points with these values are removed instead. Default is False
+
+    Returns:
+        rule (dict): the rule
+    """
+
+    if isinstance(values, (str, int, float)):
+        values = [values]
+
+    return od([("kind", "values"), ("column", column), ("values", [_json_value(value) for value in values]),
+               ("exclude", exclude)])
+
+
+def time_window(start=None, end=None, exclude=False):
+    """
+    Function to create a rule selecting a time window, see range_rule()
+
+    Args:
+        start (float): first time of the window (s). None for the beginning of the data
+        end (float): last time of the window (s). None for the end of the data
+        exclude (bool): if True, the time window is removed instead. Default is False
+
+    Returns:
+        rule (dict): the rule
+    """
+
+    return range_rule("time", start, end, exclude)
+
+
+def cycle_range(first=None, last=None, exclude=False):
+    """
+    Function to create a rule selecting a range of pulling cycles, see range_rule()
+
+    Args:
+        first (int): first pulling cycle. None for the first cycle of the data
+        last (int): last pulling cycle (included). None for the last cycle of the data
+        exclude (bool): if True, the pulling cycles are removed instead. Default is False
+
+    Returns:
+        rule (dict): the rule
+    """
+
+    return range_rule("pullingCycle", first, last, exclude)
+
+
+def force_range(minimum=None, maximum=None, exclude=False, column="forceX"):
+    """
+    Function to create a rule selecting the data points with the force in a range, see range_rule()
+
+    Args:
+        minimum (float): minimum force (pN). None for no minimum
+        maximum (float): maximum force (pN). None for no maximum
+        exclude (bool): if True, the data points in the range are removed instead. Default is False
+        column (str): column of the force. Default is "forceX"
+
+    Returns:
+        rule (dict): the rule
+    """
+
+    return range_rule(column, minimum, maximum, exclude)
+
+
+def region_rule(regions, exclude=False):
+    """
+    Function to create a rule selecting one or more regions ("pulling", "retracting", "stationary"), see values_rule()
+
+    Args:
+        regions: region or list of regions
+        exclude (bool): if True, the regions are removed instead. Default is False
+
+    Returns:
+        rule (dict): the rule
+    """
+
+    return values_rule("region", regions, exclude)
+
+
+def exclusion(selection):
+    """
+    Function to turn the rules of a selection into rules removing the data points they select
+
+    Args:
+        selection (list): rules selecting the data points to remove
+
+    Returns:
+        selection (list): the same rules with "exclude" set to True
+    """
+
+    return [od(rule, exclude=True) for rule in selection]
+
+
+def rule_mask(data, rule):
+    """
+    Function to get the data points selected by a rule, regardless of its "exclude" value
+
+    Args:
+        data (pandas.DataFrame): data to select from
+        rule (dict): rule, see range_rule() and values_rule()
+
+    Returns:
+        mask (numpy.ndarray): True for the data points with the values of the column in the range or in the list
+    """
+
+    if rule["kind"] not in RULE_KINDS:
+        raise ValueError("Unknown kind of rule: " + str(rule["kind"]) + ". Choose from " + ", ".join(RULE_KINDS))
+    if rule["column"] not in data.columns:
+        raise ValueError("The column " + str(rule["column"]) + " of the selection is not in the data")
+
+    values = data[rule["column"]]
+    if rule["kind"] == "values":
+        return values.isin(rule["values"]).values
+
+    mask = np.ones(len(data), dtype=bool)
+    if rule.get("minimum") is not None:
+        mask &= (values >= rule["minimum"]).values
+    if rule.get("maximum") is not None:
+        mask &= (values <= rule["maximum"]).values
+
+    return mask
+
+
+def selection_mask(data, selection):
+    """
+    Function to get the data points kept by a selection: the ones selected by all its rules and not by any of its
+    excluding rules
+
+    Args:
+        data (pandas.DataFrame): data to select from
+        selection (list): rules, see range_rule() and values_rule(). An empty selection keeps all the data
+
+    Returns:
+        mask (numpy.ndarray): True for the data points kept
+    """
+
+    mask = np.ones(len(data), dtype=bool)
+    for rule in selection:
+        if rule.get("exclude", False):
+            mask &= ~rule_mask(data, rule)
+        else:
+            mask &= rule_mask(data, rule)
+
+    return mask
+
+
+def apply_selection(data, selection, view=False):
+    """
+    Function to select the data points kept by a selection, see selection_mask()
+
+    Args:
+        data (pandas.DataFrame): data to select from
+        selection (list): rules, see range_rule() and values_rule()
+        view (bool): if True and the selected rows are contiguous, return a slice sharing the memory of data instead
+            of a copy. Default is False
+
+    Returns:
+        subData (pandas.DataFrame): selected subset of the data
+    """
+
+    selectedRows = np.flatnonzero(selection_mask(data, selection))
+    if view and len(selectedRows) > 0 and selectedRows[-1] - selectedRows[0] + 1 == len(selectedRows):
+        return data.iloc[selectedRows[0]: selectedRows[-1] + 1]
+
+    return data.iloc[selectedRows]
+
+
+def load_selection(path):
+    """
+    Function to load a selection stored as JSON
+
+    Args:
+        path (str): path of the JSON file, with a list of rules or an object with a list of rules per measurement
+
+    Returns:
+        selection: list of rules, or dictionary with the list of rules of each measurement
+    """
+
+    with open(path) as f:
+        selection = json.load(f, object_pairs_hook=od)
+    rules = selection if isinstance(selection, list) else [rule for rules in selection.values() for rule in rules]
+    for rule in rules:
+        if rule.get("kind") not in RULE_KINDS or "column" not in rule:
+            raise ValueError("Invalid selection rule in " + path + ": " + json.dumps(rule))
+
+    return selection
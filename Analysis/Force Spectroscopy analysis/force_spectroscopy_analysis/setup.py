@@ -29,6 +29,7 @@ MODULES = ['foldometer.analysis.thermal_calibration',
            'foldometer.analysis.event_classification',
            'foldometer.analysis.sinusoidal_calibration',
            'foldometer.analysis.noise_reduction',
+           'foldometer.analysis.drift',
            'foldometer.analysis.wlc_curve_fit',
            'foldometer.analysis.threading',
            'foldometer.analysis.fluorescence',
@@ -37,7 +38,9 @@ MODULES = ['foldometer.analysis.thermal_calibration',
            'foldometer.ixo.binary',
            'foldometer.ixo.data_conversion',
            'foldometer.ixo.old_setup',
-           'foldometer.ixo.lumicks_c_trap'
+           'foldometer.ixo.lumicks_c_trap',
+           'foldometer.ixo.batch',
+           'foldometer.ixo.manifest',
 
             #Main classes
            'foldometer.core.main',
@@ -56,9 +59,15 @@ MODULES = ['foldometer.analysis.thermal_calibration',
            'foldometer.physics.polymer',
            #simulations
            'foldometer.simulate.trap',
+           'foldometer.simulate.measurement',
            #tools
            'foldometer.tools.maths',
-           'foldometer.tools.plots'
+           'foldometer.tools.plots',
+           'foldometer.tools.cache',
+           'foldometer.tools.profiling',
+           'foldometer.tools.lazy',
+           'foldometer.tools.schema',
+           'foldometer.tools.selection'
            ]
 
 setup(
@@ -130,5 +139,6 @@ data_files=[],
 # "scripts" keyword. Entry points provide cross-platform support and allow
 # pip to create the appropriate form of executable for the target platform.
 entry_points={
+'console_scripts': ['foldometer = foldometer.ixo.batch:main'],
 },
 )